@@ -1,4 +1,6 @@
 import os
 from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
-application = get_asgi_application()
\ No newline at end of file
+# 通过 ASGI 入口启动（gunicorn -k uvicorn.workers.UvicornWorker）时使用异步视图的路由
+os.environ.setdefault('WEB_SERVER_MODE', 'asgi')
+application = get_asgi_application()
@@ -0,0 +1,21 @@
+"""
+ASGI 模式（WEB_SERVER_MODE=asgi）的路由：I/O 密集的页面换成 volunteer.async_views 中的异步版本，
+其余路由与 project.urls 完全相同。
+
+/api/ 下的 DRF 接口保持同步，由 Django 放到线程里执行：DRF 3.15 没有异步视图；
+这些接口也没有要等待的外部服务，只查数据库，而 Django 4.2 的异步 ORM 同样是在线程里执行查询，
+改写成异步视图省不下线程，还要绕开 DRF 的认证、分页和渲染。
+活动列表的条件请求（304）和 JWT 认证本来就不查库，线程占用很短。
+"""
+from django.urls import path
+
+from volunteer import async_views
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('', async_views.login_view, name='login'),
+    path('login/', async_views.login_view, name='login'),
+    path('activities/', async_views.activity_list, name='activity_list'),
+    path('activities/<int:activity_id>/', async_views.activity_detail, name='activity_detail'),
+] + sync_urlpatterns
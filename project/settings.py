@@ -1,3 +1,4 @@
+from datetime import timedelta
 from pathlib import Path
 import os
 
@@ -44,9 +45,41 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        # 慢请求日志（每行一个 JSON），见 volunteer.middleware.RequestMetricsMiddleware
+        'volunteer.performance': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+        # Turnstile 核验失败和熔断，见 volunteer.turnstile
+        'volunteer.turnstile': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
 
+# 请求总耗时超过这个毫秒数时写慢请求日志
+SLOW_REQUEST_THRESHOLD_MS = int(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', 1000))
+# 是否在响应中附带 Server-Timing 头（SQL 条数/耗时、视图和模板耗时）。
+# 任何访问者（包括未登录的）都能看到这些内部信息，默认只在 DEBUG 时开启，线上排查时再显式设置 SERVER_TIMING_HEADER=True
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', str(DEBUG)) == 'True'
+
+# 夜间闭站时段（本地时间，可跨零点），留空表示全天开放；nginx 配置片段见 generate_nginx_closure
+SITE_CLOSED_WINDOW = os.environ.get('SITE_CLOSED_WINDOW', '23:00-07:00')
+
+# Cloudflare Turnstile 核验（长连接池、已验证 token 缓存、熔断），见 volunteer.turnstile
+TURNSTILE_VERIFY_URL = os.environ.get('TURNSTILE_VERIFY_URL', 'https://challenges.cloudflare.com/turnstile/v0/siteverify')
+TURNSTILE_TIMEOUT = float(os.environ.get('TURNSTILE_TIMEOUT', 2))
+# 每个进程同时进行的核验数：同步模式与 gunicorn --threads 一致，异步模式一个进程要承接所有并发登录
+TURNSTILE_POOL_SIZE = 32 if os.environ.get('WEB_SERVER_MODE') == 'asgi' else 4
+TURNSTILE_TOKEN_CACHE_SECONDS = 300
+# 连续失败这么多次后熔断，冷却期内按 TURNSTILE_FAIL_OPEN 放行（True）或拒绝（False）
+TURNSTILE_BREAKER_THRESHOLD = 5
+TURNSTILE_BREAKER_COOLDOWN = 30
+TURNSTILE_FAIL_OPEN = os.environ.get('TURNSTILE_FAIL_OPEN', 'True') == 'True'
+
 INSTALLED_APPS = [
     'jazzmin',
     'django.contrib.admin',
@@ -58,9 +91,11 @@ INSTALLED_APPS = [
     'volunteer.apps.VolunteerConfig',
     'ckeditor',
     'ckeditor_uploader',
+    'rest_framework',
 ]
 
 MIDDLEWARE = [
+    'volunteer.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'volunteer.middleware.TimeRestrictionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -71,11 +106,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'project.urls'
+# wsgi：gunicorn 同步线程；asgi：gunicorn + uvicorn worker，登录和活动页使用异步视图（见 project/asgi_urls.py）。
+# 通过 project.asgi 启动时自动为 asgi
+WEB_SERVER_MODE = os.environ.get('WEB_SERVER_MODE', 'wsgi')
+ROOT_URLCONF = 'project.asgi_urls' if WEB_SERVER_MODE == 'asgi' else 'project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # 在 Django 自带后端基础上统计模板渲染耗时
+        'BACKEND': 'volunteer.instrumentation.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -90,33 +129,79 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'project.wsgi.application'
+ASGI_APPLICATION = 'project.asgi.application'
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': os.environ.get('DB_NAME'),
-        'USER': os.environ.get('DB_USER'),
-        'PASSWORD': os.environ.get('DB_PASS'),
-        'HOST': os.environ.get('DB_HOST'),
-        'PORT': os.environ.get('DB_PORT'),
-        'ATOMIC_REQUESTS': True,
-        'CONN_MAX_AGE': 60,
-        'DISABLE_SERVER_SIDE_CURSORS': True,
-        'OPTIONS': {
-            'keepalives': 1,
-            'keepalives_idle': 30,
-            'keepalives_interval': 10,
-            'keepalives_count': 5,
-            'application_name': 'volunteer_platform',
-            'cursor_factory': None,
+if os.environ.get('DB_NAME'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME'),
+            'USER': os.environ.get('DB_USER'),
+            'PASSWORD': os.environ.get('DB_PASS'),
+            'HOST': os.environ.get('DB_HOST'),
+            'PORT': os.environ.get('DB_PORT'),
+            'ATOMIC_REQUESTS': True,
+            # ASGI 模式下每个请求的同步部分在新线程里执行，持久连接无法复用反而会堆积
+            'CONN_MAX_AGE': 0 if WEB_SERVER_MODE == 'asgi' else 60,
+            'DISABLE_SERVER_SIDE_CURSORS': True,
+            'OPTIONS': {
+                'keepalives': 1,
+                'keepalives_idle': 30,
+                'keepalives_interval': 10,
+                'keepalives_count': 5,
+                'application_name': 'volunteer_platform',
+                'cursor_factory': None,
+            }
+        }
+    }
+else:
+    # 本地开发：未设置 DB_NAME 时使用仓库里的 SQLite
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'ATOMIC_REQUESTS': True,
+            # 测试库使用文件而不是内存库，多线程并发测试需要真实的文件锁
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
         }
     }
+
+# 缓存：版本号必须在所有 gunicorn worker 之间共享，生产环境默认用文件缓存（同机多进程共享），
+# 可用 DJANGO_CACHE_BACKEND / DJANGO_CACHE_LOCATION 换成 Redis 等；本地开发与测试是单进程，用内存缓存即可
+if os.environ.get('DB_NAME'):
+    default_cache_backend = 'django.core.cache.backends.filebased.FileBasedCache'
+    default_cache_location = str(BASE_DIR / 'cache')
+else:
+    default_cache_backend = 'django.core.cache.backends.locmem.LocMemCache'
+    default_cache_location = 'volunteer'
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', default_cache_backend),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', default_cache_location),
+    },
+    # 登录 session 单独一个缓存（SESSION_STORE=cached_db 时使用）：条目数随登录人数增长，
+    # 不能和页面缓存一起按默认的 300 条淘汰。换成 Redis 等时同时设置 DJANGO_SESSION_CACHE_LOCATION。
+    # 只有文件缓存时不用它（见下面的 SESSION_STORE）
+    'sessions': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', default_cache_backend),
+        'LOCATION': os.environ.get(
+            'DJANGO_SESSION_CACHE_LOCATION',
+            str(BASE_DIR / 'cache' / 'sessions') if os.environ.get('DB_NAME') else 'volunteer-sessions',
+        ),
+        'TIMEOUT': 60 * 60 * 24 * 30,
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
 }
+# 公告、活动列表等缓存数据的过期时间（秒）；数据变更时会通过版本号立即失效
+VOLUNTEER_CACHE_TIMEOUT = int(os.environ.get('VOLUNTEER_CACHE_TIMEOUT', 600))
 
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
 ]
 
+# 批量导入账号时计算密码哈希的进程数，默认等于 CPU 核数
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0)) or None
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -136,6 +221,23 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / "media"
 CKEDITOR_UPLOAD_PATH = "uploads/"
+# 上传图片去元数据、生成多尺寸和 WebP/AVIF，存为带内容摘要的文件名（见 volunteer.images）
+CKEDITOR_IMAGE_BACKEND = 'volunteer.images.OptimizedImageBackend'
+IMAGE_VARIANT_WIDTHS = [480, 960, 1600]
+# 按优先顺序；Pillow 不支持的格式自动跳过
+IMAGE_VARIANT_FORMATS = ['avif', 'webp']
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 80))
+# reprocess_images 的进程数，默认等于 CPU 核数
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 0)) or None
+
+# 后台导入任务的上传文件（含初始密码），放在 MEDIA_ROOT 之外
+IMPORT_JOBS_ROOT = BASE_DIR / "import_jobs"
+# 导入任务处理中超过这个时间没有心跳，视为 worker 已退出，可被重新领取
+IMPORT_JOB_STALE_SECONDS = 600
+# 处理中的任务每隔这么久刷新一次心跳（updated_at），须明显小于 IMPORT_JOB_STALE_SECONDS
+IMPORT_JOB_HEARTBEAT_SECONDS = 60
+# 导入 worker 刷新排行榜快照的间隔（秒）
+LEADERBOARD_REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 600))
 
 CKEDITOR_CONFIGS = {
     'default': {
@@ -156,6 +258,36 @@ SESSION_COOKIE_NAME = 'volunteer_sessionid'
 SESSION_COOKIE_SECURE = True
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SAMESITE = 'Lax'
+# session 存储：cached_db（先读缓存、写入时同时写库）、db（每个请求都查库）、
+# signed_cookies（数据签名后放在 cookie 里，不查库），见 volunteer.login_sessions。
+# 文件缓存每次写入都要列出并统计整个缓存目录（判断是否超过 MAX_ENTRIES），几万个 session 时一次写入要近百毫秒，
+# 比按主键读写一次 django_session（约 1ms）慢得多，所以共享缓存只有文件缓存时默认 db，内存缓存或 Redis 时默认 cached_db
+SESSION_STORE = os.environ.get(
+    'SESSION_STORE', 'db' if CACHES['sessions']['BACKEND'].endswith('.FileBasedCache') else 'cached_db',
+)
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + SESSION_STORE
+SESSION_CACHE_ALIAS = 'sessions'
+# 导入 worker 清理过期 session 的间隔（秒）
+SESSION_PRUNE_SECONDS = int(os.environ.get('SESSION_PRUNE_SECONDS', 3600))
+
+# 前端 React 应用使用的 API（/api/），JWT 认证，见 volunteer.api_auth
+REST_FRAMEWORK = {
+    # 直接用 token 里的 claims 构造用户，认证不查库
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework_simplejwt.authentication.JWTStatelessUserAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ] + (['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
+}
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=int(os.environ.get('JWT_ACCESS_MINUTES', 30))),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=int(os.environ.get('JWT_REFRESH_DAYS', 7))),
+    # 默认与 SECRET_KEY 相同；需要让所有已签发的 token 立即失效时单独设置并轮换
+    'SIGNING_KEY': os.environ.get('JWT_SIGNING_KEY', SECRET_KEY),
+    'TOKEN_OBTAIN_SERIALIZER': 'volunteer.api_auth.VolunteerTokenObtainPairSerializer',
+    'TOKEN_USER_CLASS': 'volunteer.api_auth.VolunteerTokenUser',
+}
 
 JAZZMIN_SETTINGS = {
     "site_title": "志愿者社团管理",
@@ -1,13 +1,20 @@
 from django.contrib import admin
+from django.contrib.admin.views.decorators import staff_member_required
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from django.views.decorators.csrf import csrf_exempt
+
+from volunteer import images
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('volunteer.urls')),
+    # 前端 React 应用的 JSON API（JWT 认证）
+    path('api/', include('volunteer.api_urls')),
     
-    # 修复富文本：添加 ckeditor 的路由
+    # 修复富文本：添加 ckeditor 的路由；图片上传先经过 images.upload_view，拒绝像素数超限的图片
+    path('ckeditor/upload/', staff_member_required(csrf_exempt(images.upload_view)), name='ckeditor_upload'),
     path('ckeditor/', include('ckeditor_uploader.urls')),
 ]
 
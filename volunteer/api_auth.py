@@ -0,0 +1,62 @@
+"""
+API 的 JWT 认证。
+
+签发 token 时把学号、姓名、志愿者档案 id 和年级、班级写进 claims（refresh 换出的 access token 会原样带上），
+认证时用 JWTStatelessUserAuthentication 直接从已验签的 claims 构造 VolunteerTokenUser，
+每个 API 请求不再为 request.user 查一次 User 表、再查一次 VolunteerProfile（见 profile_claims）。
+代价是 token 有效期内改名、调班、停用账号不会立即生效：重新登录后才会更新，
+需要立即踢下线时轮换 SIGNING_KEY（见 settings.SIMPLE_JWT）。
+"""
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+from .models import VolunteerProfile
+
+PROFILE_CLAIMS = ('profile_id', 'grade_id', 'class_name')
+
+
+class VolunteerTokenUser(TokenUser):
+    """由 token claims 构造的用户，不对应数据库里的行；没有志愿者档案的账号（管理员）profile_id 为 None。"""
+
+    @cached_property
+    def username(self):
+        return self.token.get('username', '')
+
+    @cached_property
+    def student_id(self):
+        return self.token.get('student_id')
+
+    @cached_property
+    def first_name(self):
+        return self.token.get('name', '')
+
+    @cached_property
+    def profile_id(self):
+        return self.token.get('profile_id')
+
+
+class VolunteerTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        profile = VolunteerProfile.objects.filter(user=user).values_list('pk', 'student_id', 'grade_id', 'class_name').first()
+        token['username'] = user.username
+        token['name'] = user.first_name
+        token['profile_id'], token['student_id'], token['grade_id'], token['class_name'] = profile or (None, None, None, None)
+        if user.is_staff:
+            token['is_staff'] = True
+        return token
+
+
+def profile_claims(request):
+    """
+    当前用户的 (档案 id, 年级 id, 班级)，没有档案时全为 None。
+    JWT 认证时直接取 token 里的 claims，不查库；
+    force_authenticate 传入的 User 或缺少这些 claims 的旧 token 才查一次档案。
+    """
+    token = request.auth
+    if token is not None and all(claim in token for claim in PROFILE_CLAIMS):
+        return tuple(token[claim] for claim in PROFILE_CLAIMS)
+    profile = VolunteerProfile.objects.filter(user_id=request.user.pk).values_list('pk', 'grade_id', 'class_name').first()
+    return profile or (None, None, None)
@@ -20,4 +20,7 @@ urlpatterns = [
     
     # 获取当前登录用户的个人资料
     path('profile/', api_views.CurrentUserProfileView.as_view(), name='api_my_profile'),
+
+    # 经验值排行榜（全校/年级/班级）及当前用户排名
+    path('leaderboard/', api_views.LeaderboardView.as_view(), name='api_leaderboard'),
 ]
\ No newline at end of file
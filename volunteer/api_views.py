@@ -1,17 +1,68 @@
+import hashlib
+
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView, RetrieveAPIView
+from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from .models import Activity
-from .serializers import ActivitySerializer, UserSerializer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from . import caching, leaderboard
+from .api_auth import profile_claims
+from .models import Activity, VolunteerProfile
+from .serializers import ActivityListSerializer, RankSnapshotSerializer, UserSerializer
+
+
+class ActivityCursorPagination(CursorPagination):
+    # 按主键倒序翻页，走 (status, -id) 索引；新活动插入不会让后面的页错位
+    ordering = '-id'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
 
 class ActivityListView(ListAPIView):
     """
     提供所有“报名中”的活动列表。
     这个接口允许任何人访问。
+    游标分页（?cursor=），?fields=id,title 只返回需要的字段；列表里只有正文的纯文本摘要（excerpt）。
+    ETag / Last-Modified 取自活动缓存命名空间的版本号，活动没有变化时带 If-None-Match 轮询直接返回 304，不查库。
     """
-    queryset = Activity.objects.filter(status="报名中").order_by('-id')
-    serializer_class = ActivitySerializer
+    queryset = Activity.objects.filter(status="报名中")
+    serializer_class = ActivityListSerializer
+    pagination_class = ActivityCursorPagination
     permission_classes = [AllowAny]
 
+    def get_queryset(self):
+        fields = ActivityListSerializer.requested_fields(self.request, ActivityListSerializer.Meta.fields)
+        queryset = super().get_queryset().defer(*Activity.HEAVY_FIELDS)
+        if fields and 'excerpt' not in fields:
+            queryset = queryset.defer('description_excerpt')
+        if not fields or 'grade_restriction' in fields:
+            queryset = queryset.prefetch_related('grade_restriction')
+        return queryset
+
+    def get_etag(self, request):
+        # 同一版本下，不同的游标、字段和输出格式是不同的表示
+        version = caching.get_version(caching.ACTIVITIES)
+        key = f'{version}:{request.accepted_renderer.format}:{request.get_full_path()}'
+        return quote_etag(hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        last_modified = caching.last_modified(caching.ACTIVITIES)
+        response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # 允许客户端缓存，但每次使用前都要带条件请求确认
+        patch_cache_control(response, no_cache=True)
+        return response
+
 class CurrentUserProfileView(RetrieveAPIView):
     """
     提供当前登录用户的详细信息（包括志愿者档案）。
@@ -21,5 +72,42 @@ class CurrentUserProfileView(RetrieveAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        # 直接返回当前通过JWT认证的用户
-        return self.request.user
\ No newline at end of file
+        # request.user 只是 token 里的 claims，按 claims 里的档案 id 用一条 select_related 查出用户、档案和年级
+        profile_id = profile_claims(self.request)[0]
+        if profile_id is None:
+            raise Http404
+        return get_object_or_404(VolunteerProfile.objects.select_related('user', 'grade'), pk=profile_id).user
+
+def _query_id(request, name):
+    """查询参数里的数据库 id；不是正整数时返回 400，不能原样带进 filter() 里报 500。"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    if not (value.isascii() and value.isdigit()) or not 0 < int(value) < 2 ** 63:
+        raise ValidationError({name: f"{name} 必须是正整数。"})
+    return int(value)
+
+
+class LeaderboardView(APIView):
+    """
+    经验值排行榜：?scope=school|grade|class，年级榜/班级榜默认为当前用户所在的年级/班级，
+    也可以用 ?grade=<年级 id> 或 ?class_name=<班级> 指定。同时返回当前用户的排名和段位分布。
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        # 当前用户的档案 id、年级和班级都在 token 里，不查档案表
+        profile_id, my_grade_id, my_class_name = profile_claims(request)
+        scope = request.query_params.get('scope', 'school')
+        if scope not in leaderboard.SCOPES:
+            scope = 'school'
+        grade_id = _query_id(request, 'grade') or my_grade_id
+        class_name = request.query_params.get('class_name') or my_class_name
+        entries = leaderboard.top_entries(scope, grade_id=grade_id, class_name=class_name)
+        me = leaderboard.my_rank(profile_id) if profile_id else None
+        return Response({
+            'scope': scope,
+            'results': RankSnapshotSerializer(entries, many=True).data,
+            'me': RankSnapshotSerializer(me).data if me else None,
+            'tiers': [{'name': name, 'count': count, 'percent': percent} for name, count, percent in leaderboard.tier_distribution()],
+        })
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 class VolunteerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'volunteer'
-    verbose_name = "志愿者核心管理"
\ No newline at end of file
+    verbose_name = "志愿者核心管理"
+
+    def ready(self):
+        from . import signals  # noqa: F401
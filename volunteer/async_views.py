@@ -0,0 +1,60 @@
+"""
+ASGI 模式（WEB_SERVER_MODE=asgi，uvicorn worker）下的异步视图，由 project/asgi_urls.py 替换同名的同步视图。
+
+I/O 等待不再占着请求线程：
+  - 登录：Turnstile 核验用 await 等待，期间既不占用请求线程也不占用数据库连接；
+  - 活动列表/详情：学生档案、活动用异步 ORM 查询，表单、报名占座和模板渲染等同步部分
+    交给 views 里与同步视图共用的函数，通过 sync_to_async 执行，业务逻辑只有一份。
+Django 4.2 的异步视图不能使用 ATOMIC_REQUESTS，这里的视图都标记为 non_atomic_requests：
+登录只更新一次 last_login，报名占座本来就在 reserve_seat 里使用自己的短事务。
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.db import transaction
+from django.http import Http404
+
+from . import eligibility, turnstile, views
+from .models import VolunteerProfile
+
+
+def login_required(view):
+    """异步版 login_required（Django 4.2 自带的只支持同步视图）。"""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # request.user 首次访问要查 session 和用户表
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def aget_or_404(queryset, **kwargs):
+    obj = await queryset.filter(**kwargs).afirst()
+    if obj is None:
+        raise Http404
+    return obj
+
+
+@transaction.non_atomic_requests
+async def login_view(request):
+    token = views.turnstile_token(request)
+    if token and not await turnstile.averify(views.turnstile_keys()[1], token, views.get_client_ip(request)):
+        return await sync_to_async(views.turnstile_failed)(request)
+    return await sync_to_async(views.login_flow)(request)
+
+
+@transaction.non_atomic_requests
+@login_required
+async def activity_list(request):
+    profile = await VolunteerProfile.objects.filter(user=request.user).afirst()
+    return await sync_to_async(views.activity_list_response)(request, profile)
+
+
+@transaction.non_atomic_requests
+@login_required
+async def activity_detail(request, activity_id):
+    profile = await aget_or_404(VolunteerProfile.objects.all(), user=request.user)
+    activity = await aget_or_404(eligibility.annotate_eligibility(views.detail_queryset(), profile), pk=activity_id)
+    return await sync_to_async(views.activity_detail_response)(request, profile, activity)
@@ -0,0 +1,234 @@
+"""
+性能基准。
+
+对 seed_load_data 生成的数据依次请求主要页面、API 和后台导入导出，记录每个场景的
+SQL 条数和耗时（多次运行取中位数），结果可保存为 JSON，下次运行时与之对比，
+查询数变多或耗时明显变长都会列为退化。
+所有场景在一个最终回滚的事务里执行，不会在数据库里留下任何数据（包括登录 session）。
+"""
+import statistics
+import time
+
+import pandas as pd
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .exports import export_registrations_to_csv, export_registrations_to_excel
+from .imports import credit_activity_hours, import_students
+from .models import Activity, Registration, VolunteerProfile
+
+# 耗时超过基线的这个比例才算退化，避免机器抖动误报
+TIME_TOLERANCE = 0.25
+BENCH_ADMIN = 'bench_admin'
+IMPORT_ROWS = 500
+
+
+class BenchmarkResult:
+    def __init__(self, name, queries, times, status=None):
+        self.name = name
+        self.queries = queries
+        self.times = times
+        self.status = status
+
+    @property
+    def median_ms(self):
+        return statistics.median(self.times) * 1000
+
+    def as_dict(self):
+        return {'queries': self.queries, 'median_ms': round(self.median_ms, 2), 'status': self.status}
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _consume(response):
+    # 流式响应要把内容读完，导出的 SQL 才会真正执行
+    if getattr(response, 'streaming', False):
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def _get(client, url):
+    def run():
+        return _consume(client.get(url)).status_code
+    return run
+
+
+def _api(url, user=None):
+    from .api_auth import VolunteerTokenObtainPairSerializer
+
+    # 与前端一样不带 session cookie，只带 Bearer token，走完整的中间件和 JWT 认证
+    headers = {'HTTP_ACCEPT': 'application/json'}
+    if user is not None:
+        token = VolunteerTokenObtainPairSerializer.get_token(user).access_token
+        headers['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    client = Client()
+
+    def run():
+        return client.get(url, **headers).status_code
+    return run
+
+
+def _in_savepoint(func):
+    """导入类场景会写库，每次运行后回滚到运行前的状态，保证多次运行的结果可比。"""
+    def run():
+        try:
+            with transaction.atomic():
+                func()
+                raise _Rollback
+        except _Rollback:
+            pass
+    return run
+
+
+def build_scenarios(client, admin_client, student, activity):
+    """返回 [(场景名, 无参函数)]，函数返回 HTTP 状态码（非请求类场景返回 None）。"""
+    scenarios = [
+        ('activity_list', _get(client, reverse('activity_list'))),
+        ('activity_list_search', _get(client, reverse('activity_list') + '?q=志愿')),
+        ('activity_detail', _get(client, reverse('activity_detail', args=[activity.pk]))),
+        ('my_profile', _get(client, reverse('my_profile'))),
+        ('message_wall', _get(client, reverse('message_wall'))),
+        ('message_wall_feed', _get(client, reverse('message_wall_feed'))),
+        ('leaderboard', _get(client, reverse('leaderboard'))),
+        ('admin_registration_changelist', _get(admin_client, reverse('admin:volunteer_registration_changelist'))),
+        ('admin_profile_changelist', _get(admin_client, reverse('admin:volunteer_volunteerprofile_changelist'))),
+        ('admin_user_changelist', _get(admin_client, reverse('admin:auth_user_changelist'))),
+        ('admin_activity_changelist', _get(admin_client, reverse('admin:volunteer_activity_changelist'))),
+    ]
+    scenarios += [
+        ('api_activity_list', _api(reverse('api_activity_list'))),
+        ('api_my_profile', _api(reverse('api_my_profile'), user=student.user)),
+        ('api_leaderboard', _api(reverse('api_leaderboard'), user=student.user)),
+    ]
+
+    registrations = Registration.objects.filter(activity=activity)
+    scenarios += [
+        ('export_excel', lambda: _consume(export_registrations_to_excel(registrations)).status_code),
+        ('export_csv', lambda: _consume(export_registrations_to_csv(registrations)).status_code),
+    ]
+
+    profiles = list(VolunteerProfile.objects.select_related('user').order_by('pk')[:IMPORT_ROWS])
+    students_df = pd.DataFrame(
+        [[p.student_id, p.user.first_name, '', p.gender, p.class_name or ''] for p in profiles],
+        columns=['学号', '姓名', '初始密码', '性别', '班级'],
+    )
+    hours_df = pd.DataFrame(
+        [[student_id, 2] for student_id in registrations.values_list('student__student_id', flat=True)[:IMPORT_ROWS]],
+        columns=['学号', '服务时长'],
+    )
+    scenarios += [
+        ('import_students', _in_savepoint(lambda: import_students(students_df.copy()))),
+        ('import_hours', _in_savepoint(lambda: credit_activity_hours(activity, hours_df.copy()))),
+    ]
+    return scenarios
+
+
+def measure(name, func, repeat=5):
+    """先预热一次，再运行 repeat 次；SQL 条数取最后一次，耗时取全部。"""
+    status = func()
+    times = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            status = func()
+            times.append(time.perf_counter() - start)
+    return BenchmarkResult(name, len(queries), times, status)
+
+
+def pick_subjects():
+    """报名记录最多的学生和报名中活动里报名人数最多的一个，作为最重的页面来测。"""
+    student = (VolunteerProfile.objects.select_related('user')
+               .annotate(n=Count('registration')).order_by('-n', 'pk').first())
+    activity = (Activity.objects.filter(status='报名中').order_by('-approved_count', '-pending_count', 'pk').first()
+                or Activity.objects.order_by('-approved_count', 'pk').first())
+    if student is None or activity is None:
+        raise ValueError("数据库里没有志愿者或活动，请先运行 seed_load_data")
+    return student, activity
+
+
+@modify_settings(MIDDLEWARE={'remove': ['volunteer.middleware.TimeRestrictionMiddleware']})
+@override_settings(ALLOWED_HOSTS=['testserver'])
+def run_benchmarks(repeat=5, only=None, progress=None):
+    """运行全部（或 only 中列出的）场景，返回 BenchmarkResult 列表。"""
+    results = []
+    try:
+        with transaction.atomic():
+            student, activity = pick_subjects()
+            admin = User.objects.create_superuser(BENCH_ADMIN, password=None)
+            client, admin_client = Client(), Client()
+            client.force_login(student.user)
+            admin_client.force_login(admin)
+            for name, func in build_scenarios(client, admin_client, student, activity):
+                if only and name not in only:
+                    continue
+                result = measure(name, func, repeat=repeat)
+                results.append(result)
+                if progress:
+                    progress(result)
+            raise _Rollback
+    except _Rollback:
+        pass
+    return results
+
+
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+
+@modify_settings(MIDDLEWARE={'remove': ['volunteer.middleware.TimeRestrictionMiddleware']})
+@override_settings(ALLOWED_HOSTS=['testserver'])
+def run_session_benchmarks(repeat=20, engines=tuple(SESSION_ENGINES)):
+    """
+    已登录学生用不同的 session 引擎反复打开个人主页，返回
+    [(引擎, 每个请求的 django_session 查询数, 每个请求的总查询数, 中位耗时 ms)]。
+    """
+    rows = []
+    url = reverse('my_profile')
+    try:
+        with transaction.atomic():
+            student, _ = pick_subjects()
+            for name in engines:
+                with override_settings(SESSION_ENGINE=SESSION_ENGINES[name]):
+                    client = Client()
+                    client.force_login(student.user)
+                    client.get(url)
+                    session_queries = total_queries = 0
+                    times = []
+                    for _ in range(repeat):
+                        with CaptureQueriesContext(connection) as queries:
+                            start = time.perf_counter()
+                            client.get(url)
+                            times.append(time.perf_counter() - start)
+                        total_queries += len(queries)
+                        session_queries += sum('django_session' in q['sql'] for q in queries.captured_queries)
+                    # 同时删掉缓存里的 session，数据库里的随事务回滚
+                    client.logout()
+                rows.append((name, session_queries / repeat, total_queries / repeat, statistics.median(times) * 1000))
+            raise _Rollback
+    except _Rollback:
+        pass
+    return rows
+
+
+def compare(results, baseline, tolerance=TIME_TOLERANCE):
+    """与基线 {场景名: {'queries':, 'median_ms':}} 对比，返回退化描述列表。"""
+    regressions = []
+    for result in results:
+        base = baseline.get(result.name)
+        if not base:
+            continue
+        if result.queries > base['queries']:
+            regressions.append(f"{result.name}: SQL {base['queries']} -> {result.queries}")
+        if result.median_ms > base['median_ms'] * (1 + tolerance):
+            regressions.append(f"{result.name}: 耗时 {base['median_ms']:.1f}ms -> {result.median_ms:.1f}ms")
+    return regressions
@@ -0,0 +1,94 @@
+"""
+前台列表缓存。
+
+公告和"正在招募"的活动一周才变几次，却每天被读取几千次。这里把它们的查询结果和
+渲染好的模板片段放进 Django 缓存，并按"命名空间版本号"失效：
+  - 每个命名空间（activities、announcements）在缓存里存一个版本号，数据和片段的键都带上版本号；
+  - 相关模型保存/删除时（见 signals.py）换一个新的随机版本号，旧键自然不再被读取，等过期即可；
+  - 版本号存在共享缓存里，所以 4 个 gunicorn worker 和导入 worker 看到的是同一个版本。
+    生产环境默认使用文件缓存（同一台机器上的进程共享），也可以通过 DJANGO_CACHE_BACKEND 换成 Redis 等。
+版本号在事务提交后才更新，避免其他请求在提交前读到旧数据、再以新版本号缓存下来。
+换版本号时同时记下时间，API 用版本号和这个时间生成 ETag / Last-Modified（见 api_views.ActivityListView）。
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+ACTIVITIES = 'activities'
+ANNOUNCEMENTS = 'announcements'
+
+
+def timeout():
+    return getattr(settings, 'VOLUNTEER_CACHE_TIMEOUT', 600)
+
+
+def _version_key(namespace):
+    return f'volunteer:version:{namespace}'
+
+
+def _new_version():
+    # 用随机值而不是自增：版本键被淘汰后重新生成也不会与旧版本号重复
+    return uuid.uuid4().hex[:12]
+
+
+def get_version(namespace):
+    version = cache.get(_version_key(namespace))
+    if version is None:
+        cache.add(_version_key(namespace), _new_version(), timeout=None)
+        version = cache.get(_version_key(namespace))
+    return version
+
+
+def _modified_key(namespace):
+    return f'volunteer:modified:{namespace}'
+
+
+def last_modified(namespace):
+    """命名空间最近一次失效的时间戳（秒）；还没有记录时从现在算起。"""
+    value = cache.get(_modified_key(namespace))
+    if value is None:
+        cache.add(_modified_key(namespace), int(time.time()), timeout=None)
+        value = cache.get(_modified_key(namespace))
+    return value
+
+
+def get_versions(*namespaces):
+    return {namespace: get_version(namespace) for namespace in namespaces}
+
+
+def invalidate(*namespaces):
+    """事务提交后为这些命名空间换新版本号；不在事务中时立即执行。"""
+    def bump():
+        now = int(time.time())
+        values = {}
+        for namespace in namespaces:
+            values[_version_key(namespace)] = _new_version()
+            values[_modified_key(namespace)] = now
+        cache.set_many(values, timeout=None)
+    transaction.on_commit(bump)
+
+
+def cached(namespace, name, builder):
+    """读取 namespace 当前版本下名为 name 的缓存数据，没有时调用 builder() 生成并写入。"""
+    key = f'volunteer:{namespace}:{get_version(namespace)}:{name}'
+    value = cache.get(key)
+    if value is None:
+        value = builder()
+        cache.set(key, value, timeout())
+    return value
+
+
+def latest_announcements(limit=3):
+    from .models import Announcement
+
+    return cached(ANNOUNCEMENTS, f'latest:{limit}', lambda: list(Announcement.objects.order_by('-created_at')[:limit]))
+
+
+def open_activities():
+    from .models import Activity
+
+    # 列表卡片只用到摘要，正文等大字段不查也不进缓存
+    return cached(ACTIVITIES, 'open', lambda: list(Activity.objects.filter(status="报名中").defer(*Activity.HEAVY_FIELDS).order_by('-id')))
@@ -0,0 +1,157 @@
+"""
+夜间闭站。
+
+闭站时段由 settings.SITE_CLOSED_WINDOW 配置（如 "23:00-07:00"，可跨零点，留空表示不闭站）。
+TimeRestrictionMiddleware 在闭站时段直接返回休息页：
+  - 休息页每个进程只渲染一次，之后返回缓存的字节串，不再每个请求都走模板引擎；
+  - 带 Retry-After 头（距离开站的秒数），爬虫和自动刷新的客户端可以按它推迟重试。
+还可以运行 generate_nginx_closure 生成 nginx 配置片段，由 nginx 在闭站时段直接返回同一个休息页，
+请求根本不会转发到 gunicorn。
+"""
+import datetime
+import functools
+import math
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def _parse_time(value):
+    hour, minute = value.strip().split(':')
+    return datetime.time(int(hour), int(minute))
+
+
+def window():
+    """(闭站时间, 开站时间)，没有配置闭站时段时返回 None。"""
+    value = getattr(settings, 'SITE_CLOSED_WINDOW', '')
+    if not value:
+        return None
+    start, end = (_parse_time(part) for part in value.split('-'))
+    if start == end:
+        return None
+    return start, end
+
+
+def is_closed(now, closed_window):
+    """now 为本地时间（datetime.time）。"""
+    start, end = closed_window
+    if start < end:
+        return start <= now < end
+    # 跨零点，如 23:00-07:00
+    return now >= start or now < end
+
+
+def seconds_until_open(now, closed_window):
+    """now 为本地时区的 datetime，返回距离下一次开站的秒数（向上取整）。"""
+    end = closed_window[1]
+    reopen = now.replace(hour=end.hour, minute=end.minute, second=0, microsecond=0)
+    if reopen <= now:
+        reopen += datetime.timedelta(days=1)
+    return math.ceil((reopen - now).total_seconds())
+
+
+@functools.lru_cache(maxsize=None)
+def sleeping_page(closed_window):
+    """渲染好的休息页（UTF-8 字节串），每个进程每种闭站时段只渲染一次。"""
+    start, end = closed_window
+    return render_to_string('volunteer/sleeping.html', {'closes_at': start, 'opens_at': end}).encode()
+
+
+# ---------------------------------------------------------------- nginx 配置片段
+
+NGINX_SNIPPET_DIR = '/etc/nginx/snippets'
+NGINX_PAGE_NAME = 'sleeping.html'
+NGINX_MAPS_NAME = 'site_closed.maps.conf'
+NGINX_SERVER_NAME = 'site_closed.server.conf'
+NGINX_PAGE_URI = '/_site_closed.html'
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def parse_utc_offset(value):
+    """"+08:00" / "-05:30" / "0" -> 分钟数。"""
+    value = value.strip()
+    sign = -1 if value.startswith('-') else 1
+    hours, _, minutes = value.lstrip('+-').partition(':')
+    return sign * (int(hours) * 60 + int(minutes or 0))
+
+
+def closed_minutes(closed_window):
+    """闭站时段内的每一分钟（本地时间，从零点起的分钟数），以及该分钟开始时距离开站的秒数。"""
+    start, end = (_minutes(value) for value in closed_window)
+    length = (end - start) % MINUTES_PER_DAY
+    for offset in range(length):
+        yield (start + offset) % MINUTES_PER_DAY, (length - offset) * 60
+
+
+def nginx_snippets(closed_window, nginx_utc_offset=0, local_utc_offset=None):
+    """
+    生成 nginx 配置片段，返回 {文件名: 内容}。
+    nginx 按它自己所在时区的 $time_iso8601 判断是否闭站（nginx:alpine 镜像默认 UTC），
+    所以闭站时段要从 settings.TIME_ZONE 换算过去；local_utc_offset 缺省时取当前的本地 UTC 偏移。
+    """
+    if local_utc_offset is None:
+        local_utc_offset = int(timezone.localtime().utcoffset().total_seconds() // 60)
+    shift = nginx_utc_offset - local_utc_offset
+    start, end = closed_window
+    retry_lines = '\n'.join(
+        f'    "{(minute + shift) % MINUTES_PER_DAY // 60:02d}:{(minute + shift) % MINUTES_PER_DAY % 60:02d}" {seconds};'
+        for minute, seconds in closed_minutes(closed_window)
+    )
+    header = (
+        '# 由 python manage.py generate_nginx_closure 生成，请勿手工修改\n'
+        f'# 闭站时段 {start:%H:%M}-{end:%H:%M}（{settings.TIME_ZONE}），'
+        f'已换算为 nginx 所在时区 UTC{"-" if nginx_utc_offset < 0 else "+"}'
+        f'{abs(nginx_utc_offset) // 60:02d}:{abs(nginx_utc_offset) % 60:02d}\n'
+    )
+    maps = header + f"""
+map $time_iso8601 $volunteer_nginx_hhmm {{
+    "~T(?<hhmm>\\d\\d:\\d\\d)" $hhmm;
+}}
+
+# 闭站时段内每一分钟距离开站的秒数，开站时段为空
+map $volunteer_nginx_hhmm $volunteer_retry_after {{
+    default "";
+{retry_lines}
+}}
+
+# 静态文件和上传文件照常放行（休息页要用到样式表）；
+# 休息页本身也要放行，否则 error_page 内部跳转过去时又命中 server 级的 return 503。
+# map 的结果默认在整个请求内缓存，内部跳转后不会按新的 $uri 重算，所以这两个 map 标为 volatile
+map $uri $volunteer_closable {{
+    volatile;
+    default 1;
+    {NGINX_PAGE_URI} 0;
+    "~^{settings.STATIC_URL}" 0;
+    "~^{settings.MEDIA_URL}" 0;
+}}
+
+map "$volunteer_closable:$volunteer_retry_after" $volunteer_site_closed {{
+    volatile;
+    default 1;
+    "~^0:" 0;
+    "1:" 0;
+}}
+"""
+    server = header + f"""
+if ($volunteer_site_closed) {{
+    return 503;
+}}
+
+error_page 503 {NGINX_PAGE_URI};
+
+location = {NGINX_PAGE_URI} {{
+    internal;
+    alias {NGINX_SNIPPET_DIR}/{NGINX_PAGE_NAME};
+    default_type text/html;
+    charset utf-8;
+    add_header Retry-After $volunteer_retry_after always;
+    add_header Cache-Control "no-store" always;
+}}
+"""
+    return {NGINX_MAPS_NAME: maps, NGINX_SERVER_NAME: server}
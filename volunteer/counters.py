@@ -0,0 +1,146 @@
+"""
+报名人数计数器维护。
+
+Activity / ActivitySession 上的 approved_count、pending_count 是冗余字段，
+列表页直接读取这些列，而不是每行都跑一次 COUNT(*)。
+所有改变报名状态的路径都必须经过这里，保证计数与 Registration 表一致。
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from . import caching
+
+# 报名状态 -> 计数字段 (Rejected 不计入任何名额)
+COUNTER_FIELDS = {
+    'Approved': 'approved_count',
+    'Pending': 'pending_count',
+}
+
+
+def counter_key(registration):
+    """返回一条报名记录在计数器中的"位置"。"""
+    return (registration.activity_id, registration.session_id, registration.status)
+
+
+def collect_deltas(deltas, key, sign):
+    """把一条报名记录 (key) 的 +1/-1 累加到 deltas 中。"""
+    if key is None:
+        return
+    activity_id, session_id, status = key
+    field = COUNTER_FIELDS.get(status)
+    if field is None:
+        return
+    deltas[('activity', activity_id)][field] += sign
+    if session_id is not None:
+        deltas[('session', session_id)][field] += sign
+
+
+def new_deltas():
+    return defaultdict(lambda: defaultdict(int))
+
+
+def apply_deltas(deltas):
+    """用 F() 表达式原子地把增量写回数据库，每个活动/场次一条 UPDATE。"""
+    from .models import Activity, ActivitySession
+
+    model_map = {'activity': Activity, 'session': ActivitySession}
+    for (kind, pk), fields in deltas.items():
+        changes = {
+            name: Greatest(F(name) + delta, Value(0))
+            for name, delta in fields.items() if delta
+        }
+        if changes:
+            model_map[kind].objects.filter(pk=pk).update(**changes)
+    if deltas:
+        caching.invalidate(caching.ACTIVITIES)
+
+
+def record_change(old_key, new_key):
+    """单条报名记录从 old_key 变为 new_key（新建时 old_key 为 None，删除时 new_key 为 None）。"""
+    if old_key == new_key:
+        return
+    deltas = new_deltas()
+    collect_deltas(deltas, old_key, -1)
+    collect_deltas(deltas, new_key, +1)
+    apply_deltas(deltas)
+
+
+def set_status(queryset, status, **extra_updates):
+    """
+    批量修改报名状态并同步计数器，替代 queryset.update(status=...)。
+    extra_updates 会一并写入（例如 hours_awarded=F(...) + n）。
+    返回实际更新的行数。
+    """
+    from .models import Registration
+
+    with transaction.atomic():
+        locked = Registration.objects.select_for_update().filter(pk__in=queryset.values('pk'))
+        rows = list(locked.values_list('pk', 'activity_id', 'session_id', 'status'))
+        if not rows:
+            return 0
+        updated = Registration.objects.filter(pk__in=[row[0] for row in rows]).update(status=status, **extra_updates)
+
+        deltas = new_deltas()
+        for _, activity_id, session_id, old_status in rows:
+            if old_status != status:
+                collect_deltas(deltas, (activity_id, session_id, old_status), -1)
+                collect_deltas(deltas, (activity_id, session_id, status), +1)
+        apply_deltas(deltas)
+    return updated
+
+
+def _count_subquery(Registration, group_field, status):
+    return Coalesce(
+        Subquery(
+            Registration.objects.filter(**{group_field: OuterRef('pk'), 'status': status})
+            .order_by()
+            .values(group_field)
+            .annotate(c=Count('pk'))
+            .values('c'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def rebuild_counters(activity_ids=None):
+    """
+    从 Registration 表整体重算所有计数器（集合式 UPDATE，每张表一条语句）。
+    返回 (活动数, 场次数)。
+    """
+    from .models import Activity, ActivitySession, Registration
+
+    activities = Activity.objects.all()
+    sessions = ActivitySession.objects.all()
+    if activity_ids is not None:
+        activities = activities.filter(pk__in=activity_ids)
+        sessions = sessions.filter(activity_id__in=activity_ids)
+
+    with transaction.atomic():
+        activity_rows = activities.update(**{
+            field: _count_subquery(Registration, 'activity', status)
+            for status, field in COUNTER_FIELDS.items()
+        })
+        session_rows = sessions.update(**{
+            field: _count_subquery(Registration, 'session', status)
+            for status, field in COUNTER_FIELDS.items()
+        })
+        caching.invalidate(caching.ACTIVITIES)
+    return activity_rows, session_rows
+
+
+def find_drift():
+    """返回计数器与实际报名数不一致的活动 ID 列表（用于巡检）。"""
+    from .models import Activity
+
+    return list(
+        Activity.objects.annotate(
+            real_approved=Count('registration', filter=Q(registration__status='Approved')),
+            real_pending=Count('registration', filter=Q(registration__status='Pending')),
+        ).exclude(
+            approved_count=F('real_approved'), pending_count=F('real_pending'),
+        ).values_list('pk', flat=True)
+    )
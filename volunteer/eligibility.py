@@ -0,0 +1,63 @@
+"""
+活动报名资格。
+
+报名条件（经验值区间、性别限制、年级限制）写成 Q 表达式，既可以用来过滤活动列表
+（"只看我能报名的"），也可以作为布尔注解随活动一起查出来，活动详情页和列表页用的是同一套规则，
+不再先取出活动再逐条 .exists() 判断。
+经验值规则：max_xp 为 0 表示不设上限，只要求 total_xp >= min_xp；否则要求 min_xp <= total_xp <= max_xp。
+"""
+from django.db.models import BooleanField, Exists, ExpressionWrapper, OuterRef, Q
+
+from . import caching
+from .models import Activity
+
+GradeRestriction = Activity.grade_restriction.through
+
+
+def xp_q(profile):
+    xp = profile.total_xp
+    return Q(min_xp__lte=xp) & (Q(max_xp=0) | Q(max_xp__gte=xp))
+
+
+def gender_q(profile):
+    return Q(gender_restriction='不限') | Q(gender_restriction=profile.gender)
+
+
+def grade_q(profile):
+    restricted = Exists(GradeRestriction.objects.filter(activity_id=OuterRef('pk')))
+    if profile.grade_id is None:
+        return ~restricted
+    return ~restricted | Exists(GradeRestriction.objects.filter(activity_id=OuterRef('pk'), grade_id=profile.grade_id))
+
+
+def eligible_q(profile):
+    return xp_q(profile) & gender_q(profile) & grade_q(profile)
+
+
+def _flag(q):
+    return ExpressionWrapper(q, output_field=BooleanField())
+
+
+def annotate_eligibility(queryset, profile):
+    """为每个活动加上 xp_ok、gender_ok、grade_ok、can_register 四个布尔注解。"""
+    return queryset.annotate(
+        xp_ok=_flag(xp_q(profile)),
+        gender_ok=_flag(gender_q(profile)),
+        grade_ok=_flag(grade_q(profile)),
+        can_register=_flag(eligible_q(profile)),
+    )
+
+
+def filter_eligible(queryset, profile):
+    return queryset.filter(eligible_q(profile))
+
+
+def eligible_open_activity_ids(profile):
+    """
+    该学生可以报名的"报名中"活动 id 集合。
+    结果只取决于活动数据和学生的经验值、性别、年级，按这三项缓存，活动变化时随版本号失效。
+    """
+    name = f'eligible:{profile.total_xp}:{profile.gender}:{profile.grade_id}'
+    return caching.cached(caching.ACTIVITIES, name, lambda: frozenset(
+        filter_eligible(Activity.objects.filter(status="报名中"), profile).values_list('pk', flat=True)
+    ))
@@ -0,0 +1,43 @@
+"""
+并行计算密码哈希。
+
+PBKDF2 每个密码要消耗几十毫秒 CPU，批量导入几千名学生时串行计算会拖到请求超时。
+这里在主进程生成盐值，把 (hasher, 密码, 盐) 分发到进程池里调用 hasher.encode()，
+结果与 make_password(password, salt) 完全一致，check_password 可直接校验。
+
+子进程用 spawn 方式启动，不继承 gunicorn 工作线程的锁状态；
+本模块不在顶层导入任何 Django 模型，子进程无需 django.setup()。
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher, make_password
+
+# 密码数少于这个值时开进程池得不偿失，直接串行计算
+MIN_PARALLEL_PASSWORDS = 64
+
+
+def _encode(args):
+    hasher, password, salt = args
+    return hasher.encode(password, salt)
+
+
+def default_workers():
+    return getattr(settings, 'PASSWORD_HASH_WORKERS', None) or os.cpu_count() or 1
+
+
+def hash_many(passwords, workers=None, min_parallel=MIN_PARALLEL_PASSWORDS):
+    """按顺序返回 passwords 对应的哈希列表。"""
+    passwords = list(passwords)
+    workers = workers or default_workers()
+    if workers <= 1 or len(passwords) < max(min_parallel, 2):
+        return [make_password(p) for p in passwords]
+
+    hasher = get_hasher('default')
+    jobs = [(hasher, password, hasher.salt()) for password in passwords]
+    workers = min(workers, len(jobs))
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return list(pool.map(_encode, jobs, chunksize=chunksize))
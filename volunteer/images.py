@@ -0,0 +1,284 @@
+"""
+CKEditor 上传图片的处理。
+
+以前上传的照片原样存进 MEDIA_ROOT/uploads/，手机上打开活动详情要下载好几 MB 的相机原图，
+EXIF 里的拍摄地点也一并公开了。现在上传时（CKEDITOR_IMAGE_BACKEND = OptimizedImageBackend）：
+  - 按 EXIF 方向转正后丢弃 EXIF/XMP 等元数据（只保留 ICC 色彩配置）；
+  - 按 IMAGE_VARIANT_WIDTHS 生成几种宽度（不放大），每种宽度输出 JPEG/PNG（有透明通道时）以及
+    IMAGE_VARIANT_FORMATS 中 Pillow 支持的现代格式（AVIF、WebP）；
+  - 文件名带内容摘要，存在 MEDIA_ROOT/img/ 下：img/<摘要>-<宽度>.<扩展名>，内容变了文件名一定变，
+    nginx 可以对 /media/img/ 返回一年的 immutable 缓存头；同一张图重复上传不会重复生成；
+  - 各尺寸、格式记在 ProcessedImage 里，活动详情保存时（见 richtext.py）把 <img> 换成带 srcset 的 <picture>；
+  - CKEditor 的“浏览服务器”只列出 CKEDITOR_UPLOAD_PATH 下的文件，上传目录里另存一份去掉元数据的最大尺寸图
+    和 _thumb 缩略图（原图不保留），记为 ProcessedImage.source，浏览后插入的图片同样换成 <picture>。
+动图和 Pillow 打不开的文件按原样保存；像素数超过 Pillow 解压炸弹上限的图片直接拒绝（见 upload_view）。
+已有的上传用 reprocess_images 命令并行重新处理。
+
+与 hashing.py 一样，子进程用 spawn 方式启动，本模块不在顶层导入 Django 模型和 Pillow。
+"""
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+# 处理规则变化时加一，生成新的摘要和文件名，旧文件名对应的缓存不会被误用
+PIPELINE_VERSION = 1
+OUTPUT_DIR = 'img'
+EXTENSIONS = {'jpeg': 'jpg', 'png': 'png', 'webp': 'webp', 'avif': 'avif'}
+MIME_TYPES = {'jpg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp', 'avif': 'image/avif'}
+VARIANT_NAME = re.compile(rf'^{OUTPUT_DIR}/(?P<digest>[0-9a-f]{{16}})-\d+\.(?:jpg|png|webp|avif)$')
+THUMBNAIL_SUFFIX = '_thumb'
+
+
+class ImageTooLarge(ValueError):
+    """像素数超过 Pillow 的解压炸弹上限（Image.MAX_IMAGE_PIXELS 的两倍）。"""
+
+
+class Options:
+    """处理参数，随任务一起传给子进程。"""
+    def __init__(self, widths=None, formats=None, quality=None):
+        self.widths = sorted(set(widths or getattr(settings, 'IMAGE_VARIANT_WIDTHS', [480, 960, 1600])))
+        self.formats = list(formats or getattr(settings, 'IMAGE_VARIANT_FORMATS', ['avif', 'webp']))
+        self.quality = quality or getattr(settings, 'IMAGE_QUALITY', 80)
+        self.thumbnail_size = tuple(getattr(settings, 'CKEDITOR_THUMBNAIL_SIZE', (75, 75)))
+
+    @property
+    def signature(self):
+        return f'{PIPELINE_VERSION}:{self.widths}:{self.formats}:{self.quality}'.encode()
+
+
+class ProcessedResult:
+    def __init__(self, digest, width, height, fallback, formats, widths, files, thumbnail=None):
+        self.digest = digest
+        self.width = width
+        self.height = height
+        self.fallback = fallback
+        self.formats = formats
+        self.widths = widths
+        # {存储路径: 字节串}
+        self.files = files
+        # CKEditor 浏览页用的缩略图（兼容格式）
+        self.thumbnail = thumbnail
+
+    @property
+    def default_path(self):
+        """插入富文本的地址：兼容格式的最大宽度。"""
+        return variant_name(self.digest, self.widths[-1], self.fallback)
+
+    def as_dict(self):
+        return {
+            'digest': self.digest, 'width': self.width, 'height': self.height,
+            'fallback_format': self.fallback, 'formats': self.formats, 'widths': self.widths,
+        }
+
+
+def variant_name(digest, width, extension):
+    return f'{OUTPUT_DIR}/{digest}-{width}.{extension}'
+
+
+def supported_formats(formats):
+    from PIL import Image
+
+    Image.init()
+    return [name for name in formats if name.upper() in Image.SAVE]
+
+
+def _encode(image, extension, quality, icc_profile):
+    buffer = io.BytesIO()
+    params = {'icc_profile': icc_profile} if icc_profile else {}
+    if extension == 'jpg':
+        image.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True, **params)
+    elif extension == 'png':
+        image.save(buffer, format='PNG', optimize=True, **params)
+    elif extension == 'webp':
+        image.save(buffer, format='WEBP', quality=quality, method=6, **params)
+    else:
+        image.save(buffer, format=extension.upper(), quality=quality, **params)
+    return buffer.getvalue()
+
+
+def process_bytes(data, options=None):
+    """生成各尺寸、各格式的文件内容；动图或不是图片时返回 None，像素数超限时抛出 ImageTooLarge。"""
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    options = options or Options()
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Image.DecompressionBombError as e:
+        # 既不是 OSError 也不是 UnidentifiedImageError，不能当成普通文件原样保存
+        raise ImageTooLarge(f"图片像素数超过上限（{Image.MAX_IMAGE_PIXELS * 2} 像素），请缩小后再上传。") from e
+    except (UnidentifiedImageError, OSError):
+        return None
+    if getattr(image, 'is_animated', False):
+        return None
+
+    digest = hashlib.sha256(options.signature + data).hexdigest()[:16]
+    image = ImageOps.exif_transpose(image)
+    icc_profile = image.info.get('icc_profile')
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    # 元数据全部丢弃（EXIF、XMP、注释等），只在编码时带回色彩配置
+    image.info = {}
+    fallback = 'png' if has_alpha else 'jpg'
+    formats = [EXTENSIONS[name] for name in supported_formats(options.formats)]
+
+    width, height = image.size
+    widths = sorted({w for w in options.widths if w < width} | {min(width, options.widths[-1])})
+    files = {}
+    for target in widths:
+        resized = image if target == width else image.resize((target, max(1, round(height * target / width))), Image.Resampling.LANCZOS)
+        for extension in [fallback] + formats:
+            files[variant_name(digest, target, extension)] = _encode(resized, extension, options.quality, icc_profile)
+    image.thumbnail(options.thumbnail_size, Image.Resampling.LANCZOS)
+    thumbnail = _encode(image, fallback, options.quality, icc_profile)
+    return ProcessedResult(digest, width, height, fallback, formats, widths, files, thumbnail)
+
+
+def save_files(storage, result):
+    # 文件名由内容决定，已存在的文件内容一定相同，跳过
+    for name, content in result.files.items():
+        if not storage.exists(name):
+            storage.save(name, ContentFile(content))
+
+
+def record(values, source=None):
+    """values 为 ProcessedResult.as_dict()；source 为原图路径（重新处理已有上传时）。"""
+    from .models import ProcessedImage
+
+    values = dict(values)
+    digest = values.pop('digest')
+    if source is not None:
+        values['source'] = source
+    ProcessedImage.objects.update_or_create(digest=digest, defaults=values)
+
+
+class OptimizedImageBackend:
+    """ckeditor_uploader 的图片后端（CKEDITOR_IMAGE_BACKEND），接口与其自带的 PillowBackend 相同。"""
+    def __init__(self, storage_engine, file_object):
+        self.storage_engine = storage_engine
+        self.file_object = file_object
+        self._result = None
+        self._data = None
+
+    def _process(self):
+        if self._data is None:
+            self.file_object.seek(0)
+            self._data = self.file_object.read()
+            self.file_object.seek(0)
+            self._result = process_bytes(self._data)
+        return self._result
+
+    @property
+    def is_image(self):
+        return self._process() is not None
+
+    def save_as(self, filepath):
+        result = self._process()
+        if result is None:
+            return self.storage_engine.save(filepath, self.file_object)
+        save_files(self.storage_engine, result)
+        # 供 CKEditor 浏览：上传目录里存去掉元数据的最大尺寸图和同名 _thumb 缩略图
+        base = os.path.splitext(filepath)[0]
+        name = self.storage_engine.save(f'{base}.{result.fallback}', ContentFile(result.files[result.default_path]))
+        base, extension = os.path.splitext(name)
+        self.storage_engine.save(f'{base}{THUMBNAIL_SUFFIX}{extension}', ContentFile(result.thumbnail))
+        record(result.as_dict(), source=name)
+        return result.default_path
+
+
+# ---------------------------------------------------------------- 重新处理已有的上传
+
+def find_uploads(root, upload_path=None):
+    """MEDIA_ROOT 下 CKEditor 上传目录里的原图（相对 MEDIA_ROOT 的路径），跳过 CKEditor 生成的缩略图。"""
+    upload_path = upload_path if upload_path is not None else getattr(settings, 'CKEDITOR_UPLOAD_PATH', 'uploads/')
+    base = os.path.join(root, upload_path)
+    paths = []
+    for directory, _, names in os.walk(base):
+        for name in names:
+            if os.path.splitext(name)[0].endswith(THUMBNAIL_SUFFIX):
+                continue
+            paths.append(os.path.relpath(os.path.join(directory, name), root).replace(os.sep, '/'))
+    return sorted(paths)
+
+
+def _reprocess(job):
+    from django.core.files.storage import FileSystemStorage
+
+    root, path, options = job
+    with open(os.path.join(root, path), 'rb') as f:
+        try:
+            result = process_bytes(f.read(), options)
+        except ImageTooLarge:
+            result = None
+    if result is None:
+        return path, None
+    save_files(FileSystemStorage(location=root), result)
+    return path, result.as_dict()
+
+
+def default_workers():
+    return getattr(settings, 'IMAGE_WORKERS', None) or os.cpu_count() or 1
+
+
+def reprocess_uploads(paths, root=None, workers=None, options=None):
+    """并行处理 paths（相对 MEDIA_ROOT），逐个产出 (路径, 结果字典或 None)。"""
+    root = str(root or settings.MEDIA_ROOT)
+    options = options or Options()
+    jobs = [(root, path, options) for path in paths]
+    workers = min(workers or default_workers(), len(jobs))
+    if workers <= 1:
+        yield from map(_reprocess, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        yield from pool.map(_reprocess, jobs)
+
+
+# ---------------------------------------------------------------- 富文本里的 <img>
+
+def media_path(url):
+    """/media/ 下的地址返回相对 MEDIA_ROOT 的路径，其余返回 None。"""
+    media_url = settings.MEDIA_URL
+    if not url or not url.startswith(media_url):
+        return None
+    return url[len(media_url):].split('?')[0]
+
+
+def variants_for_url(url):
+    """富文本中图片地址对应的 ProcessedImage，没有处理过时返回 None。"""
+    from .models import ProcessedImage
+
+    path = media_path(url)
+    if path is None:
+        return None
+    match = VARIANT_NAME.match(path)
+    if match:
+        return ProcessedImage.objects.filter(digest=match['digest']).first()
+    return ProcessedImage.objects.filter(source=path).order_by('-id').first()
+
+
+# ---------------------------------------------------------------- 上传接口
+
+def upload_view(request):
+    """CKEditor 的图片上传（挂在 ckeditor_uploader 的 upload 之前）：超过像素上限的图片不存储，返回错误提示。"""
+    from ckeditor_uploader.views import upload
+    from django.http import HttpResponse, JsonResponse
+
+    try:
+        return upload(request)
+    except ImageTooLarge as e:
+        func_num = request.GET.get('CKEditorFuncNum')
+        if func_num:
+            # 与 ckeditor_uploader 相同的 iframe 回调方式
+            return HttpResponse(
+                "<script type='text/javascript'>"
+                f"window.parent.CKEDITOR.tools.callFunction({json.dumps(func_num)}, '', {json.dumps(str(e))});"
+                "</script>"
+            )
+        return JsonResponse({'uploaded': 0, 'error': {'message': str(e)}})
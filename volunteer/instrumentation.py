@@ -0,0 +1,81 @@
+"""
+请求级性能统计。
+
+RequestMetricsMiddleware（volunteer.middleware）为每个请求创建一个 RequestMetrics，
+SQL 通过 connection.execute_wrapper 计时，模板渲染通过下面的 DjangoTemplates 后端计时
+（settings.TEMPLATES 使用本模块的 DjangoTemplates 代替 Django 自带的同名后端）。
+当前请求的 RequestMetrics 放在 contextvar 里，模板后端不需要拿到 request 也能累加。
+"""
+import contextvars
+import time
+
+from django.template.backends.django import DjangoTemplates as BaseDjangoTemplates
+from django.template.backends.django import Template as BaseTemplate
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+SQL_PREVIEW_LENGTH = 500
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.slowest_sql = None
+        self.slowest_sql_time = 0.0
+        self._render_depth = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper 的回调签名
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += duration
+            if duration > self.slowest_sql_time:
+                self.slowest_sql_time = duration
+                self.slowest_sql = sql
+
+
+def current_metrics():
+    return _current.get()
+
+
+def activate(metrics):
+    return _current.set(metrics)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+class Template(BaseTemplate):
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return super().render(context, request)
+        # render_to_string 可能在模板标签里嵌套调用，只统计最外层，避免重复计时
+        metrics._render_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics._render_depth -= 1
+            if not metrics._render_depth:
+                metrics.render_time += time.perf_counter() - start
+
+
+class DjangoTemplates(BaseDjangoTemplates):
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return Template(template.template, self)
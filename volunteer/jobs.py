@@ -0,0 +1,171 @@
+"""
+后台导入任务队列。
+
+管理后台上传的 Excel 不再在 HTTP 请求里同步处理（大文件会卡住 gunicorn 线程并在 60 秒超时），
+而是保存为 ImportJob 排队，由 `python manage.py run_import_worker` 进程逐个领取执行。
+队列就是数据库表本身，不需要额外的消息中间件；领取任务用一条带条件的 UPDATE，
+多个 worker 同时运行也不会重复领取。处理中的任务由 Heartbeat 定期刷新 updated_at，
+只有 worker 退出、心跳停止超过 IMPORT_JOB_STALE_SECONDS 的任务才会被重新领取。
+"""
+import datetime
+import logging
+import threading
+import time
+
+import pandas as pd
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Q
+from django.utils import timezone
+
+from . import leaderboard, login_sessions
+from .imports import credit_activity_hours, import_students
+from .models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(kind, uploaded_file, user, activity=None):
+    return ImportJob.objects.create(kind=kind, file=uploaded_file, created_by=user, activity=activity)
+
+
+def claim_next_job():
+    """领取一个排队中的任务（或心跳已停止、worker 已退出的处理中任务）。"""
+    stale_before = timezone.now() - datetime.timedelta(seconds=settings.IMPORT_JOB_STALE_SECONDS)
+    claimable = ImportJob.objects.filter(Q(status='Queued') | Q(status='Running', updated_at__lt=stale_before))
+    for job in claimable.order_by('created_at')[:5]:
+        claimed = ImportJob.objects.filter(pk=job.pk, status=job.status, updated_at=job.updated_at).update(
+            status='Running', updated_at=timezone.now(),
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def report_progress(job, processed, total):
+    ImportJob.objects.filter(pk=job.pk).update(processed_rows=processed, total_rows=total, updated_at=timezone.now())
+
+
+class Heartbeat:
+    """
+    任务执行期间在后台线程里定期刷新 updated_at。
+    线程使用自己的数据库连接（自动提交），不受任务事务影响，
+    执行时间再长的任务也不会被其他 worker 当成僵死任务重新领取、重复计入时长。
+    """
+    def __init__(self, job, interval=None):
+        self.job_pk = job.pk
+        self.interval = interval or settings.IMPORT_JOB_HEARTBEAT_SECONDS
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'import-job-{job.pk}-heartbeat', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stopped.wait(self.interval):
+                try:
+                    ImportJob.objects.filter(pk=self.job_pk, status='Running').update(updated_at=timezone.now())
+                except Exception:
+                    logger.exception("导入任务 %s 心跳更新失败", self.job_pk)
+        finally:
+            connection.close()
+
+
+def run_job(job):
+    with Heartbeat(job):
+        return _run_job(job)
+
+
+def _run_job(job):
+    def progress(processed, total):
+        report_progress(job, processed, total)
+
+    try:
+        with job.file.open('rb') as f:
+            if job.kind == 'students':
+                df = pd.read_excel(f, dtype=str)
+                report_progress(job, 0, len(df))
+                result = import_students(df, progress=progress)
+            elif job.kind == 'hours':
+                df = pd.read_excel(f, dtype={'学号': str})
+                # 重新领取或重试的任务从已提交的进度继续，已计入的时长不会再加一次
+                report_progress(job, job.processed_rows, len(df))
+                result = credit_activity_hours(job.activity, df, progress=progress, resume_from=job.processed_rows)
+            else:
+                raise ValueError(f"未知的任务类型: {job.kind}")
+    except Exception as e:
+        logger.exception("导入任务 %s 失败", job.pk)
+        summary = f"错误: {e}"
+        if job.kind == 'hours':
+            # 时长按批提交，失败前的批次已经计入；保留文件，重试时从断点继续，重新上传会重复计入
+            processed = ImportJob.objects.values_list('processed_rows', flat=True).get(pk=job.pk)
+            summary += f"；已计入 {processed} 人的时长。请在导入任务列表中选择“重试”从第 {processed + 1} 人继续，不要重新上传。"
+        ImportJob.objects.filter(pk=job.pk).update(
+            status='Failed', summary=summary, finished_at=timezone.now(), updated_at=timezone.now(),
+        )
+        if job.kind != 'hours':
+            _delete_file(job)
+    else:
+        ImportJob.objects.filter(pk=job.pk).update(
+            status='Done', summary=result.summary, warnings=result.warnings,
+            finished_at=timezone.now(), updated_at=timezone.now(),
+        )
+        _delete_file(job)
+    job.refresh_from_db()
+    return job
+
+
+def _delete_file(job):
+    # 名单里有明文初始密码，处理完立即删除（worker 中途退出时保留，重新领取后还要用）
+    job.file.delete(save=False)
+    ImportJob.objects.filter(pk=job.pk).update(file='')
+
+
+def retry(job):
+    """把失败的时长任务重新排队，从已提交的进度（processed_rows）继续。返回是否已排队。"""
+    return bool(
+        ImportJob.objects.filter(pk=job.pk, kind='hours', status='Failed').exclude(file='')
+        .update(status='Queued', summary='', finished_at=None, updated_at=timezone.now())
+    )
+
+
+def run_pending_jobs():
+    """依次处理队列中的任务直到队列为空，返回处理的任务数。"""
+    count = 0
+    while True:
+        job = claim_next_job()
+        if job is None:
+            return count
+        logger.info("开始处理导入任务 %s", job)
+        run_job(job)
+        logger.info("导入任务 %s 结束: %s", job.pk, job.summary)
+        count += 1
+
+
+def work(poll_interval=2):
+    """worker 主循环；空闲时顺带定期刷新排行榜快照、清理过期的登录 session。"""
+    refresh_leaderboard = leaderboard.PeriodicRefresher()
+    prune_sessions = login_sessions.PeriodicPruner()
+    while True:
+        # 长期运行的进程需要自己回收失效的数据库连接（CONN_MAX_AGE、RDS 断线）
+        close_old_connections()
+        if not run_pending_jobs():
+            try:
+                if refresh_leaderboard():
+                    logger.info("排行榜快照已刷新")
+            except Exception:
+                logger.exception("刷新排行榜快照失败")
+            try:
+                deleted = prune_sessions()
+                if deleted:
+                    logger.info("已清理 %s 个过期 session", deleted)
+            except Exception:
+                logger.exception("清理过期 session 失败")
+            time.sleep(poll_interval)
@@ -0,0 +1,125 @@
+"""
+经验值排行榜。
+
+每次查看个人主页都 COUNT(*) WHERE total_xp > x 算排名，全校几万人时代价太高。
+这里定期（导入 worker 里每 LEADERBOARD_REFRESH_SECONDS 秒一次，或手动运行 refresh_leaderboard）
+用窗口函数一次性算出全校/年级/班级排名和各范围人数，整体写入 RankSnapshot：
+  - 我的排名：按主键取一行；
+  - 排行榜：按 (范围, 名次) 索引读取前 N 行；
+  - 段位分布：刷新时统计一次，放在缓存里。
+排名使用 RANK()，经验值相同的并列，下一名次顺延。
+"""
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When, Window
+from django.db.models.functions import Rank
+from django.utils import timezone
+
+from . import caching
+from .models import RANK_TIERS, RankSnapshot, VolunteerProfile
+
+LEADERBOARD = 'leaderboard'
+LEADERBOARD_SIZE = 50
+REFRESH_BATCH_SIZE = 5000
+
+# 范围 -> (名次字段, 人数字段)
+SCOPES = {
+    'school': ('school_rank', 'school_size'),
+    'grade': ('grade_rank', 'grade_size'),
+    'class': ('class_rank', 'class_size'),
+}
+
+
+def _ranked(partition_by=None):
+    return Window(Rank(), partition_by=partition_by, order_by=F('total_xp').desc())
+
+
+def _sized(partition_by=None):
+    return Window(Count('pk'), partition_by=partition_by)
+
+
+def refresh_rank_snapshot():
+    """重算整张排名快照，返回写入的行数。"""
+    now = timezone.now()
+    rows = (VolunteerProfile.objects
+            .annotate(
+                school_rank=_ranked(), school_size=_sized(),
+                grade_rank=_ranked([F('grade_id')]), grade_size=_sized([F('grade_id')]),
+                class_rank=_ranked([F('class_name')]), class_size=_sized([F('class_name')]),
+            )
+            .values_list('pk', 'grade_id', 'class_name', 'total_xp',
+                         'school_rank', 'school_size', 'grade_rank', 'grade_size', 'class_rank', 'class_size'))
+    count = 0
+    with transaction.atomic():
+        RankSnapshot.objects.all().delete()
+        batch = []
+        for pk, grade_id, class_name, total_xp, *ranks in rows.iterator(chunk_size=REFRESH_BATCH_SIZE):
+            batch.append(RankSnapshot(
+                profile_id=pk, grade_id=grade_id, class_name=class_name or '', total_xp=total_xp,
+                school_rank=ranks[0], school_size=ranks[1], grade_rank=ranks[2], grade_size=ranks[3],
+                class_rank=ranks[4], class_size=ranks[5], refreshed_at=now,
+            ))
+            if len(batch) >= REFRESH_BATCH_SIZE:
+                count += len(RankSnapshot.objects.bulk_create(batch))
+                batch = []
+        count += len(RankSnapshot.objects.bulk_create(batch))
+        caching.invalidate(LEADERBOARD)
+    return count
+
+
+def my_rank(profile):
+    """该学生（档案或档案 id）的快照行（含三个范围的名次和人数），快照里还没有时返回 None。"""
+    # 连同姓名、年级一起取出，API 序列化时不再逐个查
+    return RankSnapshot.objects.select_related('profile__user', 'grade').filter(pk=getattr(profile, 'pk', profile)).first()
+
+
+def top_entries(scope='school', grade_id=None, class_name=None, limit=LEADERBOARD_SIZE):
+    rank_field, _ = SCOPES[scope]
+    entries = RankSnapshot.objects.select_related('profile__user', 'grade')
+    if scope == 'grade':
+        entries = entries.filter(grade_id=grade_id)
+    elif scope == 'class':
+        entries = entries.filter(class_name=class_name or '')
+    return list(entries.order_by(rank_field, 'pk')[:limit])
+
+
+def _tier_case():
+    # 等级 = total_xp // 100，等级 <= n 即 total_xp < (n + 1) * 100
+    return Case(
+        *[When(total_xp__lt=(max_level + 1) * 100, then=Value(i)) for i, (max_level, _) in enumerate(RANK_TIERS) if max_level is not None],
+        default=Value(len(RANK_TIERS) - 1),
+        output_field=IntegerField(),
+    )
+
+
+def tier_distribution():
+    """[(段位名称, 人数, 百分比)]，按快照统计，刷新快照后失效。"""
+    def build():
+        counts = dict(
+            RankSnapshot.objects.annotate(tier=_tier_case()).order_by().values_list('tier').annotate(n=Count('pk'))
+        )
+        total = sum(counts.values())
+        return [
+            (name, counts.get(i, 0), round(counts.get(i, 0) * 100 / total, 1) if total else 0)
+            for i, (_, name) in enumerate(RANK_TIERS)
+        ]
+    return caching.cached(LEADERBOARD, 'tiers', build)
+
+
+def refresh_interval():
+    return getattr(settings, 'LEADERBOARD_REFRESH_SECONDS', 600)
+
+
+class PeriodicRefresher:
+    """给长期运行的 worker 用：距上次刷新超过 refresh_interval() 秒时刷新一次快照。"""
+    def __init__(self):
+        self.next_run = 0
+
+    def __call__(self):
+        if time.monotonic() < self.next_run:
+            return False
+        refresh_rank_snapshot()
+        self.next_run = time.monotonic() + refresh_interval()
+        return True
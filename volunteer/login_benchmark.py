@@ -0,0 +1,207 @@
+"""
+WSGI / ASGI 两种运行模式的并发登录吞吐对比。
+
+用本地桩服务器代替 Cloudflare siteverify（可设置响应延迟，模拟跨境访问的往返时间），
+在进程内分别驱动两种处理器完成同样数量的登录：
+  - wsgi：同步视图，固定数量的线程处理请求，相当于一个 gunicorn worker 的 --threads；
+  - asgi：异步视图（project.asgi_urls），所有客户端的请求同时进入事件循环，相当于一个 uvicorn worker。
+两种模式都走完整的中间件、登录表单、密码校验和 session 写入，每个请求结束时都关闭数据库连接，
+连接开销相同。密码哈希临时换成 MD5，避免 PBKDF2 的 CPU 开销掩盖 I/O 等待的差别。
+测试用户和 session 在结束后删除。
+注意：SQLite 上 ATOMIC_REQUESTS 的同步登录在并发写入时会出现 database is locked（计为失败），
+数字以线上同款 PostgreSQL 上的运行结果为准。
+"""
+import asyncio
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.db import connections
+from django.test import AsyncClient, Client, modify_settings, override_settings
+
+LOGIN_BENCH_PREFIX = 'loginbench'
+LOGIN_BENCH_PASSWORD = 'bench-login-password'
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+MODES = {
+    'wsgi': 'project.urls',
+    'asgi': 'project.asgi_urls',
+}
+
+
+class TurnstileStubServer(ThreadingHTTPServer):
+    """本地桩服务器，代替 Cloudflare siteverify；delay 秒后返回 result。"""
+    daemon_threads = True
+    # 几十个客户端同时连入时默认的 listen 队列（5）不够
+    request_queue_size = 128
+
+    def __init__(self, delay=0.0, result=None):
+        self.delay = delay
+        self.result = result or {'success': True}
+        self.requests = 0
+        self.connections = 0
+        super().__init__(('127.0.0.1', 0), _TurnstileStubHandler)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/siteverify'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # 客户端超时先断开时写回响应会 BrokenPipe，忽略即可
+        pass
+
+
+class _TurnstileStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests += 1
+        time.sleep(self.server.delay)
+        body = json.dumps(self.server.result).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class LoginBenchmarkResult:
+    def __init__(self, mode, statuses, times, elapsed):
+        self.mode = mode
+        self.statuses = statuses
+        self.times = times
+        self.elapsed = elapsed
+
+    @property
+    def succeeded(self):
+        # 登录成功重定向到个人主页
+        return sum(1 for status in self.statuses if status == 302)
+
+    @property
+    def throughput(self):
+        return self.succeeded / self.elapsed if self.elapsed else 0
+
+    @property
+    def median_ms(self):
+        return statistics.median(self.times) * 1000
+
+    @property
+    def p95_ms(self):
+        return statistics.quantiles(self.times, n=20)[-1] * 1000 if len(self.times) > 1 else self.median_ms
+
+    def as_dict(self):
+        return {
+            'logins': len(self.statuses), 'succeeded': self.succeeded, 'elapsed_s': round(self.elapsed, 3),
+            'logins_per_s': round(self.throughput, 1), 'median_ms': round(self.median_ms, 1), 'p95_ms': round(self.p95_ms, 1),
+        }
+
+
+def _login_data(username, token):
+    return {'username': username, 'password': LOGIN_BENCH_PASSWORD, 'cf-turnstile-response': token}
+
+
+def _run_wsgi(usernames, concurrency, threads):
+    # concurrency 个客户端同时登录，服务端只有 threads 个线程，请求按到达顺序排队（排队时间计入耗时）
+    server = ThreadPoolExecutor(max_workers=threads)
+
+    def handle(client, i):
+        try:
+            return client.post('/login/', _login_data(usernames[i], f'wsgi-{i}'))
+        finally:
+            connections.close_all()
+
+    def one(i):
+        client = Client(raise_request_exception=False)
+        start = time.perf_counter()
+        response = server.submit(handle, client, i).result()
+        return response.status_code, time.perf_counter() - start, client.cookies.get(settings.SESSION_COOKIE_NAME)
+
+    with server, ThreadPoolExecutor(max_workers=concurrency) as clients:
+        return list(clients.map(one, range(len(usernames))))
+
+
+async def _run_asgi(usernames, concurrency):
+    # concurrency 个客户端同时登录，请求全部交给事件循环
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with limit:
+            # 与 ASGIHandler 一样，每个请求的同步部分在它自己的线程里执行
+            async with ThreadSensitiveContext():
+                client = AsyncClient(raise_request_exception=False)
+                start = time.perf_counter()
+                try:
+                    response = await client.post('/login/', _login_data(usernames[i], f'asgi-{i}'))
+                finally:
+                    await sync_to_async(connections.close_all)()
+                return response.status_code, time.perf_counter() - start, client.cookies.get(settings.SESSION_COOKIE_NAME)
+
+    return await asyncio.gather(*(one(i) for i in range(len(usernames))))
+
+
+def _create_users(count):
+    password = make_password(LOGIN_BENCH_PASSWORD)
+    User.objects.filter(username__startswith=LOGIN_BENCH_PREFIX).delete()
+    User.objects.bulk_create([User(username=f'{LOGIN_BENCH_PREFIX}{i}', password=password) for i in range(count)])
+    return [f'{LOGIN_BENCH_PREFIX}{i}' for i in range(count)]
+
+
+def compare_login_modes(logins=200, concurrency=32, threads=4, latency_ms=150, modes=tuple(MODES)):
+    """
+    两种模式各完成 logins 次登录，返回 {模式: LoginBenchmarkResult}。
+    concurrency 为同时发起登录的客户端数；threads 为 wsgi 模式的处理线程数（gunicorn --threads）。
+    """
+    stub = TurnstileStubServer(delay=latency_ms / 1000).start()
+    settings_override = override_settings(
+        ALLOWED_HOSTS=['testserver'], PASSWORD_HASHERS=FAST_HASHERS,
+        TURNSTILE_VERIFY_URL=stub.url, TURNSTILE_POOL_SIZE=concurrency,
+        TURNSTILE_BREAKER_THRESHOLD=logins + 1,
+    )
+    middleware_override = modify_settings(MIDDLEWARE={'remove': ['volunteer.middleware.TimeRestrictionMiddleware']})
+    results = {}
+    session_keys = []
+    settings_override.enable()
+    middleware_override.enable()
+    try:
+        usernames = _create_users(logins)
+        for mode in modes:
+            with override_settings(ROOT_URLCONF=MODES[mode]):
+                start = time.perf_counter()
+                if mode == 'wsgi':
+                    rows = _run_wsgi(usernames, concurrency, threads)
+                else:
+                    # 不用 async_to_sync：它会把所有同步代码送回当前线程执行，就不是 ASGIHandler 的行为了
+                    rows = asyncio.run(_run_asgi(usernames, concurrency))
+                elapsed = time.perf_counter() - start
+            results[mode] = LoginBenchmarkResult(mode, [r[0] for r in rows], [r[1] for r in rows], elapsed)
+            session_keys += [r[2].value for r in rows if r[2] is not None]
+    finally:
+        Session.objects.filter(session_key__in=session_keys).delete()
+        User.objects.filter(username__startswith=LOGIN_BENCH_PREFIX).delete()
+        middleware_override.disable()
+        settings_override.disable()
+        stub.stop()
+    return results
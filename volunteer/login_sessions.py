@@ -0,0 +1,51 @@
+"""
+登录 session 的存储与清理。
+
+session 引擎由 settings.SESSION_STORE 选择（见 settings.py）：
+  - cached_db（配置了内存缓存或 Redis 时默认）：读 session 先查缓存（独立的 sessions 缓存别名），未命中才查库；写入时同时写库和缓存，
+    已登录用户的页面请求不再每次先到远程数据库查一遍 django_session；
+  - db（只有文件缓存时默认，文件缓存每次写入都要扫描整个缓存目录）：每个请求都查库；
+  - signed_cookies：session 数据签名后放在 cookie 里，完全不查库，但无法在服务端使单个 session 失效。
+django_session 里过期的行 Django 不会自动删除。clearsessions 一条 DELETE 删完，表大时会长时间锁表，
+这里按主键分批删除，由导入 worker 空闲时每 SESSION_PRUNE_SECONDS 秒清理一轮，也可手动运行 prune_sessions。
+"""
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+
+PRUNE_BATCH_SIZE = 1000
+
+
+def prune_expired_sessions(batch_size=PRUNE_BATCH_SIZE, max_batches=None):
+    """分批删除已过期的 session，返回删除的行数；max_batches 限制本轮最多删几批。"""
+    now = timezone.now()
+    deleted = batches = 0
+    while max_batches is None or batches < max_batches:
+        keys = list(Session.objects.filter(expire_date__lt=now).values_list('pk', flat=True)[:batch_size])
+        if not keys:
+            break
+        deleted += Session.objects.filter(pk__in=keys).delete()[0]
+        batches += 1
+    return deleted
+
+
+def prune_interval():
+    return getattr(settings, 'SESSION_PRUNE_SECONDS', 3600)
+
+
+class PeriodicPruner:
+    """给长期运行的 worker 用：距上次清理超过 prune_interval() 秒时清理一轮（最多 max_batches 批）。"""
+    def __init__(self, max_batches=10):
+        self.max_batches = max_batches
+        self.next_run = 0
+
+    def __call__(self):
+        if time.monotonic() < self.next_run:
+            return None
+        deleted = prune_expired_sessions(max_batches=self.max_batches)
+        # 一轮没删完说明积压较多，下次空闲时继续，不等满一个周期
+        if deleted < self.max_batches * PRUNE_BATCH_SIZE:
+            self.next_run = time.monotonic() + prune_interval()
+        return deleted
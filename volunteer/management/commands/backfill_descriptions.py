@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from volunteer.models import Activity
+from volunteer.richtext import BACKFILL_BATCH_SIZE, backfill
+from volunteer.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "重新生成所有活动详情的派生字段（清洗后的 HTML、纯文本和摘要），并重建检索索引"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE, help='每批更新的活动数')
+        parser.add_argument('--missing-only', action='store_true', help='只处理还没有生成过派生字段的活动')
+
+    def handle(self, *args, **options):
+        activities = Activity.objects.all()
+        if options['missing_only']:
+            activities = activities.filter(description_html='').exclude(description='')
+        ids = list(activities.values_list('pk', flat=True))
+        count = backfill(Activity.objects.filter(pk__in=ids), batch_size=options['batch_size'])
+        # 检索文本由纯文本正文切分，一并重建
+        rebuild_index(Activity.objects.filter(pk__in=ids).order_by('pk'))
+        self.stdout.write(self.style.SUCCESS(f"已处理 {count} 个活动。"))
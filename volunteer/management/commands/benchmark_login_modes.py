@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand
+from volunteer.login_benchmark import MODES, compare_login_modes
+
+
+class Command(BaseCommand):
+    help = "对比 WSGI（同步线程）和 ASGI（异步视图）两种运行模式的并发登录吞吐，Turnstile 由本地桩服务器代替"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200, help='每种模式完成的登录次数')
+        parser.add_argument('--concurrency', type=int, default=32, help='同时发起登录的客户端数')
+        parser.add_argument('--threads', type=int, default=4, help='WSGI 模式的处理线程数（gunicorn --threads）')
+        parser.add_argument('--latency-ms', type=int, default=150, help='桩服务器模拟的 Turnstile 核验耗时')
+        parser.add_argument('--mode', action='append', choices=list(MODES), help='只运行指定模式（可重复）')
+        parser.add_argument('--output', help='把结果写入 JSON 文件')
+
+    def handle(self, *args, **options):
+        results = compare_login_modes(
+            logins=options['logins'], concurrency=options['concurrency'], threads=options['threads'],
+            latency_ms=options['latency_ms'], modes=tuple(options['mode'] or MODES),
+        )
+        self.stdout.write(f"{'模式':<8}{'成功/总数':>12}{'登录/秒':>10}{'中位(ms)':>10}{'P95(ms)':>10}")
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:<8}{f'{result.succeeded}/{len(result.statuses)}':>12}{result.throughput:>10.1f}"
+                f"{result.median_ms:>10.1f}{result.p95_ms:>10.1f}"
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({mode: r.as_dict() for mode, r in results.items()}, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"结果已写入 {options['output']}")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from volunteer.benchmarks import SESSION_ENGINES, run_session_benchmarks
+
+
+class Command(BaseCommand):
+    help = "对比不同 session 引擎下已登录页面请求的数据库往返次数和耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='每种引擎请求页面的次数')
+        parser.add_argument('--engine', action='append', choices=list(SESSION_ENGINES), help='只测指定引擎（可重复）')
+
+    def handle(self, *args, **options):
+        try:
+            rows = run_session_benchmarks(repeat=options['repeat'], engines=tuple(options['engine'] or SESSION_ENGINES))
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"{'引擎':<16}{'session 查询/请求':>18}{'总查询/请求':>14}{'中位耗时(ms)':>14}")
+        for name, session_queries, total_queries, median_ms in rows:
+            self.stdout.write(f"{name:<16}{session_queries:>18.1f}{total_queries:>14.1f}{median_ms:>14.1f}")
@@ -0,0 +1,34 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from volunteer import closure
+
+
+class Command(BaseCommand):
+    help = "生成 nginx 闭站配置片段和休息页，闭站时段由 nginx 直接返回休息页，不再转发给 gunicorn"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default=str(settings.BASE_DIR / 'nginx' / 'snippets'),
+                            help="输出目录，compose.yml 中挂载到 nginx 容器的 /etc/nginx/snippets")
+        parser.add_argument('--nginx-utc-offset', default='+00:00',
+                            help="nginx 所在时区的 UTC 偏移（nginx:alpine 镜像默认 UTC）")
+
+    def handle(self, *args, **options):
+        closed_window = closure.window()
+        if closed_window is None:
+            raise CommandError("未配置闭站时段（SITE_CLOSED_WINDOW 为空），无需生成。")
+        try:
+            offset = closure.parse_utc_offset(options['nginx_utc_offset'])
+        except ValueError:
+            raise CommandError(f"无法识别的 UTC 偏移：{options['nginx_utc_offset']}")
+
+        output_dir = Path(options['output_dir'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        files = closure.nginx_snippets(closed_window, nginx_utc_offset=offset)
+        for name, content in files.items():
+            (output_dir / name).write_text(content, encoding='utf-8')
+        (output_dir / closure.NGINX_PAGE_NAME).write_bytes(closure.sleeping_page(closed_window))
+        self.stdout.write(self.style.SUCCESS(
+            f"已写入 {output_dir}，重新加载 nginx 后生效：docker compose exec nginx nginx -s reload"
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from volunteer.login_sessions import PRUNE_BATCH_SIZE, prune_expired_sessions
+
+
+class Command(BaseCommand):
+    help = "分批删除过期的登录 session（导入 worker 也会定期自动清理）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PRUNE_BATCH_SIZE, help='每批删除的行数')
+        parser.add_argument('--max-batches', type=int, help='最多删除几批，默认删完为止')
+
+    def handle(self, *args, **options):
+        deleted = prune_expired_sessions(batch_size=options['batch_size'], max_batches=options['max_batches'])
+        self.stdout.write(self.style.SUCCESS(f"已删除 {deleted} 个过期 session。"))
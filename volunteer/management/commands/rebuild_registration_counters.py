@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from volunteer.counters import find_drift, rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "根据报名记录重新计算活动/场次的已批准、待审核人数计数器"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='只检查不一致的活动，不写入数据库')
+        parser.add_argument('--activity', type=int, action='append', dest='activity_ids', help='只重算指定活动 ID（可重复）')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            drifted = find_drift()
+            if drifted:
+                self.stdout.write(self.style.WARNING(f"计数不一致的活动: {', '.join(map(str, drifted))}"))
+            else:
+                self.stdout.write(self.style.SUCCESS("所有活动计数器均一致。"))
+            return
+
+        activity_rows, session_rows = rebuild_counters(activity_ids=options['activity_ids'])
+        self.stdout.write(self.style.SUCCESS(f"已重算 {activity_rows} 个活动、{session_rows} 个场次的报名计数。"))
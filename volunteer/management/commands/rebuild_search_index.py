@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from volunteer.models import Activity
+from volunteer.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "重新生成所有活动的全文检索文本并同步索引（SQLite 下同步 FTS5 表）"
+
+    def handle(self, *args, **options):
+        count = rebuild_index(Activity.objects.order_by('pk'))
+        self.stdout.write(self.style.SUCCESS(f"已重建 {count} 个活动的检索索引。"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from volunteer.xp import RECALCULATE_CHUNK_SIZE, recalculate_all_xp
+
+
+class Command(BaseCommand):
+    help = "全表校准志愿者经验值（总时长 + 标签加成），按主键分批执行，适合在闭站时段运行"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=RECALCULATE_CHUNK_SIZE, help='每批处理的档案数')
+
+    def handle(self, *args, **options):
+        def progress(checked, changed):
+            self.stdout.write(f"已检查 {checked} 人，校准 {changed} 人...")
+
+        checked, changed = recalculate_all_xp(chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"完成：共检查 {checked} 名志愿者，其中 {changed} 人的经验值已更新。"))
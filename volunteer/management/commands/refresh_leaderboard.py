@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from volunteer.leaderboard import refresh_rank_snapshot
+
+
+class Command(BaseCommand):
+    help = "立即重算经验值排行榜快照（导入 worker 也会定期自动刷新）"
+
+    def handle(self, *args, **options):
+        count = refresh_rank_snapshot()
+        self.stdout.write(self.style.SUCCESS(f"已刷新 {count} 名志愿者的排名。"))
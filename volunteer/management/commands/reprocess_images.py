@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from volunteer.images import find_uploads, record, reprocess_uploads
+from volunteer.models import Activity, ProcessedImage
+from volunteer.richtext import backfill
+
+
+class Command(BaseCommand):
+    help = "并行处理 CKEditor 已有的上传图片（去元数据、多尺寸、WebP/AVIF），并让活动详情改用 srcset 引用"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='进程数，默认为 IMAGE_WORKERS 或 CPU 核数')
+        parser.add_argument('--force', action='store_true', help='已经处理过的图片也重新处理')
+
+    def handle(self, *args, **options):
+        paths = find_uploads(settings.MEDIA_ROOT)
+        if not options['force']:
+            done = set(ProcessedImage.objects.filter(source__in=paths).values_list('source', flat=True))
+            paths = [path for path in paths if path not in done]
+        processed = skipped = 0
+        for path, values in reprocess_uploads(paths, workers=options['workers']):
+            if values is None:
+                skipped += 1
+                continue
+            record(values, source=path)
+            processed += 1
+        # 活动详情重新生成，<img> 换成带 srcset 的 <picture>
+        activities = backfill(Activity.objects.filter(description__contains='<img'))
+        self.stdout.write(self.style.SUCCESS(
+            f"已处理 {processed} 张图片，跳过 {skipped} 个非图片或动图，更新了 {activities} 个活动。"
+        ))
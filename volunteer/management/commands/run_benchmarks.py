@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from volunteer.benchmarks import TIME_TOLERANCE, compare, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = "对当前数据库运行性能基准，输出每个场景的 SQL 条数和耗时；可保存结果并与基线对比"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='每个场景运行的次数（另有一次预热）')
+        parser.add_argument('--only', action='append', help='只运行指定场景（可重复）')
+        parser.add_argument('--output', help='把结果写入 JSON 文件，可作为下次对比的基线')
+        parser.add_argument('--baseline', help='与之前保存的 JSON 结果对比，有退化时以非零状态退出')
+        parser.add_argument('--tolerance', type=float, default=TIME_TOLERANCE, help='耗时允许超出基线的比例')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'场景':<32}{'SQL':>6}{'中位耗时(ms)':>14}{'状态':>6}")
+
+        def progress(result):
+            self.stdout.write(f"{result.name:<32}{result.queries:>6}{result.median_ms:>14.1f}{result.status or '-':>6}")
+
+        try:
+            results = run_benchmarks(repeat=options['repeat'], only=options['only'], progress=progress)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump({r.name: r.as_dict() for r in results}, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"结果已写入 {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                regressions = compare(results, json.load(f), tolerance=options['tolerance'])
+            if regressions:
+                for line in regressions:
+                    self.stdout.write(self.style.ERROR(line))
+                raise CommandError(f"{len(regressions)} 项指标相对基线退化")
+            self.stdout.write(self.style.SUCCESS("与基线相比没有退化。"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from volunteer.jobs import run_pending_jobs, work
+
+
+class Command(BaseCommand):
+    help = "运行后台导入任务 worker，处理管理后台上传的 Excel（批量建号、上传时长），空闲时定期刷新排行榜快照"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='处理完当前排队的任务后退出')
+        parser.add_argument('--poll-interval', type=float, default=2, help='队列为空时的轮询间隔（秒）')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            count = run_pending_jobs()
+            self.stdout.write(self.style.SUCCESS(f"已处理 {count} 个导入任务。"))
+            return
+        self.stdout.write("导入任务 worker 已启动。")
+        work(poll_interval=options['poll_interval'])
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from volunteer.seeding import clear_seed_data, seed_load_data
+
+
+class Command(BaseCommand):
+    help = "生成压测数据（志愿者、活动、场次、报名记录、留言），供 run_benchmarks 使用。不要在生产库上运行"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, default=20000, help='志愿者人数')
+        parser.add_argument('--activities', type=int, default=300, help='活动数')
+        parser.add_argument('--registrations', type=int, default=200000, help='报名记录数（约数）')
+        parser.add_argument('--messages', type=int, default=100000, help='留言数')
+        parser.add_argument('--prefix', default='load', help='生成账号的用户名/学号前缀')
+        parser.add_argument('--seed', type=int, default=0, help='随机数种子，相同种子生成相同数据')
+        parser.add_argument('--clear', action='store_true', help='先删除之前生成的压测数据')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if options['clear']:
+            users, activities = clear_seed_data(prefix)
+            self.stdout.write(f"已删除旧压测数据：{users} 行（账号及关联数据）、{activities} 行（活动及关联数据）。")
+        elif User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f"已存在以 {prefix} 开头的账号，请加 --clear 重新生成或换一个 --prefix")
+
+        created = seed_load_data(
+            profiles=options['profiles'], activities=options['activities'],
+            registrations=options['registrations'], messages=options['messages'],
+            prefix=prefix, random_seed=options['seed'], progress=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"完成：{created['profiles']} 名志愿者，{created['activities']} 个活动（{created['sessions']} 个场次），"
+            f"{created['registrations']} 条报名记录，{created['messages']} 条留言。"
+        ))
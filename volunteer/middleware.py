@@ -1,31 +1,132 @@
-from django.shortcuts import render
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
 from django.utils import timezone
-import datetime
+from . import closure, instrumentation
+import json
+import logging
+
+slow_logger = logging.getLogger('volunteer.performance')
 
 class TimeRestrictionMiddleware:
+    """
+    夜间闭站：闭站时段（settings.SITE_CLOSED_WINDOW）内直接返回休息页，见 volunteer.closure。
+    同步（WSGI）、异步（ASGI）两种模式都支持。
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.closed_window = closure.window()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.closed_response(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.closed_response(request) or await self.get_response(request)
+
+    def closed_response(self, request):
+        """闭站时返回休息页，否则返回 None。"""
         # 1. 【特赦】允许访问静态文件 (CSS/JS/图片)
         # 如果拦截了这些，sleeping.html 就会变丑，而且这些文件不查数据库，放心放行。
-        if request.path.startswith(settings.STATIC_URL) or request.path.startswith(settings.MEDIA_URL):
-            return self.get_response(request)
-
-        # 3. 获取当前时间 (自动适配 settings.py 里的 Asia/Shanghai 时区)
-        now = timezone.localtime(timezone.now()).time()
-        
-        # 4. 设定闭站时间 (晚上 23:00:00 到 早上 07:00:00)
-        start_sleep = datetime.time(23, 0, 0)
-        end_sleep = datetime.time(7, 0, 0)
-
-        # 5. 判断逻辑：如果在 23:00 之后 或者 7:00 之前
-        if now >= start_sleep or now < end_sleep:
-            # === 核心操作 ===
-            # 直接返回渲染好的 HTML，坚决不调用 self.get_response(request)
-            # 这意味着后续的 SessionMiddleware、AuthMiddleware 统统不会执行
-            # 数据库也就根本不知道有这回事。
-            return render(request, 'volunteer/sleeping.html', status=503)
-
-        return self.get_response(request)
\ No newline at end of file
+        if self.closed_window is None or request.path.startswith(settings.STATIC_URL) or request.path.startswith(settings.MEDIA_URL):
+            return None
+
+        # 2. 获取当前时间 (自动适配 settings.py 里的 Asia/Shanghai 时区)
+        now = timezone.localtime(timezone.now())
+
+        if not closure.is_closed(now.time(), self.closed_window):
+            return None
+        # === 核心操作 ===
+        # 直接返回预先渲染好的 HTML，坚决不调用 self.get_response(request)
+        # 这意味着后续的 SessionMiddleware、AuthMiddleware 统统不会执行
+        # 数据库也就根本不知道有这回事。
+        response = HttpResponse(closure.sleeping_page(self.closed_window), status=503)
+        response['Retry-After'] = str(closure.seconds_until_open(now, self.closed_window))
+        response['Cache-Control'] = 'no-store'
+        return response
+
+class RequestMetricsMiddleware:
+    """
+    统计每个请求的 SQL 条数/耗时、视图耗时和模板渲染耗时，SERVER_TIMING_HEADER 开启时写入
+    Server-Timing 响应头（浏览器开发者工具的 Timing 面板可以直接查看）；总耗时超过 SLOW_REQUEST_THRESHOLD_MS
+    时输出一行 JSON 慢请求日志。放在 MIDDLEWARE 最前面，统计范围覆盖其余所有中间件。
+    流式响应（导出）在返回之后才执行的查询不计入。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', 1000) / 1000
+        self.server_timing = getattr(settings, 'SERVER_TIMING_HEADER', False)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = instrumentation.RequestMetrics()
+        token = instrumentation.activate(metrics)
+        try:
+            with connection.execute_wrapper(metrics):
+                response = self.get_response(request)
+        finally:
+            instrumentation.deactivate(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = instrumentation.RequestMetrics()
+        token = instrumentation.activate(metrics)
+        # 异步模式下 SQL 在 sync_to_async 的请求线程里执行，计时回调要装到那个线程的数据库连接上
+        await sync_to_async(lambda: connection.execute_wrappers.append(metrics))()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(lambda: connection.execute_wrappers.remove(metrics))()
+            instrumentation.deactivate(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        total = metrics.elapsed()
+        if self.server_timing:
+            response['Server-Timing'] = self.server_timing_header(metrics, total)
+        if total >= self.threshold:
+            self.log_slow_request(request, response, metrics, total)
+        return response
+
+    @staticmethod
+    def server_timing_header(metrics, total):
+        # 视图耗时 = 总耗时 - 模板渲染耗时（包含视图自己的 SQL 时间）
+        view = max(total - metrics.render_time, 0)
+        return ', '.join([
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries"',
+            f'view;dur={view * 1000:.1f}',
+            f'render;dur={metrics.render_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+    def log_slow_request(self, request, response, metrics, total):
+        match = getattr(request, 'resolver_match', None)
+        # 只读取已经加载过的用户，日志不能为此再查一次 session/用户表
+        user = getattr(request, '_cached_user', None)
+        slowest_sql = metrics.slowest_sql or ''
+        slow_logger.warning(json.dumps({
+            'path': request.path,
+            'method': request.method,
+            'status': response.status_code,
+            'view': match.view_name if match else None,
+            'user_id': user.pk if user is not None and user.is_authenticated else None,
+            'total_ms': round(total * 1000, 1),
+            'queries': metrics.queries,
+            'db_ms': round(metrics.db_time * 1000, 1),
+            'render_ms': round(metrics.render_time * 1000, 1),
+            'slowest_sql_ms': round(metrics.slowest_sql_time * 1000, 1),
+            'slowest_sql': slowest_sql[:instrumentation.SQL_PREVIEW_LENGTH],
+        }, ensure_ascii=False))
@@ -0,0 +1,68 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:02
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+# 迁移只使用历史模型和本文件内的逻辑，不导入 volunteer.counters（以后改动应用代码不影响旧迁移）
+COUNTER_FIELDS = {
+    'Approved': 'approved_count',
+    'Pending': 'pending_count',
+}
+
+
+def _count_subquery(Registration, group_field, status):
+    return Coalesce(
+        Subquery(
+            Registration.objects.filter(**{group_field: OuterRef('pk'), 'status': status})
+            .order_by()
+            .values(group_field)
+            .annotate(c=Count('pk'))
+            .values('c'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def backfill_counters(apps, schema_editor):
+    Activity = apps.get_model('volunteer', 'Activity')
+    ActivitySession = apps.get_model('volunteer', 'ActivitySession')
+    Registration = apps.get_model('volunteer', 'Registration')
+    Activity.objects.update(**{
+        field: _count_subquery(Registration, 'activity', status) for status, field in COUNTER_FIELDS.items()
+    })
+    ActivitySession.objects.update(**{
+        field: _count_subquery(Registration, 'session', status) for status, field in COUNTER_FIELDS.items()
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('volunteer', '0004_messagewall_is_anonymous'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='approved_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='已批准人数'),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='pending_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='待审核人数'),
+        ),
+        migrations.AddField(
+            model_name='activitysession',
+            name='approved_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='已批准人数'),
+        ),
+        migrations.AddField(
+            model_name='activitysession',
+            name='pending_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='待审核人数'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:05
+
+import html
+
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+# 切分规则复用 search.document_text（只处理字符串、不涉及模型），不另抄一份；读写只用历史模型
+from volunteer.search import FTS_TABLE, document_text
+
+
+def build_document(title, description):
+    return document_text(title, html.unescape(strip_tags(description or '')).replace('\xa0', ' '))
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS volunteer_activity_search_gin ON volunteer_activity "
+            "USING gin (to_tsvector('simple'::regconfig, search_document))"
+        )
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(search_document)")
+        except Exception:
+            # 当前 SQLite 未编译 FTS5，检索会退化为普通包含匹配
+            return
+
+    if vendor == 'sqlite':
+        schema_editor.execute(f"DELETE FROM {FTS_TABLE}")
+    Activity = apps.get_model('volunteer', 'Activity')
+    for activity in Activity.objects.only('pk', 'title', 'description').iterator():
+        activity.search_document = build_document(activity.title, activity.description)
+        activity.save(update_fields=['search_document'])
+        if vendor == 'sqlite':
+            schema_editor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, search_document) VALUES (%s, %s)",
+                [activity.pk, activity.search_document],
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS volunteer_activity_search_gin")
+    elif vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('volunteer', '0005_registration_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='检索文本'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import volunteer.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('volunteer', '0006_activity_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('students', '批量创建用户'), ('hours', '上传活动时长')], max_length=20, verbose_name='任务类型')),
+                ('file', models.FileField(blank=True, storage=volunteer.models.import_job_storage, upload_to='%Y%m/', verbose_name='上传文件')),
+                ('status', models.CharField(choices=[('Queued', '排队中'), ('Running', '处理中'), ('Done', '已完成'), ('Failed', '失败')], default='Queued', max_length=10, verbose_name='状态')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='提交时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='最后更新')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='完成时间')),
+                ('total_rows', models.PositiveIntegerField(default=0, verbose_name='总行数')),
+                ('processed_rows', models.PositiveIntegerField(default=0, verbose_name='已处理行数')),
+                ('warnings', models.JSONField(blank=True, default=list, verbose_name='提示信息')),
+                ('summary', models.TextField(blank=True, verbose_name='处理结果')),
+                ('activity', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='volunteer.activity', verbose_name='活动')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='提交人')),
+            ],
+            options={
+                'verbose_name': '导入任务',
+                'verbose_name_plural': '导入任务',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('volunteer', '0007_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankSnapshot',
+            fields=[
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rank_snapshot', serialize=False, to='volunteer.volunteerprofile', verbose_name='志愿者')),
+                ('class_name', models.CharField(blank=True, default='', max_length=100, verbose_name='班级')),
+                ('total_xp', models.PositiveIntegerField(verbose_name='经验值')),
+                ('school_rank', models.PositiveIntegerField(verbose_name='全校排名')),
+                ('school_size', models.PositiveIntegerField(verbose_name='全校人数')),
+                ('grade_rank', models.PositiveIntegerField(verbose_name='年级排名')),
+                ('grade_size', models.PositiveIntegerField(verbose_name='年级人数')),
+                ('class_rank', models.PositiveIntegerField(verbose_name='班级排名')),
+                ('class_size', models.PositiveIntegerField(verbose_name='班级人数')),
+                ('refreshed_at', models.DateTimeField(verbose_name='统计时间')),
+            ],
+            options={
+                'verbose_name': '排名快照',
+                'verbose_name_plural': '排名快照',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='volunteerprofile',
+            index=models.Index(fields=['-total_xp'], name='volunteer_profile_xp_idx'),
+        ),
+        migrations.AddField(
+            model_name='ranksnapshot',
+            name='grade',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='volunteer.grade', verbose_name='年级'),
+        ),
+        migrations.AddIndex(
+            model_name='ranksnapshot',
+            index=models.Index(fields=['school_rank'], name='volunteer_rank_school_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ranksnapshot',
+            index=models.Index(fields=['grade', 'grade_rank'], name='volunteer_rank_grade_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ranksnapshot',
+            index=models.Index(fields=['class_name', 'class_rank'], name='volunteer_rank_class_idx'),
+        ),
+    ]
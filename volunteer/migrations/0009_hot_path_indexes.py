@@ -0,0 +1,37 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('volunteer', '0008_leaderboard'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['status', '-id'], name='volunteer_activity_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['-created_at'], name='volunteer_announcement_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='messagewall',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['-created_at', '-id'], name='volunteer_message_public_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registration',
+            index=models.Index(fields=['activity', 'status'], name='volunteer_reg_act_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registration',
+            index=models.Index(condition=models.Q(('status', 'Rejected'), _negated=True), fields=['session', 'status'], name='volunteer_reg_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registration',
+            index=models.Index(fields=['student', '-registered_at'], name='volunteer_reg_student_time_idx'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:45
+
+from django.db import migrations, models
+
+# 清洗规则和检索切分直接复用 richtext.derive、search.document_text：两者只处理字符串、不涉及模型，
+# 不会因为模型变化而失效；不另抄一份，免得两个 XSS 过滤器分叉。读写只用历史模型。
+# 这里不生成 <picture>（此时还没有处理过的图片），之后可运行 backfill_descriptions 按当前规则重新生成。
+from volunteer.richtext import derive
+from volunteer.search import FTS_TABLE, document_text
+
+BATCH_SIZE = 200
+
+
+def fill_derived_fields(apps, schema_editor):
+    Activity = apps.get_model('volunteer', 'Activity')
+    connection = schema_editor.connection
+    use_fts = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    fields = ['description_html', 'description_text', 'description_excerpt', 'search_document']
+    batch = []
+    activities = Activity.objects.only('pk', 'title', 'description').order_by('pk').iterator(chunk_size=BATCH_SIZE)
+    for activity in activities:
+        for name, value in derive(activity.description).items():
+            setattr(activity, name, value)
+        # 检索文本改由纯文本正文切分，与 0006 写入的旧检索文本可能不同，一并重新生成
+        activity.search_document = document_text(activity.title, activity.description_text)
+        batch.append(activity)
+        if len(batch) >= BATCH_SIZE:
+            _save_batch(Activity, batch, fields, schema_editor, use_fts)
+            batch = []
+    if batch:
+        _save_batch(Activity, batch, fields, schema_editor, use_fts)
+
+
+def _save_batch(Activity, batch, fields, schema_editor, use_fts):
+    Activity.objects.bulk_update(batch, fields)
+    if use_fts:
+        for activity in batch:
+            schema_editor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [activity.pk])
+            schema_editor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, search_document) VALUES (%s, %s)",
+                [activity.pk, activity.search_document],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('volunteer', '0009_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='description_excerpt',
+            field=models.CharField(blank=True, default='', editable=False, max_length=80, verbose_name='活动摘要'),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='description_html',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='活动详情（已清洗）'),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='description_text',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='活动详情（纯文本）'),
+        ),
+        migrations.RunPython(fill_derived_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('volunteer', '0010_activity_description_derived'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=16, unique=True, verbose_name='内容摘要')),
+                ('source', models.CharField(blank=True, db_index=True, default='', max_length=255, verbose_name='原图路径')),
+                ('width', models.PositiveIntegerField(verbose_name='原图宽度')),
+                ('height', models.PositiveIntegerField(verbose_name='原图高度')),
+                ('fallback_format', models.CharField(max_length=4, verbose_name='兼容格式')),
+                ('formats', models.JSONField(default=list, verbose_name='现代格式')),
+                ('widths', models.JSONField(default=list, verbose_name='输出宽度')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='处理时间')),
+            ],
+            options={
+                'verbose_name': '图片',
+                'verbose_name_plural': '图片',
+            },
+        ),
+    ]
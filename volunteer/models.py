@@ -1,6 +1,8 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from ckeditor.fields import RichTextField
+from . import counters, images, richtext, search
 
 class Announcement(models.Model):
     title = models.CharField("标题", max_length=200)
@@ -10,6 +12,9 @@ class Announcement(models.Model):
         verbose_name = "公告"
         verbose_name_plural = "公告"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='volunteer_announcement_idx'),
+        ]
     def __str__(self):
         return self.title
 
@@ -30,6 +35,15 @@ class StudentTag(models.Model):
     def __str__(self):
         return f"{self.name} (+{self.xp_bonus} XP)"
 
+# 段位：(最高等级, 名称)，等级 = total_xp // 100，最后一档不设上限
+RANK_TIERS = (
+    (10, "青铜"),
+    (30, "白银"),
+    (60, "黄金"),
+    (100, "铂金"),
+    (None, "钻石"),
+)
+
 class VolunteerProfile(models.Model):
     GENDER_CHOICES = (('男', '男'), ('女', '女'),)
     user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name="关联用户")
@@ -44,6 +58,10 @@ class VolunteerProfile(models.Model):
     class Meta:
         verbose_name = "志愿者档案"
         verbose_name_plural = "志愿者档案"
+        indexes = [
+            # 排行榜快照按经验值排序
+            models.Index(fields=['-total_xp'], name='volunteer_profile_xp_idx'),
+        ]
     def __str__(self):
         return f"{self.user.first_name} ({self.student_id})"
     
@@ -54,13 +72,21 @@ class VolunteerProfile(models.Model):
     @property
     def rank(self):
         lvl = self.level
-        if lvl <= 10: return "青铜"
-        elif lvl <= 30: return "白银"
-        elif lvl <= 60: return "黄金"
-        elif lvl <= 100: return "铂金"
-        else: return "钻石"
+        for max_level, name in RANK_TIERS:
+            if max_level is None or lvl <= max_level:
+                return name
+
+class RegistrationCountersMixin:
+    """计数器字段只允许由 volunteer.counters 用 F() 增量更新，普通 save() 不回写，避免覆盖并发报名。"""
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in counters.COUNTER_FIELDS.values()
+            ]
+        super().save(*args, **kwargs)
 
-class Activity(models.Model):
+class Activity(RegistrationCountersMixin, models.Model):
     STATUS_CHOICES = (('报名中', '报名中'), ('进行中', '进行中'), ('已结束', '已结束'),)
     GENDER_CHOICES = (('不限', '不限'), ('男', '男'), ('女', '女'),)
     title = models.CharField("活动标题", max_length=200)
@@ -74,24 +100,61 @@ class Activity(models.Model):
     gender_restriction = models.CharField("性别限制", max_length=2, choices=GENDER_CHOICES, default='不限')
     grade_restriction = models.ManyToManyField(Grade, blank=True, verbose_name="年级限制")
     capacity = models.PositiveIntegerField("总名额上限", default=0, help_text="设置为0表示无人数限制")
+    # 冗余计数器，由 volunteer.counters 在每次报名状态变化时维护
+    approved_count = models.PositiveIntegerField("已批准人数", default=0, editable=False)
+    pending_count = models.PositiveIntegerField("待审核人数", default=0, editable=False)
+    # 由 description 派生，保存时由 volunteer.richtext 生成：清洗后的 HTML、纯文本正文和摘要
+    description_html = models.TextField("活动详情（已清洗）", blank=True, default='', editable=False)
+    description_text = models.TextField("活动详情（纯文本）", blank=True, default='', editable=False)
+    description_excerpt = models.CharField("活动摘要", max_length=richtext.EXCERPT_LENGTH, blank=True, default='', editable=False)
+    # 检索用的分词文本，保存时由 volunteer.search 生成
+    search_document = models.TextField("检索文本", blank=True, default='', editable=False)
 
     class Meta:
         verbose_name = "活动"
         verbose_name_plural = "活动"
+        indexes = [
+            # 活动大厅：status = '报名中' ORDER BY id DESC
+            models.Index(fields=['status', '-id'], name='volunteer_activity_status_idx'),
+        ]
     def __str__(self):
         return self.title
 
+    # 列表页、API 用不到的大字段
+    HEAVY_FIELDS = ('description', 'description_html', 'description_text', 'search_document')
+
+    def save(self, *args, **kwargs):
+        richtext.apply(self)
+        self.search_document = search.build_document(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'title', 'description'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'description_html', 'description_text', 'description_excerpt', 'search_document'}
+        super().save(*args, **kwargs)
+        search.sync_index(self)
+
     @property
     def approved_registrations_count(self):
-        return self.registration_set.filter(status='Approved').count()
+        return self.approved_count
+
+    @property
+    def seats_taken(self):
+        # 待审核的报名同样占用名额，与 reservations.reserve_seat 的判断一致
+        return self.approved_count + self.pending_count
 
-class ActivitySession(models.Model):
+    @property
+    def is_full(self):
+        if self.capacity == 0: return False
+        return self.seats_taken >= self.capacity
+
+class ActivitySession(RegistrationCountersMixin, models.Model):
     activity = models.ForeignKey(Activity, on_delete=models.CASCADE, related_name='sessions', verbose_name="所属活动")
     date = models.DateField("日期")
     start_time = models.TimeField("开始时间")
     end_time = models.TimeField("结束时间")
     location = models.CharField("地点", max_length=100, blank=True)
     capacity = models.PositiveIntegerField("本场次名额", default=0)
+    approved_count = models.PositiveIntegerField("已批准人数", default=0, editable=False)
+    pending_count = models.PositiveIntegerField("待审核人数", default=0, editable=False)
 
     class Meta:
         verbose_name = "活动场次"
@@ -103,7 +166,7 @@ class ActivitySession(models.Model):
     
     @property
     def current_count(self):
-        return self.registrations.exclude(status='Rejected').count()
+        return self.approved_count + self.pending_count
 
     @property
     def is_full(self):
@@ -131,9 +194,36 @@ class Registration(models.Model):
         verbose_name = "报名记录"
         verbose_name_plural = "报名记录"
         unique_together = ('student', 'activity', 'session')
+        # (student, activity) 的查询直接使用 unique_together 的索引前缀，不再单独建索引
+        indexes = [
+            # 按活动筛选审核状态（批量审核、导入时长、导出）
+            models.Index(fields=['activity', 'status'], name='volunteer_reg_act_status_idx'),
+            # 场次已占名额：只索引计入名额的报名（已拒绝的不占名额）
+            models.Index(fields=['session', 'status'], condition=~models.Q(status='Rejected'), name='volunteer_reg_session_idx'),
+            # 个人主页：我的报名按时间倒序
+            models.Index(fields=['student', '-registered_at'], name='volunteer_reg_student_time_idx'),
+        ]
     def __str__(self):
         return f"{self.student} 报名了 {self.activity} ({self.get_status_display()})"
 
+    def _locked_counter_key(self):
+        # 计数器增量按库里当前的状态算，不能用读出实例时的状态：
+        # 读出之后 counters.set_status 或并发请求可能已经改过这一行。加行锁防止保存前再被改掉
+        return Registration.objects.select_for_update().filter(pk=self.pk).values_list(
+            'activity_id', 'session_id', 'status').first()
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            old_key = None if self._state.adding else self._locked_counter_key()
+            super().save(*args, **kwargs)
+            counters.record_change(old_key, counters.counter_key(self))
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            # 供 post_delete 信号释放计数器（见 signals.release_registration_counters）
+            self._counted_key = self._locked_counter_key()
+            return super().delete(*args, **kwargs)
+
 # === [新增] 留言墙模型 ===
 class MessageWall(models.Model):
     COLOR_CHOICES = (
@@ -155,6 +245,121 @@ class MessageWall(models.Model):
         verbose_name = "心声/留言"
         verbose_name_plural = "心声/留言"
         ordering = ['-created_at']
+        indexes = [
+            # 留言墙游标分页：is_public = true ORDER BY created_at DESC, id DESC
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_public=True), name='volunteer_message_public_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user.first_name}: {self.content[:20]}..."
\ No newline at end of file
+        return f"{self.user.first_name}: {self.content[:20]}..."
+
+# === 经验值排行榜快照 ===
+class RankSnapshot(models.Model):
+    """
+    定期整体重算的排名快照（volunteer.leaderboard.refresh_rank_snapshot），
+    查询"我的排名"只需按主键取一行，排行榜按 (范围, 名次) 索引顺序读取前几十行。
+    """
+    profile = models.OneToOneField(VolunteerProfile, on_delete=models.CASCADE, primary_key=True, related_name='rank_snapshot', verbose_name="志愿者")
+    grade = models.ForeignKey(Grade, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="年级")
+    class_name = models.CharField("班级", max_length=100, blank=True, default='')
+    total_xp = models.PositiveIntegerField("经验值")
+    school_rank = models.PositiveIntegerField("全校排名")
+    school_size = models.PositiveIntegerField("全校人数")
+    grade_rank = models.PositiveIntegerField("年级排名")
+    grade_size = models.PositiveIntegerField("年级人数")
+    class_rank = models.PositiveIntegerField("班级排名")
+    class_size = models.PositiveIntegerField("班级人数")
+    refreshed_at = models.DateTimeField("统计时间")
+
+    class Meta:
+        verbose_name = "排名快照"
+        verbose_name_plural = "排名快照"
+        indexes = [
+            models.Index(fields=['school_rank'], name='volunteer_rank_school_idx'),
+            models.Index(fields=['grade', 'grade_rank'], name='volunteer_rank_grade_idx'),
+            models.Index(fields=['class_name', 'class_rank'], name='volunteer_rank_class_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.profile_id}: 第 {self.school_rank} 名"
+
+# === 后台导入任务 ===
+def import_job_storage():
+    # 上传的名单里有初始密码，不能放在 nginx 公开的 MEDIA_ROOT 下
+    from django.core.files.storage import FileSystemStorage
+    return FileSystemStorage(location=settings.IMPORT_JOBS_ROOT)
+
+class ImportJob(models.Model):
+    KIND_CHOICES = (
+        ('students', '批量创建用户'),
+        ('hours', '上传活动时长'),
+    )
+    STATUS_CHOICES = (
+        ('Queued', '排队中'),
+        ('Running', '处理中'),
+        ('Done', '已完成'),
+        ('Failed', '失败'),
+    )
+
+    kind = models.CharField("任务类型", max_length=20, choices=KIND_CHOICES)
+    activity = models.ForeignKey(Activity, on_delete=models.CASCADE, null=True, blank=True, verbose_name="活动")
+    file = models.FileField("上传文件", upload_to='%Y%m/', storage=import_job_storage, blank=True)
+    status = models.CharField("状态", max_length=10, choices=STATUS_CHOICES, default='Queued')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="提交人")
+    created_at = models.DateTimeField("提交时间", auto_now_add=True)
+    updated_at = models.DateTimeField("最后更新", auto_now=True)
+    finished_at = models.DateTimeField("完成时间", null=True, blank=True)
+    total_rows = models.PositiveIntegerField("总行数", default=0)
+    processed_rows = models.PositiveIntegerField("已处理行数", default=0)
+    warnings = models.JSONField("提示信息", default=list, blank=True)
+    summary = models.TextField("处理结果", blank=True)
+
+    class Meta:
+        verbose_name = "导入任务"
+        verbose_name_plural = "导入任务"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.get_status_display()})"
+
+    @property
+    def is_finished(self):
+        return self.status in ('Done', 'Failed')
+
+
+class ProcessedImage(models.Model):
+    """CKEditor 上传图片处理后的各尺寸、各格式文件，文件名为 img/<digest>-<宽度>.<扩展名>（见 volunteer.images）。"""
+    digest = models.CharField("内容摘要", max_length=16, unique=True)
+    # 由 reprocess_images 处理的已有上传记下原图路径（相对 MEDIA_ROOT），富文本里引用原图时据此替换
+    source = models.CharField("原图路径", max_length=255, blank=True, default='', db_index=True)
+    width = models.PositiveIntegerField("原图宽度")
+    height = models.PositiveIntegerField("原图高度")
+    fallback_format = models.CharField("兼容格式", max_length=4)
+    formats = models.JSONField("现代格式", default=list)
+    widths = models.JSONField("输出宽度", default=list)
+    created_at = models.DateTimeField("处理时间", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "图片"
+        verbose_name_plural = "图片"
+
+    def __str__(self):
+        return self.source or self.digest
+
+    def url(self, width, extension):
+        return settings.MEDIA_URL + images.variant_name(self.digest, width, extension)
+
+    def srcset(self, extension):
+        return ', '.join(f'{self.url(width, extension)} {width}w' for width in self.widths)
+
+    @property
+    def src(self):
+        return self.url(self.widths[-1], self.fallback_format)
+
+    @property
+    def sizes(self):
+        return f'(max-width: {self.widths[-1]}px) 100vw, {self.widths[-1]}px'
+
+    def sources(self):
+        """<picture> 里的 <source>：(MIME 类型, srcset)，按 formats 的优先顺序。"""
+        return [(images.MIME_TYPES[extension], self.srcset(extension)) for extension in self.formats]
@@ -0,0 +1,75 @@
+"""
+报名抢座。
+
+活动开放报名时会有大量学生同时提交，先 COUNT 再 INSERT 的写法会超卖。
+这里用一次带条件的原子 UPDATE 同时完成"判断是否还有名额"和"占座"：
+UPDATE ... SET pending_count = pending_count + 1 WHERE capacity = 0 OR capacity > approved_count + pending_count
+更新不到行就说明名额已满，直接返回，不做重试。
+PostgreSQL 下并发的 UPDATE 会在行锁上排队，拿到锁后重新判断 WHERE 条件；
+SQLite 下写事务本身就是串行的。
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+
+from . import caching
+from .models import Activity, ActivitySession, Registration
+
+SEATS_TAKEN = F('approved_count') + F('pending_count')
+HAS_FREE_SEAT = Q(capacity=0) | Q(capacity__gt=SEATS_TAKEN)
+
+
+class ReservationError(Exception):
+    message = '报名失败'
+
+    def __str__(self):
+        return self.message
+
+
+class SoldOut(ReservationError):
+    message = '名额已满'
+
+
+class SessionSoldOut(SoldOut):
+    message = '该场次名额已满'
+
+
+class AlreadyRegistered(ReservationError):
+    message = '已报名'
+
+
+def _take_seat(model, pk, extra_filter=None):
+    queryset = model.objects.filter(HAS_FREE_SEAT, pk=pk)
+    if extra_filter:
+        queryset = queryset.filter(**extra_filter)
+    return queryset.update(pending_count=F('pending_count') + 1) == 1
+
+
+def reserve_seat(profile, activity, session, **details):
+    """
+    在一个短事务内为学生占一个名额并创建待审核报名。
+    先锁活动行、再锁场次行（固定顺序，避免死锁），任何一级满员都会整体回滚。
+    成功返回 Registration，失败抛出 SoldOut / SessionSoldOut / AlreadyRegistered。
+    """
+    try:
+        with transaction.atomic():
+            if not _take_seat(Activity, activity.pk):
+                raise SoldOut()
+            # 活动行锁已持有，同一学生的并发请求在这里排队，不会重复报名
+            if Registration.objects.filter(student=profile, activity_id=activity.pk).exists():
+                raise AlreadyRegistered()
+            if not _take_seat(ActivitySession, session.pk, {'activity_id': activity.pk}):
+                raise SessionSoldOut()
+
+            registration = Registration(
+                student=profile,
+                activity_id=activity.pk,
+                session=session,
+                status='Pending',
+                **details
+            )
+            # 计数器已经在上面加过了，bulk_create 不走 save()，避免重复计数
+            Registration.objects.bulk_create([registration])
+            caching.invalidate(caching.ACTIVITIES)
+    except IntegrityError:
+        raise AlreadyRegistered()
+    return registration
@@ -0,0 +1,217 @@
+"""
+活动详情（CKEditor 富文本）的派生字段。
+
+Activity.description 是管理员在 CKEditor 里编辑的原始 HTML，保存时（见 Activity.save）一次性生成：
+  - description_html：白名单清洗后的 HTML，详情页直接输出，不会带出 <script>、事件属性和 javascript: 链接；
+    图片加上 loading="lazy"，外链加上 rel="noopener"；处理过的上传图片（见 images.py）换成带 srcset 的 <picture>；
+  - description_text：纯文本正文，检索文本由它切分；
+  - description_excerpt：列表页和 API 用的摘要。
+只依赖标准库的 html.parser，不引入 bleach 之类的额外组件。
+已有数据或清洗规则调整后运行 backfill_descriptions 重新生成。
+"""
+import html
+import re
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from django.utils.text import Truncator
+
+EXCERPT_LENGTH = 80
+BACKFILL_BATCH_SIZE = 200
+
+ALLOWED_TAGS = {
+    'p', 'br', 'div', 'span', 'strong', 'b', 'em', 'i', 'u', 's', 'strike', 'sub', 'sup', 'small',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'code', 'hr',
+    'ol', 'ul', 'li', 'a', 'img', 'figure', 'figcaption',
+    'table', 'caption', 'thead', 'tbody', 'tfoot', 'tr', 'th', 'td', 'colgroup', 'col',
+}
+VOID_TAGS = {'br', 'hr', 'img', 'col'}
+# 连同内容一起丢弃
+DROP_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'noscript', 'template', 'textarea', 'select'}
+ALLOWED_ATTRIBUTES = {
+    '*': {'style', 'title'},
+    'a': {'href', 'target'},
+    'img': {'src', 'alt', 'width', 'height'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan', 'scope'},
+    'col': {'span'},
+    'ol': {'start', 'type'},
+    'table': {'border', 'cellpadding', 'cellspacing'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+ALLOWED_SCHEMES = {'', 'http', 'https', 'mailto', 'tel'}
+# CKEditor 工具栏会写出的内联样式
+ALLOWED_STYLES = {
+    'color', 'background-color', 'text-align', 'text-decoration', 'font-size', 'font-weight', 'font-style',
+    'font-family', 'line-height', 'margin-left', 'margin-right', 'padding', 'width', 'height', 'float',
+    'border', 'border-collapse', 'vertical-align',
+}
+UNSAFE_STYLE_VALUE = re.compile(r'url\s*\(|expression\s*\(|javascript:|[<>\\]', re.IGNORECASE)
+BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'hr', 'figcaption', 'caption'}
+
+
+def _safe_url(value):
+    # 去掉控制字符和空白后再判断协议，防止 "java\tscript:" 之类的绕过
+    compact = re.sub(r'[\x00-\x20]+', '', value)
+    try:
+        scheme = urlsplit(compact).scheme.lower()
+    except ValueError:
+        return False
+    return scheme in ALLOWED_SCHEMES
+
+
+def _clean_style(value):
+    declarations = []
+    for declaration in value.split(';'):
+        name, _, style_value = declaration.partition(':')
+        name, style_value = name.strip().lower(), style_value.strip()
+        if name in ALLOWED_STYLES and style_value and not UNSAFE_STYLE_VALUE.search(style_value):
+            declarations.append(f'{name}: {style_value}')
+    return '; '.join(declarations)
+
+
+def _attributes(attrs):
+    return ''.join(f' {name}="{html.escape(value)}"' for name, value in attrs.items())
+
+
+class _Sanitizer(HTMLParser):
+    def __init__(self, image_variants=None):
+        super().__init__(convert_charrefs=True)
+        self.image_variants = image_variants
+        self.html = []
+        self.text = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            if tag not in VOID_TAGS:
+                self.dropping += 1
+            return
+        if self.dropping:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append('\n')
+        if tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES['*'] | ALLOWED_ATTRIBUTES.get(tag, set())
+        cleaned = {}
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRIBUTES and not _safe_url(value):
+                continue
+            if name == 'style':
+                value = _clean_style(value)
+                if not value:
+                    continue
+            cleaned[name] = value
+        if tag == 'a' and cleaned.get('target') == '_blank':
+            cleaned['rel'] = 'noopener noreferrer'
+        if tag == 'img':
+            cleaned.setdefault('loading', 'lazy')
+            cleaned.setdefault('decoding', 'async')
+            if self._picture(cleaned):
+                return
+        self.html.append(f'<{tag}{_attributes(cleaned)}>')
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def _picture(self, attrs):
+        """图片有处理好的多尺寸版本时输出 <picture>，浏览器按屏幕宽度和支持的格式自选。"""
+        processed = self.image_variants(attrs['src']) if self.image_variants and attrs.get('src') else None
+        if processed is None:
+            return False
+        attrs.update(src=processed.src, srcset=processed.srcset(processed.fallback_format), sizes=processed.sizes)
+        sources = ''.join(
+            f'<source{_attributes({"type": mime_type, "srcset": srcset, "sizes": processed.sizes})}>'
+            for mime_type, srcset in processed.sources()
+        )
+        self.html.append(f'<picture>{sources}<img{_attributes(attrs)}></picture>')
+        return True
+
+    def handle_startendtag(self, tag, attrs):
+        # <script/>、<iframe/> 之类自闭合写法没有内容可丢，不能进入丢弃状态，否则后面的正文全部丢失
+        if tag in DROP_CONTENT_TAGS:
+            return
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and tag in ALLOWED_TAGS and not self.dropping and self.open_tags and self.open_tags[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # 补上未闭合的内层标签，保证输出的标签嵌套完整
+        while self.open_tags:
+            current = self.open_tags.pop()
+            self.html.append(f'</{current}>')
+            if current == tag:
+                break
+        if tag in BLOCK_TAGS:
+            self.text.append('\n')
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        self.html.append(html.escape(data, quote=False))
+        self.text.append(data)
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.html.append(f'</{self.open_tags.pop()}>')
+
+
+def render(value, image_variants=None):
+    """
+    返回 (清洗后的 HTML, 纯文本)。
+    image_variants(src) 返回图片的 ProcessedImage，没有时返回 None。
+    """
+    parser = _Sanitizer(image_variants)
+    parser.feed(value or '')
+    parser.close()
+    lines = (' '.join(line.replace('\xa0', ' ').split()) for line in ''.join(parser.text).split('\n'))
+    return ''.join(parser.html), '\n'.join(line for line in lines if line)
+
+
+def excerpt(text, length=EXCERPT_LENGTH):
+    return Truncator(' '.join(text.split())).chars(length)
+
+
+def derive(description, image_variants=None):
+    """由原始 HTML 生成三个派生字段的值。只处理字符串、不涉及模型，迁移 0010 回填时也用它。"""
+    cleaned, text = render(description, image_variants)
+    return {'description_html': cleaned, 'description_text': text, 'description_excerpt': excerpt(text)}
+
+
+def apply(activity):
+    """按 activity.description 填好三个派生字段（不保存）。"""
+    from .images import variants_for_url
+
+    for name, value in derive(activity.description, variants_for_url).items():
+        setattr(activity, name, value)
+    return activity
+
+
+def backfill(queryset, batch_size=BACKFILL_BATCH_SIZE):
+    """重新生成 queryset 中所有活动的派生字段，按批 bulk_update，返回处理的活动数。"""
+    from . import caching
+
+    fields = ['description_html', 'description_text', 'description_excerpt']
+    count = 0
+    batch = []
+    for activity in queryset.only('pk', 'description').order_by('pk').iterator(chunk_size=batch_size):
+        batch.append(apply(activity))
+        if len(batch) >= batch_size:
+            type(activity).objects.bulk_update(batch, fields)
+            count += len(batch)
+            batch = []
+    if batch:
+        type(batch[0]).objects.bulk_update(batch, fields)
+        count += len(batch)
+    # bulk_update 不触发信号，手动让活动缓存失效
+    caching.invalidate(caching.ACTIVITIES)
+    return count
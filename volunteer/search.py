@@ -0,0 +1,141 @@
+"""
+活动全文检索。
+
+活动详情是 CKEditor 的 HTML，直接 icontains 既会全表扫描，又会匹配到标签属性。
+这里在保存时把标题和纯文本正文（Activity.description_text，见 richtext.py）切分成词元，存入 Activity.search_document：
+  - 中文没有空格分词，采用"单字 + 相邻双字"切分（志愿者 -> 志 愿 者 志愿 愿者），
+    不依赖 jieba/zhparser 之类的额外组件，查询时用同样的规则切分，再要求所有词元同时命中；
+  - 英文/数字按单词小写化。
+PostgreSQL 上对 to_tsvector('simple', search_document) 建 GIN 表达式索引，
+本地 SQLite 上维护一张 FTS5 虚拟表 volunteer_activity_fts（rowid = 活动 id）。
+两种后端都按相关度排序。
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField, Func, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'volunteer_activity_fts'
+CJK_RUN = re.compile(r'[㐀-䶿一-鿿豈-﫿]+')
+WORD = re.compile(r'[㐀-䶿一-鿿豈-﫿]+|[0-9a-z]+')
+
+
+def tokenize(text, for_query=False):
+    """切分文本为词元列表。查询时中文只用双字（单个汉字时用单字），索引时单字、双字都存。"""
+    tokens = []
+    for word in WORD.findall((text or '').lower()):
+        if not CJK_RUN.fullmatch(word):
+            tokens.append(word)
+            continue
+        bigrams = [word[i:i + 2] for i in range(len(word) - 1)]
+        if for_query:
+            tokens.extend(bigrams or [word])
+        else:
+            tokens.extend(word)
+            tokens.extend(bigrams)
+    return tokens
+
+
+def document_text(title, text):
+    # 标题词元重复一次，相关度排序时标题命中权重更高
+    title_tokens = tokenize(title)
+    return ' '.join(title_tokens + title_tokens + tokenize(text))
+
+
+def build_document(activity):
+    return document_text(activity.title, activity.description_text)
+
+
+_fts5_tables = {}
+
+
+def fts5_available():
+    if connection.vendor != 'sqlite':
+        return False
+    # 按数据库文件缓存探测结果（测试时会切换到测试库）
+    name = str(connection.settings_dict['NAME'])
+    if name not in _fts5_tables:
+        _fts5_tables[name] = FTS_TABLE in connection.introspection.table_names()
+    return _fts5_tables[name]
+
+
+def sync_index(activity):
+    """保存后同步 SQLite FTS5 表；PostgreSQL 的 GIN 表达式索引由数据库自动维护。"""
+    if not fts5_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [activity.pk])
+        cursor.execute(f"INSERT INTO {FTS_TABLE} (rowid, search_document) VALUES (%s, %s)", [activity.pk, activity.search_document])
+
+
+def rebuild_index(queryset):
+    """重新生成 queryset 中所有活动的检索文本并同步索引，返回处理的活动数。"""
+    count = 0
+    for activity in queryset.only('pk', 'title', 'description_text').iterator(chunk_size=200):
+        activity.search_document = build_document(activity)
+        type(activity).objects.filter(pk=activity.pk).update(search_document=activity.search_document)
+        sync_index(activity)
+        count += 1
+    return count
+
+
+def remove_from_index(activity_pk):
+    if not fts5_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [activity_pk])
+
+
+class TSVector(Func):
+    # 必须与迁移中 GIN 索引的表达式完全一致，否则用不上索引
+    template = "to_tsvector('simple'::regconfig, %(expressions)s)"
+
+
+class TSQuery(Func):
+    template = "plainto_tsquery('simple'::regconfig, %(expressions)s)"
+
+
+class TSMatch(Func):
+    template = "%(expressions)s"
+    arg_joiner = ' @@ '
+    output_field = BooleanField()
+
+
+class TSRank(Func):
+    function = 'ts_rank'
+    output_field = FloatField()
+
+
+def search_activities(queryset, query):
+    """在 queryset 中按关键字检索活动，并按相关度（高到低）排序。"""
+    tokens = tokenize(query, for_query=True)
+    if not tokens:
+        return queryset.none()
+
+    if connection.vendor == 'postgresql':
+        vector = TSVector(F('search_document'))
+        tsquery = TSQuery(Value(' '.join(tokens)))
+        return (queryset
+                .filter(TSMatch(vector, tsquery))
+                .annotate(search_rank=TSRank(vector, tsquery))
+                .order_by('-search_rank', '-id'))
+
+    if fts5_available():
+        match = ' '.join('"%s"' % token for token in tokens)
+        # bm25() 越小越相关，这里取负数以便统一按 -search_rank 排序
+        rank = RawSQL(
+            f"SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = volunteer_activity.id",
+            [match],
+            output_field=FloatField(),
+        )
+        hits = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+        return (queryset
+                .filter(pk__in=hits)
+                .annotate(search_rank=rank)
+                .order_by('-search_rank', '-id'))
+
+    # 其他数据库：退化为在切分后的纯文本上做包含匹配
+    for token in tokens:
+        queryset = queryset.filter(search_document__contains=token)
+    return queryset
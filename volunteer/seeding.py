@@ -0,0 +1,206 @@
+"""
+压测数据生成。
+
+按线上一个学年的量级批量造数：几万名志愿者（带年级、标签）、几百个活动和场次、
+几十万条报名记录和留言，全部用 bulk_create 写入，之后统一重算计数器、检索文本和经验值。
+生成的账号用户名都以 prefix 开头，活动标题都以 TITLE_MARKER 开头，方便整体清理。
+"""
+import datetime
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from . import counters, leaderboard, richtext, search, xp
+from .models import Activity, ActivitySession, Grade, MessageWall, Registration, StudentTag, VolunteerProfile
+
+BATCH_SIZE = 2000
+TITLE_MARKER = '[压测]'
+SEED_PASSWORD = 'loadtest123'
+
+GRADE_NAMES = ['21', '22', '23', '24']
+MAJORS = ['计算机', '电子商务', '会计', '机电', '护理', '物流', '旅游管理', '软件技术']
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗'
+GIVEN_NAMES = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉萍红'
+TAGS = [('班长', 20), ('团支书', 20), ('学生会', 15), ('社团骨干', 10), ('党员', 10), ('优秀志愿者', 30)]
+ACTIVITY_TOPICS = ['社区敬老', '图书馆整理', '校园迎新', '马拉松服务', '垃圾分类宣传', '献血引导', '支教', '博物馆讲解']
+LOCATIONS = ['图书馆', '体育馆', '行政楼', '社区服务中心', '市民广场', '南门']
+PHRASES = [
+    '本次活动需要志愿者协助现场秩序维护与引导工作。',
+    '请穿着统一志愿者服装，提前十五分钟到达集合地点签到。',
+    '活动结束后将根据实际服务情况认定志愿时长。',
+    '欢迎有相关经验的同学踊跃报名，名额有限先到先得。',
+    '如因故无法参加，请提前联系负责人取消报名。',
+]
+MESSAGES = ['今天的活动很有意义！', '感谢学长学姐的帮助', '下次还要报名', '志愿服务，快乐你我', '辛苦大家了', '期待下一次相遇']
+
+
+def _batches(items, size=BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _backdate(model, field, values):
+    """bulk_create 时 auto_now_add 字段都是当前时间，这里按 {主键: 时间} 分批改写成分散的历史时间。"""
+    for batch in _batches(list(values.items()), 500):
+        model.objects.filter(pk__in=[pk for pk, _ in batch]).update(**{field: Case(
+            *[When(pk=pk, then=Value(value)) for pk, value in batch],
+            output_field=DateTimeField(),
+        )})
+
+
+def clear_seed_data(prefix):
+    """删除之前生成的压测数据（报名、留言随用户/活动级联删除）。"""
+    with transaction.atomic():
+        users, _ = User.objects.filter(username__startswith=prefix).delete()
+        activities, _ = Activity.objects.filter(title__startswith=TITLE_MARKER).delete()
+    return users, activities
+
+
+def seed_load_data(profiles=20000, activities=300, registrations=200000, messages=100000,
+                   prefix='load', random_seed=0, progress=None):
+    """生成压测数据，返回各表实际写入的行数。"""
+    rng = random.Random(random_seed)
+    now = timezone.now()
+    report = progress or (lambda message: None)
+    created = {}
+
+    grades = {}
+    for name in GRADE_NAMES:
+        grades[name], _ = Grade.objects.get_or_create(name=name)
+    tags = [StudentTag.objects.get_or_create(name=name, defaults={'xp_bonus': bonus})[0] for name, bonus in TAGS]
+
+    # 1. 账号与档案：所有账号共用一个密码哈希，造几万个账号不必每个都跑一遍 PBKDF2
+    password = make_password(SEED_PASSWORD)
+    user_ids = []
+    for batch in _batches(range(profiles)):
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}{i:06d}', first_name=rng.choice(SURNAMES) + ''.join(rng.choices(GIVEN_NAMES, k=rng.randint(1, 2))),
+                 password=password, date_joined=now)
+            for i in batch
+        ])
+        if any(u.pk is None for u in users):
+            users = User.objects.filter(username__in=[u.username for u in users]).order_by('username')
+        user_ids.extend(u.pk for u in users)
+    report(f"已创建 {len(user_ids)} 个账号")
+
+    profile_ids, class_names = [], {}
+    for batch in _batches(list(enumerate(user_ids))):
+        rows = []
+        for i, user_id in batch:
+            grade_name = rng.choice(GRADE_NAMES)
+            hours = int(rng.expovariate(1 / 20))
+            rows.append(VolunteerProfile(
+                user_id=user_id, student_id=f'{prefix}{i:06d}', gender=rng.choice('男女'),
+                grade=grades[grade_name], class_name=f'{grade_name}级{rng.choice(MAJORS)}{rng.randint(1, 6)}班',
+                total_hours=hours, total_xp=hours,
+            ))
+        VolunteerProfile.objects.bulk_create(rows)
+        if any(p.pk is None for p in rows):
+            rows = VolunteerProfile.objects.filter(user_id__in=[p.user_id for p in rows]).order_by('user_id')
+        profile_ids.extend(p.pk for p in rows)
+        class_names.update((p.pk, p.class_name) for p in rows)
+    created['profiles'] = len(profile_ids)
+
+    # 约三分之一的学生有职务标签
+    Through = VolunteerProfile.tags.through
+    Through.objects.bulk_create([
+        Through(volunteerprofile_id=pk, studenttag_id=tag.pk)
+        for pk in profile_ids if rng.random() < 0.33
+        for tag in rng.sample(tags, rng.randint(1, 2))
+    ], batch_size=BATCH_SIZE)
+    report(f"已创建 {len(profile_ids)} 份志愿者档案")
+
+    # 2. 活动与场次
+    activity_rows = []
+    for i in range(activities):
+        start = (now - datetime.timedelta(days=rng.randint(-30, 330))).date()
+        status = '报名中' if start > now.date() else rng.choice(['进行中', '已结束', '已结束', '已结束'])
+        activity = Activity(
+            title=f'{TITLE_MARKER}{rng.choice(ACTIVITY_TOPICS)}第{i + 1}期',
+            description=''.join(f'<p>{rng.choice(PHRASES)}</p>' for _ in range(rng.randint(2, 6))),
+            status=status, start_date=start, end_date=start + datetime.timedelta(days=rng.randint(0, 3)),
+            hours_reward=rng.randint(1, 8), min_xp=rng.choice([0, 0, 0, 50, 100]),
+            gender_restriction=rng.choice(['不限'] * 8 + ['男', '女']),
+            capacity=rng.choice([0, 0, 30, 50, 100, 200, 500]),
+        )
+        richtext.apply(activity)
+        activity.search_document = search.build_document(activity)
+        activity_rows.append(activity)
+    activity_rows = Activity.objects.bulk_create(activity_rows, batch_size=BATCH_SIZE)
+    if any(a.pk is None for a in activity_rows):
+        activity_rows = list(Activity.objects.filter(title__startswith=TITLE_MARKER).order_by('pk'))
+    search.rebuild_index(Activity.objects.filter(pk__in=[a.pk for a in activity_rows]))
+
+    GradeRestriction = Activity.grade_restriction.through
+    GradeRestriction.objects.bulk_create([
+        GradeRestriction(activity_id=a.pk, grade_id=grades[name].pk)
+        for a in activity_rows if rng.random() < 0.2
+        for name in rng.sample(GRADE_NAMES, 2)
+    ])
+
+    session_rows = []
+    for activity in activity_rows:
+        for day in range(rng.randint(1, 4)):
+            hour = rng.choice([8, 9, 13, 14])
+            session_rows.append(ActivitySession(
+                activity_id=activity.pk, date=activity.start_date + datetime.timedelta(days=day),
+                start_time=datetime.time(hour, 0), end_time=datetime.time(hour + 3, 0),
+                location=rng.choice(LOCATIONS), capacity=rng.choice([0, 20, 50]),
+            ))
+    session_rows = ActivitySession.objects.bulk_create(session_rows, batch_size=BATCH_SIZE)
+    if any(s.pk is None for s in session_rows):
+        session_rows = list(ActivitySession.objects.filter(activity__title__startswith=TITLE_MARKER))
+    sessions = {}
+    for session in session_rows:
+        sessions.setdefault(session.activity_id, []).append(session.pk)
+    created['activities'] = len(activity_rows)
+    created['sessions'] = len(session_rows)
+    report(f"已创建 {len(activity_rows)} 个活动、{len(session_rows)} 个场次")
+
+    # 3. 报名记录：热门活动报名人数多，每个学生在同一活动只报名一次
+    weights = [rng.paretovariate(1.2) for _ in activity_rows]
+    scale = registrations / sum(weights)
+    per_activity = [min(len(profile_ids), round(w * scale)) for w in weights]
+    registration_rows, registered_at = [], []
+    for activity, count in zip(activity_rows, per_activity):
+        opened = datetime.datetime.combine(activity.start_date, datetime.time(8), tzinfo=now.tzinfo) - datetime.timedelta(days=14)
+        for student_id in rng.sample(profile_ids, count):
+            status = rng.choices(['Approved', 'Pending', 'Rejected'], [60, 25, 15])[0]
+            registration_rows.append(Registration(
+                student_id=student_id, activity_id=activity.pk, session_id=rng.choice(sessions[activity.pk]),
+                phone_number=f'1{rng.randint(3, 9)}{rng.randint(0, 999999999):09d}',
+                class_name=class_names[student_id], headteacher_name=rng.choice(SURNAMES) + '老师', status=status,
+                hours_awarded=activity.hours_reward if status == 'Approved' and activity.status == '已结束' else 0,
+            ))
+            registered_at.append(min(now, opened + datetime.timedelta(minutes=rng.randint(0, 14 * 24 * 60))))
+    for batch in _batches(list(zip(registration_rows, registered_at))):
+        rows = Registration.objects.bulk_create([r for r, _ in batch])
+        if all(r.pk for r in rows):
+            _backdate(Registration, 'registered_at', {r.pk: at for r, (_, at) in zip(rows, batch)})
+    created['registrations'] = len(registration_rows)
+    report(f"已创建 {len(registration_rows)} 条报名记录")
+
+    # 4. 留言墙
+    message_rows, message_times = [], []
+    for _ in range(messages):
+        message_rows.append(MessageWall(
+            user_id=rng.choice(user_ids), content=rng.choice(MESSAGES), color=rng.choice(MessageWall.COLOR_CHOICES)[0],
+            is_public=rng.random() < 0.95, is_anonymous=rng.random() < 0.2,
+        ))
+        message_times.append(now - datetime.timedelta(seconds=rng.randint(0, 365 * 24 * 3600)))
+    for batch in _batches(list(zip(message_rows, message_times))):
+        rows = MessageWall.objects.bulk_create([m for m, _ in batch])
+        if all(m.pk for m in rows):
+            _backdate(MessageWall, 'created_at', {m.pk: at for m, (_, at) in zip(rows, batch)})
+    created['messages'] = len(message_rows)
+    report(f"已创建 {len(message_rows)} 条留言")
+
+    # 5. 冗余数据：计数器、经验值、排名快照
+    counters.rebuild_counters(activity_ids=[a.pk for a in activity_rows])
+    xp.recalculate_xp(VolunteerProfile.objects.filter(student_id__startswith=prefix))
+    leaderboard.refresh_rank_snapshot()
+    return created
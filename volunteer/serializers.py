@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import VolunteerProfile, Activity, Grade
+from .models import VolunteerProfile, Activity, Grade, RankSnapshot
 
 class GradeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -26,4 +26,40 @@ class UserSerializer(serializers.ModelSerializer):
 class ActivitySerializer(serializers.ModelSerializer):
     class Meta:
         model = Activity
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+
+class SparseFieldsMixin:
+    """?fields=id,title 只输出列出的字段；未知字段名忽略，一个有效字段都没有时输出全部。"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.requested_fields(self.context.get('request'), self.Meta.fields)
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @staticmethod
+    def requested_fields(request, available):
+        if request is None:
+            return set()
+        value = request.query_params.get('fields', '')
+        return {name.strip() for name in value.split(',')} & set(available)
+
+
+class ActivityListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """活动列表用：不带 CKEditor 的 HTML 正文，只给保存时生成的纯文本摘要。"""
+    excerpt = serializers.CharField(source='description_excerpt', read_only=True)
+
+    class Meta:
+        model = Activity
+        fields = ['id', 'title', 'excerpt', 'status', 'start_date', 'end_date', 'hours_reward', 'min_xp', 'max_xp',
+                  'gender_restriction', 'grade_restriction', 'capacity', 'approved_count', 'pending_count']
+
+
+class RankSnapshotSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(source='profile.user.first_name', read_only=True)
+    grade = serializers.CharField(source='grade.name', read_only=True, default=None)
+
+    class Meta:
+        model = RankSnapshot
+        fields = ['name', 'grade', 'class_name', 'total_xp', 'school_rank', 'grade_rank', 'class_rank', 'refreshed_at']
@@ -0,0 +1,35 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from . import caching, counters, search
+from .models import Activity, ActivitySession, Announcement, Registration
+
+
+@receiver(post_delete, sender=Registration)
+def release_registration_counters(sender, instance, **kwargs):
+    # 覆盖单条删除、queryset.delete() 以及删除学生档案时的级联删除；
+    # 单条删除时 Registration.delete 已在行锁下重新读出库里的状态
+    old_key = getattr(instance, '_counted_key', None) or counters.counter_key(instance)
+    counters.record_change(old_key, None)
+
+
+@receiver(post_delete, sender=Activity)
+def remove_activity_from_search_index(sender, instance, **kwargs):
+    search.remove_from_index(instance.pk)
+
+
+@receiver(post_save, sender=Announcement)
+@receiver(post_delete, sender=Announcement)
+def invalidate_announcements(sender, **kwargs):
+    caching.invalidate(caching.ANNOUNCEMENTS)
+
+
+@receiver(post_save, sender=Activity)
+@receiver(post_delete, sender=Activity)
+@receiver(post_save, sender=ActivitySession)
+@receiver(post_delete, sender=ActivitySession)
+@receiver(post_save, sender=Registration)
+@receiver(post_delete, sender=Registration)
+@receiver(m2m_changed, sender=Activity.grade_restriction.through)
+def invalidate_activities(sender, **kwargs):
+    # 批量 UPDATE 不触发信号，counters / reservations 中改计数器的地方另外调用 caching.invalidate
+    caching.invalidate(caching.ACTIVITIES)
@@ -0,0 +1,1596 @@
+import datetime
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+from unittest import mock, skipUnless
+
+import pandas as pd
+from asgiref.sync import sync_to_async
+
+from django.contrib.admin import site as admin_site
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import closure, images, richtext, turnstile
+from .benchmarks import BENCH_ADMIN, compare, run_benchmarks, run_session_benchmarks
+from .counters import find_drift, set_status
+from .eligibility import annotate_eligibility, filter_eligible
+from .exports import export_registrations_to_csv, export_registrations_to_excel, iter_export_rows
+from .hashing import hash_many
+from .imports import credit_activity_hours, import_students
+from .jobs import Heartbeat, claim_next_job, retry, run_pending_jobs
+from .login_benchmark import LOGIN_BENCH_PREFIX, TurnstileStubServer, compare_login_modes
+from .login_sessions import prune_expired_sessions
+from .leaderboard import my_rank as leaderboard_my_rank, refresh_rank_snapshot, tier_distribution, top_entries
+from .models import Activity, ActivitySession, Announcement, Grade, ImportJob, MessageWall, ProcessedImage, RankSnapshot, Registration, StudentTag, VolunteerProfile
+from .reservations import AlreadyRegistered, SessionSoldOut, SoldOut, reserve_seat
+from .search import search_activities, tokenize
+from .seeding import seed_load_data
+from .views import MESSAGE_WALL_PAGE_SIZE
+from .xp import recalculate_all_xp, recalculate_xp
+
+try:
+    import PIL  # noqa: F401
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+
+def make_profile(student_id):
+    user = User.objects.create(username=student_id, first_name=f"学生{student_id}")
+    return VolunteerProfile.objects.create(user=user, student_id=student_id)
+
+
+def make_activity(capacity=0, session_capacity=0, **kwargs):
+    kwargs = {'title': "测试活动", 'description': "<p>测试</p>", **kwargs}
+    activity = Activity.objects.create(capacity=capacity, **kwargs)
+    session = ActivitySession.objects.create(
+        activity=activity, date=datetime.date(2026, 5, 1),
+        start_time=datetime.time(8, 0), end_time=datetime.time(11, 0),
+        location="操场", capacity=session_capacity,
+    )
+    return activity, session
+
+
+# 闭站时段中间件会让夜间跑的视图测试全部 503，视图测试统一移除
+without_time_restriction = modify_settings(MIDDLEWARE={'remove': ['volunteer.middleware.TimeRestrictionMiddleware']})
+
+REGISTRATION_DETAILS = {'phone_number': '13800000000', 'class_name': '23级1班', 'headteacher_name': '王老师'}
+
+
+class ReserveSeatTests(TestCase):
+    def test_reservation_updates_counters(self):
+        activity, session = make_activity(capacity=2, session_capacity=2)
+        reserve_seat(make_profile('s1'), activity, session, **REGISTRATION_DETAILS)
+        activity.refresh_from_db()
+        session.refresh_from_db()
+        self.assertEqual(activity.pending_count, 1)
+        self.assertEqual(session.current_count, 1)
+
+    def test_activity_capacity_is_enforced(self):
+        activity, session = make_activity(capacity=1)
+        reserve_seat(make_profile('s1'), activity, session, **REGISTRATION_DETAILS)
+        with self.assertRaises(SoldOut):
+            reserve_seat(make_profile('s2'), activity, session, **REGISTRATION_DETAILS)
+
+    def test_session_sold_out_rolls_back_activity_seat(self):
+        activity, session = make_activity(capacity=10, session_capacity=1)
+        reserve_seat(make_profile('s1'), activity, session, **REGISTRATION_DETAILS)
+        with self.assertRaises(SessionSoldOut):
+            reserve_seat(make_profile('s2'), activity, session, **REGISTRATION_DETAILS)
+        activity.refresh_from_db()
+        self.assertEqual(activity.pending_count, 1)
+
+    def test_duplicate_registration(self):
+        activity, session = make_activity()
+        profile = make_profile('s1')
+        reserve_seat(profile, activity, session, **REGISTRATION_DETAILS)
+        with self.assertRaises(AlreadyRegistered):
+            reserve_seat(profile, activity, session, **REGISTRATION_DETAILS)
+        self.assertEqual(Registration.objects.count(), 1)
+
+
+class RegistrationCounterTests(TestCase):
+    def setUp(self):
+        self.activity, self.session = make_activity()
+        self.other_session = ActivitySession.objects.create(
+            activity=self.activity, date=datetime.date(2026, 5, 2),
+            start_time=datetime.time(8, 0), end_time=datetime.time(11, 0), location="操场",
+        )
+
+    def register(self, student_id, status='Pending', session=None):
+        return Registration.objects.create(
+            student=make_profile(student_id), activity=self.activity, session=session or self.session,
+            status=status, **REGISTRATION_DETAILS,
+        )
+
+    def counts(self, obj=None):
+        obj = obj or self.activity
+        obj.refresh_from_db(fields=['approved_count', 'pending_count'])
+        return obj.approved_count, obj.pending_count
+
+    def test_status_transitions(self):
+        registration = self.register('c1')
+        self.assertEqual((self.counts(), self.counts(self.session)), ((0, 1), (0, 1)))
+        for status, expected in [('Approved', (1, 0)), ('Rejected', (0, 0)), ('Pending', (0, 1)), ('Approved', (1, 0))]:
+            registration.status = status
+            registration.save()
+            self.assertEqual((self.counts(), self.counts(self.session)), (expected, expected), status)
+        # 只改其他字段不影响计数
+        registration.phone_number = '13900000000'
+        registration.save()
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_instance_without_loaded_status_reads_old_key(self):
+        registration = self.register('c1')
+        partial = Registration.objects.only('pk').get(pk=registration.pk)
+        partial.status = 'Approved'
+        partial.save()
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_moving_session(self):
+        registration = self.register('c1', status='Approved')
+        registration.session = self.other_session
+        registration.save()
+        self.assertEqual((self.counts(), self.counts(self.session), self.counts(self.other_session)), ((1, 0), (0, 0), (1, 0)))
+        registration.session = None
+        registration.save()
+        self.assertEqual((self.counts(), self.counts(self.other_session)), ((1, 0), (0, 0)))
+
+    def test_set_status_applies_only_real_changes(self):
+        self.register('c1')
+        self.register('c2')
+        self.register('c3', status='Approved')
+        self.assertEqual(set_status(Registration.objects.all(), 'Approved'), 3)
+        self.assertEqual((self.counts(), self.counts(self.session)), ((3, 0), (3, 0)))
+        set_status(Registration.objects.filter(student__student_id='c1'), 'Rejected')
+        self.assertEqual(self.counts(), (2, 0))
+
+    def test_stale_instance_after_set_status(self):
+        stale = self.register('c1')
+        set_status(Registration.objects.filter(pk=stale.pk), 'Approved')
+        self.assertEqual(self.counts(), (1, 0))
+        # 实例里还是读出时的 Pending，计数器应按库里的 Approved 计算增量
+        stale.status = 'Rejected'
+        stale.save()
+        self.assertEqual((self.counts(), self.counts(self.session)), ((0, 0), (0, 0)))
+
+        stale = Registration.objects.get(pk=stale.pk)
+        set_status(Registration.objects.filter(pk=stale.pk), 'Approved')
+        stale.delete()
+        self.assertEqual(self.counts(), (0, 0))
+        self.assertEqual(find_drift(), [])
+
+    def test_delete(self):
+        first = self.register('c1', status='Approved')
+        self.register('c2')
+        self.register('c3')
+        first.delete()
+        self.assertEqual(self.counts(), (0, 2))
+        Registration.objects.filter(student__student_id='c2').delete()
+        self.assertEqual(self.counts(), (0, 1))
+        # 删除学生档案时级联删除报名
+        VolunteerProfile.objects.filter(student_id='c3').delete()
+        self.assertEqual((self.counts(), self.counts(self.session)), ((0, 0), (0, 0)))
+
+    def test_counters_never_go_negative(self):
+        registration = self.register('c1', status='Approved')
+        Activity.objects.filter(pk=self.activity.pk).update(approved_count=0)
+        registration.delete()
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_rebuild_command_check_and_repair(self):
+        self.register('c1', status='Approved')
+        self.register('c2')
+        other, _ = make_activity()
+        Activity.objects.filter(pk=self.activity.pk).update(approved_count=7, pending_count=0)
+        Activity.objects.filter(pk=other.pk).update(pending_count=3)
+        ActivitySession.objects.filter(pk=self.session.pk).update(approved_count=5)
+
+        out = io.StringIO()
+        call_command('rebuild_registration_counters', '--check', stdout=out)
+        reported = out.getvalue().split(':')[1]
+        self.assertEqual({int(pk) for pk in reported.split(',')}, {self.activity.pk, other.pk})
+        # --check 只检查不写入
+        self.assertEqual(self.counts(), (7, 0))
+
+        call_command('rebuild_registration_counters', '--activity', str(self.activity.pk), stdout=io.StringIO())
+        self.assertEqual((self.counts(), self.counts(self.session)), ((1, 1), (1, 1)))
+        self.assertEqual(find_drift(), [other.pk])
+
+        call_command('rebuild_registration_counters', stdout=io.StringIO())
+        self.assertEqual(find_drift(), [])
+        out = io.StringIO()
+        call_command('rebuild_registration_counters', '--check', stdout=out)
+        self.assertIn("均一致", out.getvalue())
+
+
+class MigrationTests(TransactionTestCase):
+    """从旧版本带数据迁移到最新：数据迁移只能用历史模型，不能依赖当前的应用代码。"""
+    START = [('volunteer', '0004_messagewall_is_anonymous')]
+
+    def setUp(self):
+        from django.db.migrations.executor import MigrationExecutor
+
+        self.executor = MigrationExecutor(connection)
+        self.latest = self.executor.loader.graph.leaf_nodes('volunteer')
+        self.executor.migrate(self.START)
+
+    def tearDown(self):
+        from django.db.migrations.executor import MigrationExecutor
+
+        # 无论测试结果如何都回到最新结构，后面的测试依赖它
+        MigrationExecutor(connection).migrate(self.latest)
+
+    def test_migrate_forward_with_data(self):
+        from django.db.migrations.executor import MigrationExecutor
+
+        old_apps = self.executor.loader.project_state(self.START).apps
+        OldUser = old_apps.get_model('auth', 'User')
+        OldProfile = old_apps.get_model('volunteer', 'VolunteerProfile')
+        OldActivity = old_apps.get_model('volunteer', 'Activity')
+        OldSession = old_apps.get_model('volunteer', 'ActivitySession')
+        OldRegistration = old_apps.get_model('volunteer', 'Registration')
+        profile = OldProfile.objects.create(user=OldUser.objects.create(username='m1'), student_id='m1')
+        activity = OldActivity.objects.create(
+            title="河道清理", capacity=0,
+            description='<p onclick="x()">清理<script>alert(1)</script>河道<iframe/></p><p>注意安全</p>',
+        )
+        session = OldSession.objects.create(
+            activity=activity, date=datetime.date(2026, 5, 1),
+            start_time=datetime.time(8, 0), end_time=datetime.time(11, 0), location="河边",
+        )
+        OldRegistration.objects.create(student=profile, activity=activity, session=session, status='Approved', **REGISTRATION_DETAILS)
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.latest)
+
+        migrated = Activity.objects.get(pk=activity.pk)
+        self.assertEqual(migrated.description_html, '<p>清理河道</p><p>注意安全</p>')
+        self.assertEqual(migrated.description_text, '清理河道\n注意安全')
+        self.assertEqual(migrated.description_excerpt, '清理河道 注意安全')
+        self.assertIn('注意', migrated.search_document.split())
+        self.assertNotIn('alert', migrated.search_document)
+        self.assertEqual((migrated.approved_count, migrated.pending_count), (1, 0))
+        self.assertEqual(ActivitySession.objects.get(pk=session.pk).approved_count, 1)
+        self.assertEqual([a.pk for a in search_activities(Activity.objects.all(), '河道')], [activity.pk])
+
+
+class ConcurrentReservationTests(TransactionTestCase):
+    threads = 20
+
+    def run_concurrently(self, activity, session, profiles):
+        barrier = threading.Barrier(len(profiles))
+        outcomes = []
+        lock = threading.Lock()
+
+        def worker(profile):
+            try:
+                barrier.wait()
+                try:
+                    reserve_seat(profile, activity, session, **REGISTRATION_DETAILS)
+                    outcome = 'ok'
+                except SoldOut:
+                    outcome = 'sold_out'
+                with lock:
+                    outcomes.append(outcome)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(p,)) for p in profiles]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        return outcomes
+
+    def test_exactly_session_capacity_succeeds(self):
+        activity, session = make_activity(session_capacity=5)
+        profiles = [make_profile(f"s{i}") for i in range(self.threads)]
+
+        outcomes = self.run_concurrently(activity, session, profiles)
+
+        self.assertEqual(len(outcomes), self.threads)
+        self.assertEqual(outcomes.count('ok'), 5)
+        self.assertEqual(outcomes.count('sold_out'), self.threads - 5)
+        self.assertEqual(Registration.objects.filter(session=session).count(), 5)
+        session.refresh_from_db()
+        activity.refresh_from_db()
+        self.assertEqual(session.pending_count, 5)
+        self.assertEqual(activity.pending_count, 5)
+
+    def test_exactly_activity_capacity_succeeds(self):
+        activity, session = make_activity(capacity=3, session_capacity=10)
+        profiles = [make_profile(f"s{i}") for i in range(self.threads)]
+
+        outcomes = self.run_concurrently(activity, session, profiles)
+
+        self.assertEqual(outcomes.count('ok'), 3)
+        self.assertEqual(Registration.objects.filter(activity=activity).count(), 3)
+
+
+@without_time_restriction
+class MessageWallFeedTests(TestCase):
+    def setUp(self):
+        self.profile = make_profile('s1')
+        self.client.force_login(self.profile.user)
+        MessageWall.objects.bulk_create([
+            MessageWall(user=self.profile.user, content=f"留言{i}", is_anonymous=(i % 2 == 0))
+            for i in range(75)
+        ])
+        # bulk_create 在同一时刻写入，created_at 大量相同，正好检验 id 作为第二排序键
+        MessageWall.objects.create(user=self.profile.user, content="私密", is_public=False)
+
+    def test_feed_walks_all_public_messages_once(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'cursor': cursor} if cursor else {}
+            data = self.client.get(reverse('message_wall_feed'), params).json()
+            seen.extend(m['id'] for m in data['messages'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        public_ids = list(MessageWall.objects.filter(is_public=True).order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, public_ids)
+
+    def test_feed_hides_anonymous_authors(self):
+        data = self.client.get(reverse('message_wall_feed')).json()
+        for msg in data['messages']:
+            if msg['author'] == '匿名志愿者':
+                self.assertEqual(msg['initial'], '?')
+            else:
+                self.assertEqual(msg['author'], self.profile.user.first_name)
+
+    def test_wall_query_count_does_not_grow(self):
+        # 请求事务的 SAVEPOINT/RELEASE + user + 一页留言（已 JOIN 用户）；session 从缓存读取
+        with self.assertNumQueries(4):
+            self.client.get(reverse('message_wall'))
+
+
+class ActivitySearchTests(TestCase):
+    def setUp(self):
+        self.cleanup = Activity.objects.create(title="社区垃圾分类宣传", description="<p>周末在社区开展<strong>志愿者</strong>宣传活动</p>")
+        self.library = Activity.objects.create(title="图书馆志愿者招募", description="<p>整理书架，协助借还</p>")
+        self.marathon = Activity.objects.create(title="Marathon 补给站", description='<p class="volunteer">递水</p>')
+
+    def search(self, query):
+        return list(search_activities(Activity.objects.all(), query))
+
+    def test_tokenize_chinese_into_unigrams_and_bigrams(self):
+        self.assertEqual(tokenize("志愿者"), ['志', '愿', '者', '志愿', '愿者'])
+        self.assertEqual(tokenize("志愿者", for_query=True), ['志愿', '愿者'])
+
+    def test_matches_text_not_markup(self):
+        self.assertEqual(self.search("strong"), [])
+        self.assertEqual(self.search("volunteer"), [])
+        self.assertEqual(self.search("marathon"), [self.marathon])
+
+    def test_title_hits_rank_first(self):
+        self.assertEqual(self.search("志愿者"), [self.library, self.cleanup])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.library.title = "图书整理"
+        self.library.description = "<p>整理书架</p>"
+        self.library.save()
+        self.assertEqual(self.search("志愿者"), [self.cleanup])
+        self.cleanup.delete()
+        self.assertEqual(self.search("志愿者"), [])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ImportStudentsTests(TestCase):
+    def sheet(self, rows):
+        return pd.DataFrame(rows, columns=['学号', '姓名', '初始密码', '性别', '班级', '志愿者时长', '标签']).astype(str)
+
+    def test_creates_and_updates_in_bulk(self):
+        StudentTag.objects.create(name="班长", xp_bonus=20)
+        existing = make_profile('1001')
+        existing.user.set_password('old')
+        existing.user.save()
+
+        rows = [['1001', '张三', 'pw', '男', '23级1', '5', '班长'], ['1002', '李四', 'pw2', '女', '23级2班', '3', '']]
+        rows += [[str(2000 + i), f'学生{i}', 'pw', '男', '24级3', '0', '班长，不存在'] for i in range(50)]
+        with self.assertNumQueries(14):
+            result = import_students(self.sheet(rows))
+
+        self.assertEqual((result.created, result.updated), (51, 1))
+        existing.refresh_from_db()
+        self.assertEqual(existing.user.first_name, '张三')
+        self.assertTrue(existing.user.check_password('old'))
+        self.assertEqual((existing.class_name, existing.total_hours, existing.total_xp), ('23级1班', 5, 25))
+        self.assertEqual(list(existing.tags.values_list('name', flat=True)), ['班长'])
+
+        new = VolunteerProfile.objects.get(student_id='1002')
+        self.assertTrue(new.user.check_password('pw2'))
+        self.assertEqual(new.grade.name, '23')
+        self.assertEqual(set(Grade.objects.values_list('name', flat=True)), {'23', '24'})
+        self.assertEqual(VolunteerProfile.objects.get(student_id='2003').tags.count(), 1)
+
+    def test_duplicate_student_ids_count_like_row_by_row(self):
+        rows = [['3001', '王五', 'pw', '男', '23级1', '1', ''], ['3001', '王五改', 'pw', '男', '23级1', '2', '']]
+        result = import_students(self.sheet(rows))
+        self.assertEqual((result.created, result.updated), (1, 1))
+        self.assertEqual(VolunteerProfile.objects.get(student_id='3001').total_hours, 2)
+
+
+class ParallelHashingTests(TestCase):
+    def test_pool_hashes_match_check_password(self):
+        passwords = ['pw1', 'pw2', '中文密码', 'pw1']
+        hashes = hash_many(passwords, workers=2, min_parallel=0)
+        self.assertEqual(len(hashes), len(passwords))
+        for password, encoded in zip(passwords, hashes):
+            self.assertTrue(encoded.startswith('pbkdf2_sha256$'))
+            self.assertTrue(check_password(password, encoded))
+        self.assertNotEqual(hashes[0], hashes[3])
+
+
+def excel_upload(rows, columns, name='名单.xlsx'):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    buffer = io.BytesIO()
+    pd.DataFrame(rows, columns=columns).to_excel(buffer, index=False)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+@without_time_restriction
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ImportJobTests(TestCase):
+    def setUp(self):
+        self.jobs_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.jobs_root.cleanup)
+        override = override_settings(IMPORT_JOBS_ROOT=self.jobs_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(self.admin)
+
+    def test_batch_create_is_queued_and_processed_by_worker(self):
+        upload = excel_upload([['4001', '赵六', 'pw', '女', '24级1']], ['学号', '姓名', '初始密码', '性别', '班级'])
+        response = self.client.post(reverse('admin:batch_create'), {'excel_file': upload})
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, reverse('admin:import_job_progress', args=[job.pk]))
+        self.assertEqual(job.status, 'Queued')
+        self.assertFalse(User.objects.filter(username='4001').exists())
+
+        run_pending_jobs()
+
+        data = self.client.get(reverse('admin:import_job_progress_json', args=[job.pk])).json()
+        self.assertEqual(data['status'], 'Done')
+        self.assertTrue(data['finished'])
+        self.assertEqual((data['processed_rows'], data['total_rows']), (1, 1))
+        self.assertEqual(data['summary'], '处理完成：新建 1 人，更新 0 人。')
+        self.assertTrue(User.objects.get(username='4001').check_password('pw'))
+        job.refresh_from_db()
+        self.assertFalse(job.file)
+
+    def test_upload_hours_job_reports_missing_students(self):
+        activity, session = make_activity()
+        profile = make_profile('5001')
+        reserve_seat(profile, activity, session, **REGISTRATION_DETAILS)
+        upload = excel_upload([['5001', 3], ['9999', 2]], ['学号', '服务时长'])
+        self.client.post(reverse('admin:upload_hours', args=[activity.pk]), {'excel_file': upload})
+
+        run_pending_jobs()
+
+        job = ImportJob.objects.get()
+        self.assertEqual(job.status, 'Done')
+        self.assertEqual(job.summary, '成功更新 1 人')
+        self.assertEqual(job.warnings, ['未找到以下学号，已跳过：9999'])
+        profile.refresh_from_db()
+        self.assertEqual((profile.total_hours, profile.total_xp), (3, 3))
+        activity.refresh_from_db()
+        self.assertEqual((activity.approved_count, activity.pending_count), (1, 0))
+
+
+    def test_reclaimed_hours_job_resumes_without_crediting_twice(self):
+        activity, session = make_activity()
+        profiles = [make_profile(str(5100 + i)) for i in range(3)]
+        for profile in profiles:
+            reserve_seat(profile, activity, session, **REGISTRATION_DETAILS)
+        rows = [[p.student_id, 2] for p in profiles]
+        self.client.post(reverse('admin:upload_hours', args=[activity.pk]), {'excel_file': excel_upload(rows, ['学号', '服务时长'])})
+        job = ImportJob.objects.get()
+        # 模拟 worker 计入前两人（进度随批次提交）后退出：任务仍是处理中，但心跳早已停止
+        credit_activity_hours(activity, pd.DataFrame(rows[:2], columns=['学号', '服务时长']))
+        ImportJob.objects.filter(pk=job.pk).update(
+            status='Running', processed_rows=2, updated_at=timezone.now() - datetime.timedelta(hours=1),
+        )
+
+        self.assertEqual(run_pending_jobs(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.summary, job.processed_rows), ('Done', '成功更新 3 人', 3))
+        self.assertEqual(list(VolunteerProfile.objects.order_by('pk').values_list('total_hours', flat=True)), [2, 2, 2])
+        self.assertEqual(list(Registration.objects.values_list('hours_awarded', flat=True).distinct()), [2])
+        activity.refresh_from_db()
+        self.assertEqual((activity.approved_count, activity.pending_count), (3, 0))
+
+
+    def test_failed_hours_job_is_retried_from_checkpoint(self):
+        from . import imports
+
+        activity, session = make_activity()
+        users = User.objects.bulk_create([User(username=str(5200 + i)) for i in range(imports.HOURS_CHUNK + 20)])
+        profiles = VolunteerProfile.objects.bulk_create([VolunteerProfile(user=u, student_id=u.username) for u in users])
+        Registration.objects.bulk_create([
+            Registration(student=p, activity=activity, session=session, **REGISTRATION_DETAILS) for p in profiles
+        ])
+        rows = [[p.student_id, 2] for p in profiles]
+        self.client.post(reverse('admin:upload_hours', args=[activity.pk]), {'excel_file': excel_upload(rows, ['学号', '服务时长'])})
+        job = ImportJob.objects.get()
+
+        # 第二批写回时出错：第一批已提交
+        original = imports._credit_hours_chunk
+        calls = []
+
+        def flaky(activity, batch):
+            calls.append(len(batch))
+            if len(calls) == 2:
+                raise RuntimeError("数据库连接断开")
+            return original(activity, batch)
+
+        with mock.patch.object(imports, '_credit_hours_chunk', flaky), self.assertLogs('volunteer.jobs', 'ERROR'):
+            run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed_rows), ('Failed', imports.HOURS_CHUNK))
+        self.assertIn(f"已计入 {imports.HOURS_CHUNK} 人", job.summary)
+        self.assertTrue(job.file)
+        credited = dict(VolunteerProfile.objects.values_list('total_hours').annotate(n=Count('pk')))
+        self.assertEqual(credited, {2: imports.HOURS_CHUNK, 0: 20})
+
+        self.client.post(reverse('admin:volunteer_importjob_changelist'), {
+            'action': 'retry_jobs', '_selected_action': [job.pk],
+        })
+        self.assertEqual(ImportJob.objects.get().status, 'Queued')
+        run_pending_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed_rows), ('Done', imports.HOURS_CHUNK + 20))
+        self.assertFalse(job.file)
+        self.assertEqual(set(VolunteerProfile.objects.values_list('total_hours', flat=True)), {2})
+        self.assertEqual(set(Registration.objects.values_list('hours_awarded', flat=True)), {2})
+        activity.refresh_from_db()
+        self.assertEqual((activity.approved_count, activity.pending_count), (imports.HOURS_CHUNK + 20, 0))
+        # 已完成的任务不能再重试
+        self.assertFalse(retry(job))
+
+
+class ImportJobHeartbeatTests(TransactionTestCase):
+    def test_running_job_with_heartbeat_is_not_reclaimed(self):
+        job = ImportJob.objects.create(kind='hours', status='Running')
+        stale = timezone.now() - datetime.timedelta(hours=1)
+        ImportJob.objects.filter(pk=job.pk).update(updated_at=stale)
+
+        with Heartbeat(job, interval=0.01):
+            for _ in range(200):
+                job.refresh_from_db()
+                if job.updated_at > stale:
+                    break
+                threading.Event().wait(0.01)
+        self.assertGreater(job.updated_at, stale)
+        self.assertIsNone(claim_next_job())
+
+        # 心跳停止（worker 退出）超过 IMPORT_JOB_STALE_SECONDS 后才能重新领取
+        ImportJob.objects.filter(pk=job.pk).update(updated_at=stale)
+        self.assertEqual(claim_next_job().pk, job.pk)
+
+
+class CreditActivityHoursTests(TestCase):
+    def test_credits_in_a_fixed_number_of_queries(self):
+        activity, session = make_activity()
+        profiles = [make_profile(str(6000 + i)) for i in range(30)]
+        for profile in profiles[:20]:
+            reserve_seat(profile, activity, session, **REGISTRATION_DETAILS)
+        User.objects.create(username='7000', first_name='没有档案')
+        rows = [[p.student_id, 2] for p in profiles] + [['6000', 3], ['7000', 1], ['8888', 1], ['6001', 'abc']]
+        df = pd.DataFrame(rows, columns=['学号', '服务时长']).astype({'学号': str})
+
+        # 含补全档案和写回批次两个事务的 SAVEPOINT/RELEASE
+        with self.assertNumQueries(15):
+            result = credit_activity_hours(activity, df)
+
+        self.assertEqual(result.updated, 31)
+        self.assertEqual(result.warnings, [
+            '第 35 行学号 6001 的服务时长无效，跳过。',
+            '已为以下用户自动补全档案：7000',
+            '未找到以下学号，已跳过：8888',
+        ])
+        totals = dict(VolunteerProfile.objects.values_list('student_id', 'total_hours'))
+        self.assertEqual((totals['6000'], totals['6001'], totals['7000']), (5, 2, 1))
+        self.assertEqual(VolunteerProfile.objects.get(student_id='6000').total_xp, 5)
+        registrations = Registration.objects.filter(activity=activity)
+        self.assertEqual(set(registrations.values_list('status', flat=True)), {'Approved'})
+        self.assertEqual(registrations.get(student__student_id='6000').hours_awarded, 5)
+        activity.refresh_from_db()
+        self.assertEqual((activity.approved_count, activity.pending_count), (20, 0))
+
+
+    def test_statements_stay_under_sqlite_parameter_limit(self):
+        activity, session = make_activity()
+        users = User.objects.bulk_create([User(username=str(6200 + i)) for i in range(400)])
+        profiles = VolunteerProfile.objects.bulk_create([VolunteerProfile(user=u, student_id=u.username) for u in users])
+        Registration.objects.bulk_create([
+            Registration(student=p, activity=activity, session=session, **REGISTRATION_DETAILS) for p in profiles
+        ])
+        df = pd.DataFrame([[p.student_id, 2] for p in profiles], columns=['学号', '服务时长'])
+        sizes = []
+
+        def count_params(execute, sql, params, many, context):
+            sizes.append(len(params or ()))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_params):
+            self.assertEqual(credit_activity_hours(activity, df).updated, 400)
+        self.assertLessEqual(max(sizes), 999)
+        self.assertEqual(set(VolunteerProfile.objects.values_list('total_hours', flat=True)), {2})
+        self.assertEqual(set(Registration.objects.values_list('hours_awarded', flat=True)), {2})
+
+
+class CreditActivityHoursProgressTests(TransactionTestCase):
+    def test_each_batch_commits_with_its_progress(self):
+        activity, _ = make_activity()
+        profiles = [make_profile(str(6100 + i)) for i in range(25)]
+        df = pd.DataFrame([[p.student_id, 2] for p in profiles], columns=['学号', '服务时长'])
+
+        def committed():
+            # 另开一个连接读，只能看到已提交的批次
+            seen = []
+
+            def read():
+                seen.append(VolunteerProfile.objects.filter(total_hours=2).count())
+                connection.close()
+
+            thread = threading.Thread(target=read)
+            thread.start()
+            thread.join()
+            return seen[0]
+
+        reports = []
+        credit_activity_hours(activity, df, progress=lambda done, total: reports.append((done, total, committed())), chunk_size=10)
+        self.assertEqual(reports, [(10, 25, 0), (20, 25, 10), (25, 25, 20)])
+        self.assertEqual(committed(), 25)
+
+
+class ExportRegistrationsTests(TestCase):
+    def setUp(self):
+        activity, session = make_activity()
+        for i in range(7):
+            reserve_seat(make_profile(str(8000 + i)), activity, session, **REGISTRATION_DETAILS)
+
+    def test_rows_are_read_in_keyset_batches(self):
+        with self.assertNumQueries(4):
+            rows = list(iter_export_rows(Registration.objects.all(), chunk_size=3))
+        self.assertEqual([r[1] for r in rows], [str(8000 + i) for i in range(7)])
+
+    def test_excel_export(self):
+        from openpyxl import load_workbook
+        response = export_registrations_to_excel(Registration.objects.all())
+        sheet = load_workbook(io.BytesIO(b''.join(response.streaming_content))).active
+        values = list(sheet.values)
+        self.assertEqual(values[0][:3], ('姓名', '学号', '活动名称'))
+        self.assertEqual(len(values), 8)
+
+    def test_csv_export_streams(self):
+        response = export_registrations_to_csv(Registration.objects.all())
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 8)
+        self.assertTrue(lines[1].startswith('学生8000,8000,测试活动,2026-05-01,08:00:00'))
+
+
+class RecalculateXpTests(TestCase):
+    def setUp(self):
+        leader = StudentTag.objects.create(name="班长", xp_bonus=20)
+        member = StudentTag.objects.create(name="学生会", xp_bonus=15)
+        self.correct = make_profile('9001')
+        self.correct.total_hours = self.correct.total_xp = 4
+        self.correct.save()
+        self.tagged = make_profile('9002')
+        self.tagged.total_hours = 10
+        self.tagged.save()
+        self.tagged.tags.set([leader, member])
+        self.stale = make_profile('9003')
+        self.stale.total_xp = 99
+        self.stale.save()
+
+    def test_single_update_reports_changed_rows(self):
+        with self.assertNumQueries(1):
+            changed = recalculate_xp(VolunteerProfile.objects.all())
+        self.assertEqual(changed, 2)
+        xp = dict(VolunteerProfile.objects.values_list('student_id', 'total_xp'))
+        self.assertEqual(xp, {'9001': 4, '9002': 45, '9003': 0})
+        self.assertEqual(recalculate_xp(VolunteerProfile.objects.all()), 0)
+
+    def test_chunked_full_table_recompute(self):
+        self.assertEqual(recalculate_all_xp(chunk_size=2), (3, 2))
+
+
+@without_time_restriction
+class AdminChangelistQueryTests(TestCase):
+    """后台列表页的查询数不随每页行数增长。"""
+    ROWS = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='admin')
+        grade = Grade.objects.create(name='23')
+        tags = [StudentTag.objects.create(name="班长", xp_bonus=20), StudentTag.objects.create(name="学生会", xp_bonus=15)]
+        activity, session = make_activity()
+        for i in range(cls.ROWS):
+            profile = make_profile(f'7{i:03d}')
+            profile.grade = grade
+            profile.save()
+            profile.tags.set(tags)
+            reserve_seat(profile, activity, session, **REGISTRATION_DETAILS)
+            Activity.objects.create(title=f"活动{i}", description="", capacity=10)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assertChangelistQueries(self, model, url_name, expected):
+        # expected 不含 session 查询：SESSION_STORE=cached_db 时 session 从缓存读取
+        model_admin = admin_site._registry[model]
+        for per_page in (25, 100):
+            with self.subTest(per_page=per_page), mock.patch.object(model_admin, 'list_per_page', per_page):
+                with self.assertNumQueries(expected):
+                    response = self.client.get(reverse(url_name))
+                self.assertEqual(len(response.context['cl'].result_list), per_page)
+
+    def test_registration_changelist(self):
+        self.assertChangelistQueries(Registration, 'admin:volunteer_registration_changelist', 10)
+
+    def test_user_changelist(self):
+        self.assertChangelistQueries(User, 'admin:auth_user_changelist', 9)
+
+    def test_profile_changelist(self):
+        self.assertChangelistQueries(VolunteerProfile, 'admin:volunteer_volunteerprofile_changelist', 10)
+
+    def test_profile_changelist_shows_expected_xp(self):
+        response = self.client.get(reverse('admin:volunteer_volunteerprofile_changelist'))
+        self.assertEqual({p.expected_xp for p in response.context['cl'].result_list}, {35})
+
+    def test_activity_changelist(self):
+        self.assertChangelistQueries(Activity, 'admin:volunteer_activity_changelist', 8)
+
+
+class LoadDataBenchmarkTests(TestCase):
+    def test_seed_and_benchmark_leave_no_trace(self):
+        created = seed_load_data(profiles=40, activities=5, registrations=80, messages=60, prefix='bench')
+        self.assertEqual((created['profiles'], created['activities'], created['messages']), (40, 5, 60))
+        self.assertEqual(Registration.objects.count(), created['registrations'])
+        self.assertEqual(find_drift(), [])
+
+        results = run_benchmarks(repeat=1)
+
+        self.assertIn('activity_detail', [r.name for r in results])
+        for result in results:
+            self.assertIn(result.status, (200, None), result.name)
+            self.assertGreater(result.queries, 0, result.name)
+        self.assertFalse(User.objects.filter(username=BENCH_ADMIN).exists())
+        self.assertEqual(compare(results, {r.name: r.as_dict() for r in results}, tolerance=float('inf')), [])
+
+
+@without_time_restriction
+@override_settings(SERVER_TIMING_HEADER=True)
+class RequestMetricsMiddlewareTests(TestCase):
+    def setUp(self):
+        self.profile = make_profile('8101')
+        self.client.force_login(self.profile.user)
+
+    def server_timing(self, response):
+        return dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+
+    def test_server_timing_reports_queries_and_render_time(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('my_profile'))
+        timing = self.server_timing(response)
+        self.assertEqual(set(timing), {'db', 'view', 'render', 'total'})
+        # 与 CaptureQueriesContext 看到的条数一致（含 ATOMIC_REQUESTS 的 SAVEPOINT）
+        self.assertIn(f'desc="{len(queries)} queries"', timing['db'])
+        self.assertGreater(float(timing['render'].split('=')[1]), 0)
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0)
+    def test_slow_request_log_line(self):
+        with self.assertLogs('volunteer.performance', 'WARNING') as logs:
+            self.client.get(reverse('my_profile'))
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['path'], reverse('my_profile'))
+        self.assertEqual(entry['view'], 'my_profile')
+        self.assertEqual(entry['user_id'], self.profile.user_id)
+        self.assertGreater(entry['queries'], 0)
+        self.assertTrue(entry['slowest_sql'])
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_header_can_be_disabled(self):
+        self.assertFalse(self.client.get(reverse('my_profile')).has_header('Server-Timing'))
+
+    def test_header_is_off_unless_enabled(self):
+        from django.conf import settings
+        with self.settings():
+            del settings.SERVER_TIMING_HEADER
+            self.assertFalse(self.client.get(reverse('login')).has_header('Server-Timing'))
+
+
+@without_time_restriction
+class ActivityListCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile('8201')
+        self.activity, self.session = make_activity(capacity=10)
+        Activity.objects.filter(pk=self.activity.pk).update(title="敬老院探访")
+        self.client.force_login(self.profile.user)
+
+    def get_list(self):
+        return self.client.get(reverse('activity_list')).content.decode()
+
+    def test_second_request_skips_list_queries(self):
+        with CaptureQueriesContext(connection) as first:
+            self.get_list()
+        with CaptureQueriesContext(connection) as second:
+            self.get_list()
+        tables = lambda queries: {t for q in queries for t in ('volunteer_activity', 'volunteer_announcement') if t in q['sql']}
+        self.assertEqual(tables(first), {'volunteer_activity', 'volunteer_announcement'})
+        self.assertEqual(tables(second), set())
+
+    def test_signals_invalidate_after_commit(self):
+        self.assertIn("敬老院探访", self.get_list())
+        with self.captureOnCommitCallbacks() as callbacks:
+            Announcement.objects.create(title="暑期安全提示", content="注意防暑")
+        # 提交前版本号不变，其他请求不会缓存到未提交的数据
+        self.assertNotIn("暑期安全提示", self.get_list())
+        for callback in callbacks:
+            callback()
+        self.assertIn("暑期安全提示", self.get_list())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.activity.title = "图书馆整理"
+            self.activity.save()
+        self.assertIn("图书馆整理", self.get_list())
+
+    def test_bulk_counter_updates_invalidate(self):
+        self.get_list()
+        with self.captureOnCommitCallbacks(execute=True):
+            registration = reserve_seat(self.profile, self.activity, self.session, **REGISTRATION_DETAILS)
+        with self.captureOnCommitCallbacks(execute=True):
+            set_status(Registration.objects.filter(pk=registration.pk), 'Approved')
+        self.assertIn("已报: 1 / 10", self.get_list())
+
+
+class EligibilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.grade23 = Grade.objects.create(name='23')
+        self.grade24 = Grade.objects.create(name='24')
+        self.profile = make_profile('8301')
+        self.profile.total_xp = 120
+        self.profile.gender = '女'
+        self.profile.grade = self.grade23
+        self.profile.save()
+        self.activities = {}
+        for name, kwargs in [
+            ('open', {}),
+            ('no_cap_ok', {'min_xp': 100, 'max_xp': 0}),
+            ('too_little_xp', {'min_xp': 200, 'max_xp': 0}),
+            ('too_much_xp', {'min_xp': 0, 'max_xp': 100}),
+            ('male_only', {'gender_restriction': '男'}),
+            ('female_only', {'gender_restriction': '女'}),
+        ]:
+            self.activities[name] = make_activity(**kwargs)[0]
+        self.activities['grade23'] = make_activity()[0]
+        self.activities['grade23'].grade_restriction.set([self.grade23, self.grade24])
+        self.activities['grade24'] = make_activity()[0]
+        self.activities['grade24'].grade_restriction.set([self.grade24])
+
+    def names(self, pks):
+        return {name for name, activity in self.activities.items() if activity.pk in pks}
+
+    def test_rules(self):
+        expected = {'open', 'no_cap_ok', 'female_only', 'grade23'}
+        eligible = filter_eligible(Activity.objects.all(), self.profile).values_list('pk', flat=True)
+        self.assertEqual(self.names(set(eligible)), expected)
+        with self.assertNumQueries(1):
+            annotated = {a.pk: a for a in annotate_eligibility(Activity.objects.all(), self.profile)}
+        self.assertEqual(self.names({pk for pk, a in annotated.items() if a.can_register}), expected)
+        self.assertFalse(annotated[self.activities['too_much_xp'].pk].xp_ok)
+        self.assertFalse(annotated[self.activities['male_only'].pk].gender_ok)
+        self.assertFalse(annotated[self.activities['grade24'].pk].grade_ok)
+
+    def test_profile_without_grade_only_matches_unrestricted(self):
+        self.profile.grade = None
+        eligible = filter_eligible(Activity.objects.filter(pk__in=[self.activities['open'].pk, self.activities['grade23'].pk]), self.profile)
+        self.assertEqual(self.names(set(eligible.values_list('pk', flat=True))), {'open'})
+
+    @without_time_restriction
+    def test_activity_list_eligible_mode_and_detail(self):
+        self.client.force_login(self.profile.user)
+        response = self.client.get(reverse('activity_list'))
+        self.assertEqual(len(response.context['activities']), len(self.activities))
+        self.assertContains(response, '不符合条件', count=4)
+
+        response = self.client.get(reverse('activity_list'), {'eligible': '1'})
+        self.assertEqual(self.names({a.pk for a in response.context['activities']}), {'open', 'no_cap_ok', 'female_only', 'grade23'})
+        self.assertNotContains(response, '不符合条件')
+
+        response = self.client.get(reverse('activity_detail', args=[self.activities['grade24'].pk]))
+        self.assertEqual(
+            (response.context['reason_xp_ok'], response.context['reason_gender_ok'], response.context['reason_grade_ok']),
+            (True, True, False),
+        )
+        self.assertFalse(response.context['can_register'])
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        grade23, grade24 = Grade.objects.create(name='23'), Grade.objects.create(name='24')
+        self.profiles = {}
+        for sid, xp, grade, class_name in [
+            ('8401', 500, grade23, '23级1班'),
+            ('8402', 1500, grade23, '23级1班'),
+            ('8403', 1500, grade23, '23级2班'),
+            ('8404', 200, grade24, '24级1班'),
+            ('8405', 12000, grade24, '24级1班'),
+        ]:
+            profile = make_profile(sid)
+            profile.total_xp, profile.grade, profile.class_name = xp, grade, class_name
+            profile.save()
+            self.profiles[sid] = profile
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(refresh_rank_snapshot(), 5)
+
+    def test_ranks_with_ties(self):
+        with self.assertNumQueries(1):
+            snapshot = leaderboard_my_rank(self.profiles['8403'])
+        self.assertEqual((snapshot.school_rank, snapshot.school_size), (2, 5))
+        self.assertEqual((snapshot.grade_rank, snapshot.grade_size), (1, 3))
+        self.assertEqual((snapshot.class_rank, snapshot.class_size), (1, 1))
+        snapshot = leaderboard_my_rank(self.profiles['8401'])
+        self.assertEqual((snapshot.school_rank, snapshot.grade_rank, snapshot.class_rank), (4, 3, 2))
+
+    def test_top_entries_and_tiers(self):
+        entries = top_entries('grade', grade_id=self.profiles['8404'].grade_id)
+        self.assertEqual([e.profile.student_id for e in entries], ['8405', '8404'])
+        self.assertEqual(tier_distribution(), [('青铜', 2, 40.0), ('白银', 2, 40.0), ('黄金', 0, 0.0), ('铂金', 0, 0.0), ('钻石', 1, 20.0)])
+
+    @without_time_restriction
+    def test_pages(self):
+        self.client.force_login(self.profiles['8401'].user)
+        self.assertContains(self.client.get(reverse('my_profile')), '全校第 <b class="text-dark">4</b> / 5 名', html=False)
+        response = self.client.get(reverse('leaderboard'), {'scope': 'class'})
+        self.assertEqual(response.context['my_position'], 2)
+        self.assertEqual([e.profile_id for _, e in response.context['entries']], [self.profiles['8402'].pk, self.profiles['8401'].pk])
+
+    def test_api(self):
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from .api_views import LeaderboardView
+
+        request = APIRequestFactory().get('/api/leaderboard/', {'scope': 'school'})
+        force_authenticate(request, user=self.profiles['8404'].user)
+        data = LeaderboardView.as_view()(request).data
+        self.assertEqual([row['total_xp'] for row in data['results']], [12000, 1500, 1500, 500, 200])
+        self.assertEqual(data['me']['school_rank'], 5)
+
+    @without_time_restriction
+    def test_api_rejects_invalid_grade(self):
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(user=self.profiles['8404'].user)
+        for grade in ('abc', '-1', '0', '1.5', '9' * 30):
+            response = client.get(reverse('api_leaderboard'), {'scope': 'grade', 'grade': grade})
+            self.assertEqual(response.status_code, 400, grade)
+            self.assertIn('grade', response.json())
+        response = client.get(reverse('api_leaderboard'), {'scope': 'grade', 'grade': self.profiles['8401'].grade_id})
+        self.assertEqual([row['total_xp'] for row in response.json()['results']], [1500, 1500, 500])
+
+
+class QueryPlanTests(TestCase):
+    """热点查询必须走索引：对视图实际使用的 queryset 执行 EXPLAIN，出现全表扫描或额外排序即失败。"""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_load_data(profiles=300, activities=30, registrations=3000, messages=1000, prefix='plan')
+        for i in range(20):
+            Announcement.objects.create(title=f"公告{i}", content="内容")
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.profile = VolunteerProfile.objects.order_by('pk').first()
+        cls.activity = Activity.objects.order_by('pk').first()
+        cls.session = ActivitySession.objects.order_by('pk').first()
+
+    def explain(self, queryset):
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # 测试数据量小，PostgreSQL 会倾向顺序扫描；关掉后检查的是"有没有可用的索引"
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
+
+    def assertUsesIndex(self, queryset, ordered=False):
+        plan = self.explain(queryset)
+        table = queryset.model._meta.db_table
+        for line in plan.splitlines():
+            if connection.vendor == 'postgresql':
+                self.assertNotIn(f'Seq Scan on {table}', line, plan)
+            else:
+                self.assertFalse(f'SCAN {table}' in line and 'USING' not in line, plan)
+        if ordered:
+            self.assertNotRegex(plan, r'TEMP B-TREE FOR ORDER BY|Sort Key', plan)
+
+    def test_registration_lookups(self):
+        self.assertUsesIndex(Registration.objects.filter(student=self.profile, activity=self.activity))
+        self.assertUsesIndex(Registration.objects.filter(activity=self.activity, status='Approved'))
+        self.assertUsesIndex(Registration.objects.filter(session=self.session).exclude(status='Rejected'))
+        self.assertUsesIndex(Registration.objects.filter(student=self.profile).order_by('-registered_at'), ordered=True)
+
+    def test_activity_list(self):
+        self.assertUsesIndex(Activity.objects.filter(status="报名中").order_by('-id'), ordered=True)
+
+    def test_message_wall_page(self):
+        self.assertUsesIndex(
+            MessageWall.objects.filter(is_public=True).order_by('-created_at', '-id')[:MESSAGE_WALL_PAGE_SIZE + 1],
+            ordered=True,
+        )
+
+    def test_announcements(self):
+        self.assertUsesIndex(Announcement.objects.order_by('-created_at')[:3], ordered=True)
+
+    def test_leaderboard(self):
+        self.assertUsesIndex(RankSnapshot.objects.filter(grade_id=self.profile.grade_id).order_by('grade_rank', 'pk')[:50], ordered=True)
+
+
+@override_settings(SITE_CLOSED_WINDOW='23:00-07:00')
+class SiteClosureTests(TestCase):
+    def setUp(self):
+        closure.sleeping_page.cache_clear()
+
+    def at(self, hour, minute=0):
+        local = datetime.datetime(2026, 3, 2, hour, minute, tzinfo=timezone.get_current_timezone())
+        return mock.patch('volunteer.middleware.timezone.now', return_value=local)
+
+    def test_closed_page_rendered_once_with_retry_after(self):
+        with self.at(23, 30), mock.patch.object(closure, 'render_to_string', wraps=closure.render_to_string) as render:
+            first = self.client.get('/')
+            second = self.client.get(reverse('activity_list'))
+        self.assertEqual((first.status_code, second.status_code), (503, 503))
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertIn('07:00 - 23:00', first.content.decode())
+        self.assertEqual(first['Retry-After'], str(int(7.5 * 3600)))
+
+    def test_open_hours_and_static_pass_through(self):
+        with self.at(7, 0):
+            self.assertNotEqual(self.client.get(reverse('login')).status_code, 503)
+        with self.at(2, 0):
+            self.assertNotEqual(self.client.get('/static/vendor/css/bootstrap.min.css').status_code, 503)
+
+    @override_settings(SITE_CLOSED_WINDOW='12:00-13:30')
+    def test_window_from_settings(self):
+        with self.at(13, 0):
+            response = self.client.get(reverse('login'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1800')
+        with self.at(23, 30):
+            self.assertNotEqual(self.client.get(reverse('login')).status_code, 503)
+
+    @override_settings(SITE_CLOSED_WINDOW='')
+    def test_empty_window_disables_closure(self):
+        with self.at(3, 0):
+            self.assertNotEqual(self.client.get(reverse('login')).status_code, 503)
+
+    def test_nginx_snippets_in_nginx_timezone(self):
+        snippets = closure.nginx_snippets(closure.window(), nginx_utc_offset=0, local_utc_offset=8 * 60)
+        maps = snippets[closure.NGINX_MAPS_NAME]
+        # 北京时间 23:00 = UTC 15:00，06:59 = UTC 22:59
+        self.assertIn('"15:00" 28800;', maps)
+        self.assertIn('"22:59" 60;', maps)
+        self.assertNotIn('"23:00"', maps)
+        self.assertEqual(len(re.findall(r'"\d\d:\d\d" \d+;', maps)), 8 * 60)
+
+    def test_nginx_maps_exempt_closed_page(self):
+        snippets = closure.nginx_snippets(closure.window())
+        closable = re.search(r'map \$uri \$volunteer_closable \{(.*?)\}', snippets[closure.NGINX_MAPS_NAME], re.S).group(1)
+        self.assertIn(f'{closure.NGINX_PAGE_URI} 0;', closable)
+        self.assertIn('volatile;', closable)
+        self.assertIn(f'error_page 503 {closure.NGINX_PAGE_URI};', snippets[closure.NGINX_SERVER_NAME])
+
+    def test_generate_nginx_closure_command(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            call_command('generate_nginx_closure', output_dir=output_dir, stdout=io.StringIO())
+            names = set(os.listdir(output_dir))
+            with open(os.path.join(output_dir, closure.NGINX_PAGE_NAME), encoding='utf-8') as page:
+                self.assertIn('07:00 - 23:00', page.read())
+        self.assertEqual(names, {closure.NGINX_MAPS_NAME, closure.NGINX_SERVER_NAME, closure.NGINX_PAGE_NAME})
+
+
+class TurnstileVerifierTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stub = TurnstileStubServer().start()
+        self.addCleanup(self.stub.stop)
+        settings = override_settings(
+            TURNSTILE_VERIFY_URL=self.stub.url, TURNSTILE_TIMEOUT=0.2,
+            TURNSTILE_BREAKER_THRESHOLD=2, TURNSTILE_BREAKER_COOLDOWN=60, TURNSTILE_FAIL_OPEN=True,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_keep_alive_connection_and_token_cache(self):
+        self.assertTrue(turnstile.verify('secret', 'token-a', '127.0.0.1'))
+        self.assertTrue(turnstile.verify('secret', 'token-b', '127.0.0.1'))
+        self.assertEqual((self.stub.requests, self.stub.connections), (2, 1))
+        # 已验证过的 token 直接命中缓存
+        self.assertTrue(turnstile.verify('secret', 'token-a', '127.0.0.1'))
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_rejected_token_is_not_cached(self):
+        self.stub.result = {'success': False, 'error-codes': ['invalid-input-response']}
+        self.assertFalse(turnstile.verify('secret', 'bad', None))
+        self.assertFalse(turnstile.verify('secret', 'bad', None))
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_breaker_opens_after_repeated_timeouts(self):
+        self.stub.delay = 0.5
+        with self.assertLogs('volunteer.turnstile', 'WARNING'):
+            self.assertTrue(turnstile.verify('secret', 'slow-1'))
+            self.assertTrue(turnstile.verify('secret', 'slow-2'))
+        verifier = turnstile.get_verifier()
+        self.assertTrue(verifier.breaker.is_open)
+        requests = self.stub.requests
+        # 熔断期间不再请求核验服务，按策略直接放行
+        self.assertTrue(turnstile.verify('secret', 'slow-3'))
+        self.assertEqual(self.stub.requests, requests)
+        verifier.fail_open = False
+        self.assertFalse(turnstile.verify('secret', 'slow-4'))
+
+    def test_breaker_recovers_after_cooldown(self):
+        verifier = turnstile.get_verifier()
+        with self.assertLogs('volunteer.turnstile', 'WARNING'):
+            verifier.breaker.record_failure()
+            verifier.breaker.record_failure()
+        verifier.breaker.opened_at -= 60
+        self.assertTrue(turnstile.verify('secret', 'probe'))
+        self.assertFalse(verifier.breaker.is_open)
+        self.assertEqual(self.stub.requests, 1)
+
+    @without_time_restriction
+    def test_login_view_rejects_failed_token(self):
+        self.stub.result = {'success': False}
+        response = self.client.post(reverse('login'), {
+            'username': 'nobody', 'password': 'x', 'cf-turnstile-response': 'bad',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '人机验证失败')
+        self.assertEqual(self.stub.requests, 1)
+
+
+@without_time_restriction
+@override_settings(ROOT_URLCONF='project.asgi_urls')
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile('8801')
+        self.activity, self.session = make_activity(capacity=10)
+        self.stub = TurnstileStubServer().start()
+        self.addCleanup(self.stub.stop)
+        settings = override_settings(TURNSTILE_VERIFY_URL=self.stub.url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    async def test_anonymous_redirected_to_login(self):
+        response = await self.async_client.get(reverse('activity_list'))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(reverse('login')))
+
+    @override_settings(SERVER_TIMING_HEADER=True)
+    async def test_activity_pages(self):
+        await sync_to_async(self.async_client.force_login)(self.profile.user)
+        response = await self.async_client.get(reverse('activity_list'))
+        self.assertContains(response, self.activity.title)
+        # 异步模式下 Server-Timing 同样统计到请求线程里执行的 SQL
+        self.assertNotIn('desc="0 queries"', response['Server-Timing'])
+
+        response = await self.async_client.get(reverse('activity_detail', args=[self.activity.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['can_register'])
+        response = await self.async_client.get(reverse('activity_detail', args=[self.activity.pk + 1000]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_login_with_turnstile(self):
+        user = self.profile.user
+        await sync_to_async(lambda: (user.set_password('pw-8801'), user.save()))()
+        data = {'username': user.username, 'password': 'pw-8801', 'cf-turnstile-response': 'ok'}
+        response = await self.async_client.post(reverse('login'), data)
+        self.assertRedirects(response, reverse('my_profile'), fetch_redirect_response=False)
+
+        self.stub.result = {'success': False}
+        response = await self.async_client.post(reverse('login'), dict(data, **{'cf-turnstile-response': 'bad'}))
+        self.assertContains(response, '人机验证失败')
+        self.assertEqual(self.stub.requests, 2)
+
+
+    async def test_api_runs_in_thread_under_asgi(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        response = await self.async_client.get(reverse('api_activity_list'))
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.activity.pk])
+        response = await self.async_client.get(reverse('api_activity_list'), headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        token = await sync_to_async(lambda: str(AccessToken.for_user(self.profile.user)))()
+        self.assertEqual((await self.async_client.get(reverse('api_leaderboard'))).status_code, 401)
+        response = await self.async_client.get(reverse('api_leaderboard'), headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+
+
+class LoginBenchmarkTests(TransactionTestCase):
+    def test_both_modes_log_everyone_in_and_clean_up(self):
+        # wsgi 只开一个线程：SQLite 上 ATOMIC_REQUESTS 的并发写入会 database is locked
+        results = compare_login_modes(logins=4, concurrency=2, threads=1, latency_ms=0)
+        self.assertEqual(set(results), {'wsgi', 'asgi'})
+        for result in results.values():
+            self.assertEqual(result.succeeded, 4, result.statuses)
+        self.assertFalse(User.objects.filter(username__startswith=LOGIN_BENCH_PREFIX).exists())
+        self.assertFalse(Session.objects.exists())
+
+
+class SessionStoreTests(TestCase):
+    def setUp(self):
+        caches['sessions'].clear()
+        self.profile = make_profile('8901')
+
+    @without_time_restriction
+    def test_logged_in_request_reads_session_from_cache(self):
+        self.client.force_login(self.profile.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('my_profile'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'django_session' in q['sql']])
+
+    @without_time_restriction
+    def test_session_survives_cache_loss(self):
+        # 写入时同时写库，缓存被清空后从库里读回
+        self.client.force_login(self.profile.user)
+        caches['sessions'].clear()
+        self.assertEqual(self.client.get(reverse('my_profile')).status_code, 200)
+
+    def test_prune_expired_sessions_in_batches(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f'expired{i}', session_data='', expire_date=now - datetime.timedelta(days=1))
+        Session.objects.create(session_key='live', session_data='', expire_date=now + datetime.timedelta(days=1))
+
+        self.assertEqual(prune_expired_sessions(batch_size=2, max_batches=1), 2)
+        self.assertEqual(prune_expired_sessions(batch_size=2), 3)
+        self.assertEqual(list(Session.objects.values_list('pk', flat=True)), ['live'])
+
+    def test_session_benchmark(self):
+        make_activity()
+        rows = {name: session_queries for name, session_queries, _, _ in run_session_benchmarks(repeat=2)}
+        self.assertEqual(rows, {'db': 1, 'cached_db': 0, 'signed_cookies': 0})
+        self.assertFalse(Session.objects.exists())
+
+
+class ActivityApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        grade = Grade.objects.create(name="高一")
+        for i in range(5):
+            activity, _ = make_activity()
+            activity.grade_restriction.add(grade)
+
+    def get(self, params=None, **headers):
+        from rest_framework.test import APIRequestFactory
+        from .api_views import ActivityListView
+
+        request = APIRequestFactory().get('/api/activities/', params or {}, **headers)
+        response = ActivityListView.as_view()(request)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_cursor_pages_with_prefetched_grades(self):
+        with self.assertNumQueries(2):
+            first = self.get({'page_size': 3}).data
+        self.assertEqual(len(first['results']), 3)
+        self.assertEqual(first['results'][0]['excerpt'], '测试')
+        self.assertNotIn('description', first['results'][0])
+        cursor = first['next'].split('cursor=')[1].split('&')[0]
+        second = self.get({'page_size': 3, 'cursor': cursor}).data
+        ids = [row['id'] for row in first['results'] + second['results']]
+        self.assertEqual(ids, sorted(Activity.objects.values_list('pk', flat=True), reverse=True))
+        self.assertIsNone(second['next'])
+
+    def test_sparse_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.get({'fields': 'id,title,unknown'}).data['results']
+        self.assertEqual(set(rows[0]), {'id', 'title'})
+        # 不需要年级限制就不预取，不需要摘要就不读正文
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"description"', queries[0]['sql'])
+
+    def test_unchanged_list_returns_304(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            again = self.get(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+        # 不同的字段组合是不同的表示
+        self.assertEqual(self.get({'fields': 'id'}, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Activity.objects.first().save()
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+
+@without_time_restriction
+class ApiAuthTests(TestCase):
+    def setUp(self):
+        self.profile = make_profile('9101')
+        self.profile.grade = Grade.objects.create(name="高二")
+        self.profile.class_name = "高二1班"
+        self.profile.save()
+        self.profile.user.set_password('api-password')
+        self.profile.user.save()
+
+    def obtain(self):
+        response = self.client.post(reverse('token_obtain_pair'), {'username': '9101', 'password': 'api-password'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_token_carries_profile_claims(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        access = AccessToken(self.obtain()['access'])
+        self.assertEqual((access['student_id'], access['name'], access['profile_id']), ('9101', '学生9101', self.profile.pk))
+        self.assertEqual((access['grade_id'], access['class_name']), (self.profile.grade_id, "高二1班"))
+
+    def test_profile_in_one_query(self):
+        headers = {'HTTP_AUTHORIZATION': f"Bearer {self.obtain()['access']}"}
+        # 认证不查库，只剩读取档案的一条 select_related（另有 ATOMIC_REQUESTS 的 SAVEPOINT）
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api_my_profile'), **headers)
+        selects = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 1)
+        # 按 token 里的档案 id 查，不再按 user_id 反查
+        self.assertIn(f'"volunteer_volunteerprofile"."id" = {self.profile.pk}', selects[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['profile']['student_id'], '9101')
+        self.assertEqual(response.json()['profile']['grade'], {'name': "高二"})
+
+    def test_leaderboard_reads_profile_from_claims(self):
+        headers = {'HTTP_AUTHORIZATION': f"Bearer {self.obtain()['access']}"}
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_rank_snapshot()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api_leaderboard'), {'scope': 'class'}, **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'FROM "volunteer_volunteerprofile"' in q['sql']])
+        self.assertEqual([row['class_name'] for row in response.json()['results']], ["高二1班"])
+        self.assertEqual(response.json()['me']['class_rank'], 1)
+
+    def test_refreshed_token_keeps_claims(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.obtain()['refresh']})
+        self.assertEqual(AccessToken(response.json()['access'])['profile_id'], self.profile.pk)
+
+    def test_requires_token(self):
+        self.assertEqual(self.client.get(reverse('api_my_profile')).status_code, 401)
+        self.assertEqual(self.client.get(reverse('api_activity_list')).status_code, 200)
+
+
+class RichTextTests(TestCase):
+    DIRTY = (
+        '<p style="color: red; position: fixed" onclick="steal()">欢迎参加<strong>敬老院</strong>探访&nbsp;活动</p>'
+        '<script>alert(1)</script><a href="javascript:alert(1)">点我</a>'
+        '<a href="https://example.com" target="_blank">报名须知</a><img src="/media/uploads/a.jpg" onerror="x()">'
+        '<div><em>未闭合'
+    )
+
+    def test_render_sanitizes(self):
+        cleaned, text = richtext.render(self.DIRTY)
+        self.assertEqual(cleaned, (
+            '<p style="color: red">欢迎参加<strong>敬老院</strong>探访\xa0活动</p>'
+            '<a>点我</a><a href="https://example.com" target="_blank" rel="noopener noreferrer">报名须知</a>'
+            '<img src="/media/uploads/a.jpg" loading="lazy" decoding="async"><div><em>未闭合</em></div>'
+        ))
+        self.assertEqual(text, '欢迎参加敬老院探访 活动\n点我报名须知\n未闭合')
+
+    def test_self_closing_drop_tags_keep_following_content(self):
+        for tag in ('script', 'iframe', 'embed'):
+            cleaned, text = richtext.render(f'<p>a<{tag}/>b</p><p>后面的正文</p>')
+            self.assertEqual(cleaned, '<p>ab</p><p>后面的正文</p>', tag)
+            self.assertEqual(text, 'ab\n后面的正文', tag)
+        cleaned, _ = richtext.render('<iframe src="https://evil.example"/><script>x</script><p>正文</p>')
+        self.assertEqual(cleaned, '<p>正文</p>')
+
+    def test_save_fills_derived_fields(self):
+        activity, _ = make_activity(description='<p>' + '图书馆整理' * 30 + '</p>')
+        activity.refresh_from_db()
+        self.assertEqual(activity.description_html, '<p>' + '图书馆整理' * 30 + '</p>')
+        self.assertEqual(len(activity.description_excerpt), richtext.EXCERPT_LENGTH)
+        self.assertTrue(activity.description_excerpt.startswith('图书馆整理'))
+        self.assertEqual([a.pk for a in search_activities(Activity.objects.all(), '图书馆')], [activity.pk])
+
+        activity.description = '<p>清理河道</p>'
+        activity.save(update_fields=['description'])
+        activity.refresh_from_db()
+        self.assertEqual((activity.description_text, activity.description_excerpt), ('清理河道', '清理河道'))
+
+    def test_backfill_command(self):
+        activity, _ = make_activity()
+        Activity.objects.filter(pk=activity.pk).update(description='<p>新的<script>x</script>正文</p>', description_html='', description_text='', description_excerpt='')
+        call_command('backfill_descriptions', '--missing-only', stdout=io.StringIO())
+        activity.refresh_from_db()
+        self.assertEqual((activity.description_html, activity.description_excerpt), ('<p>新的正文</p>', '新的正文'))
+        self.assertEqual([a.pk for a in search_activities(Activity.objects.all(), '正文')], [activity.pk])
+
+    @without_time_restriction
+    def test_detail_page_uses_sanitized_html(self):
+        profile = make_profile('9201')
+        activity, _ = make_activity(description=self.DIRTY)
+        self.client.force_login(profile.user)
+        response = self.client.get(reverse('activity_detail', args=[activity.pk]))
+        self.assertContains(response, '<strong>敬老院</strong>')
+        self.assertNotContains(response, 'steal()')
+        self.assertNotContains(response, 'alert(1)')
+
+        # 清洗后为空的详情不能退回原始 HTML
+        only_script, _ = make_activity(description='<script>alert("xss")</script><iframe src="https://evil.example"></iframe>')
+        response = self.client.get(reverse('activity_detail', args=[only_script.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'alert("xss")')
+        self.assertNotContains(response, 'evil.example')
+
+
+def make_jpeg(width, height, exif_make=None):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    if exif_make:
+        exif[0x010F] = exif_make
+    Image.new('RGB', (width, height), (200, 80, 40)).save(buffer, format='JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+class ImagePipelineTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name, IMAGE_VARIANT_WIDTHS=[480, 960], IMAGE_VARIANT_FORMATS=['webp'])
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_processed_image_renders_picture(self):
+        image = ProcessedImage.objects.create(digest='0123456789abcdef', width=1200, height=800, fallback_format='jpg', formats=['webp'], widths=[480, 960])
+        activity, _ = make_activity(description='<p><img src="/media/img/0123456789abcdef-960.jpg" alt="合影"></p>')
+        self.assertEqual(activity.description_html, (
+            '<p><picture><source type="image/webp" srcset="/media/img/0123456789abcdef-480.webp 480w, '
+            '/media/img/0123456789abcdef-960.webp 960w" sizes="(max-width: 960px) 100vw, 960px">'
+            '<img src="/media/img/0123456789abcdef-960.jpg" alt="合影" loading="lazy" decoding="async" '
+            'srcset="/media/img/0123456789abcdef-480.jpg 480w, /media/img/0123456789abcdef-960.jpg 960w" '
+            'sizes="(max-width: 960px) 100vw, 960px"></picture></p>'
+        ))
+        # 已有上传按原图路径对应
+        image.source = 'uploads/2026/05/01/photo.jpg'
+        image.save()
+        activity.description = '<img src="/media/uploads/2026/05/01/photo.jpg">'
+        activity.save()
+        self.assertIn('<picture>', activity.description_html)
+
+    @skipUnless(PIL_AVAILABLE, "需要 Pillow")
+    def test_process_strips_metadata_and_resizes(self):
+        from PIL import Image
+
+        result = images.process_bytes(make_jpeg(1200, 600, exif_make='Camera'), images.Options())
+        self.assertEqual((result.widths, result.fallback, result.formats), ([480, 960], 'jpg', ['webp']))
+        self.assertEqual(len(result.files), 4)
+        variant = Image.open(io.BytesIO(result.files[images.variant_name(result.digest, 480, 'jpg')]))
+        self.assertEqual(variant.size, (480, 240))
+        self.assertNotIn('exif', variant.info)
+        # 小图不放大
+        self.assertEqual(images.process_bytes(make_jpeg(300, 200), images.Options()).widths, [300])
+        self.assertIsNone(images.process_bytes(b'not an image', images.Options()))
+
+    @skipUnless(PIL_AVAILABLE, "需要 Pillow")
+    def test_upload_backend_stores_hashed_variants(self):
+        from django.core.files.storage import FileSystemStorage
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        storage = FileSystemStorage(location=self.media.name)
+        data = make_jpeg(1200, 600)
+        backend = images.OptimizedImageBackend(storage, SimpleUploadedFile('IMG_0001.jpg', data))
+        self.assertTrue(backend.is_image)
+        path = backend.save_as('uploads/IMG_0001.jpg')
+        self.assertRegex(path, r'^img/[0-9a-f]{16}-960\.jpg$')
+        self.assertTrue(storage.exists(path.replace('.jpg', '.webp')))
+        # 同一张图再次上传得到同一个文件名
+        again = images.OptimizedImageBackend(storage, SimpleUploadedFile('copy.jpg', data)).save_as('uploads/copy.jpg')
+        self.assertEqual(again, path)
+        self.assertEqual(ProcessedImage.objects.count(), 1)
+
+        # 通过 CKEditor 上传接口，返回的地址指向处理后的文件
+        admin = User.objects.create_superuser('image_admin', password=None)
+        self.client.force_login(admin)
+        with without_time_restriction:
+            response = self.client.post(reverse('ckeditor_upload'), {'upload': SimpleUploadedFile('IMG_0002.jpg', make_jpeg(800, 600))})
+        self.assertRegex(response.json()['url'], r'^/media/img/[0-9a-f]{16}-800\.jpg$')
+
+    @skipUnless(PIL_AVAILABLE, "需要 Pillow")
+    def test_uploads_are_listed_by_ckeditor_browse(self):
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        admin = User.objects.create_superuser('image_admin', password=None)
+        self.client.force_login(admin)
+        with without_time_restriction:
+            self.client.post(reverse('ckeditor_upload'), {'upload': SimpleUploadedFile('IMG_0003.jpeg', make_jpeg(1200, 600, exif_make='Camera'))})
+            response = self.client.get(reverse('ckeditor_browse'))
+        image = ProcessedImage.objects.get()
+        self.assertRegex(image.source, r'^uploads/\d{4}/\d{2}/\d{2}/img_0003\.jpg$')
+        self.assertContains(response, f'/media/{image.source}')
+        self.assertContains(response, f'/media/{image.source[:-4]}_thumb.jpg')
+        # 上传目录里的是去掉元数据的副本，浏览后插入同样换成 <picture>
+        with open(os.path.join(self.media.name, image.source), 'rb') as f:
+            copy = Image.open(io.BytesIO(f.read()))
+        self.assertEqual(copy.size, (960, 480))
+        self.assertNotIn('exif', copy.info)
+        activity, _ = make_activity(description=f'<img src="/media/{image.source}">')
+        self.assertIn('<picture>', activity.description_html)
+
+    @skipUnless(PIL_AVAILABLE, "需要 Pillow")
+    def test_decompression_bombs_are_rejected(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        admin = User.objects.create_superuser('image_admin', password=None)
+        self.client.force_login(admin)
+        with mock.patch('PIL.Image.MAX_IMAGE_PIXELS', 1000):
+            with self.assertRaises(images.ImageTooLarge):
+                images.process_bytes(make_jpeg(100, 100), images.Options())
+            with without_time_restriction:
+                response = self.client.post(reverse('ckeditor_upload'), {'upload': SimpleUploadedFile('huge.jpg', make_jpeg(100, 100))})
+                self.assertEqual(response.json()['uploaded'], 0)
+                self.assertIn('像素数超过上限', response.json()['error']['message'])
+                response = self.client.post(reverse('ckeditor_upload') + '?CKEditorFuncNum=3', {'upload': SimpleUploadedFile('huge.jpg', make_jpeg(100, 100))})
+                self.assertContains(response, 'callFunction("3", \'\', ')
+            self.assertEqual(os.listdir(self.media.name), [])
+            upload_dir = os.path.join(self.media.name, 'uploads')
+            os.makedirs(upload_dir)
+            with open(os.path.join(upload_dir, 'huge.jpg'), 'wb') as f:
+                f.write(make_jpeg(100, 100))
+            self.assertEqual(list(images.reprocess_uploads(['uploads/huge.jpg'], workers=1)), [('uploads/huge.jpg', None)])
+        self.assertFalse(ProcessedImage.objects.exists())
+
+    @skipUnless(PIL_AVAILABLE, "需要 Pillow")
+    def test_reprocess_command(self):
+        upload_dir = os.path.join(self.media.name, 'uploads', '2026')
+        os.makedirs(upload_dir)
+        with open(os.path.join(upload_dir, 'photo.jpg'), 'wb') as f:
+            f.write(make_jpeg(1000, 500, exif_make='Camera'))
+        with open(os.path.join(upload_dir, 'photo_thumb.jpg'), 'wb') as f:
+            f.write(make_jpeg(75, 75))
+        activity, _ = make_activity(description='<img src="/media/uploads/2026/photo.jpg">')
+
+        call_command('reprocess_images', '--workers', '1', stdout=io.StringIO())
+        self.assertEqual(list(ProcessedImage.objects.values_list('source', flat=True)), ['uploads/2026/photo.jpg'])
+        activity.refresh_from_db()
+        self.assertIn('srcset=', activity.description_html)
+        # 再次运行跳过已处理的图片
+        out = io.StringIO()
+        call_command('reprocess_images', '--workers', '1', stdout=out)
+        self.assertIn('已处理 0 张图片', out.getvalue())
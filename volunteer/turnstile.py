@@ -0,0 +1,232 @@
+"""
+Cloudflare Turnstile 人机验证。
+
+以前每次登录都用 urllib.request.urlopen 新建一条 TLS 连接、最长阻塞 5 秒，
+下课时集中登录，Cloudflare 一慢，gunicorn 的线程就全卡在这里。现在：
+  - 每个进程保留一个长连接池（keep-alive），省掉每次登录的 TCP/TLS 握手；
+  - 连接和读取超时缩短为 TURNSTILE_TIMEOUT 秒；
+  - 已验证通过的 token 在缓存里保留 TURNSTILE_TOKEN_CACHE_SECONDS 秒，
+    重复提交（双击登录、密码输错后重新提交）不再请求 Cloudflare（token 只能核验一次，再核验会被判失败）；
+  - 熔断：连续 TURNSTILE_BREAKER_THRESHOLD 次超时/网络错误/5xx 后，TURNSTILE_BREAKER_COOLDOWN 秒内
+    不再请求 Cloudflare，按 TURNSTILE_FAIL_OPEN 直接放行或拒绝；冷却结束后先放一个请求试探。
+异步视图（ASGI 模式）使用 averify()，核验在线程池中进行，不阻塞事件循环。
+核验地址由 TURNSTILE_VERIFY_URL 配置，测试时指向本地的桩服务器（支持 http://）。
+"""
+import hashlib
+import http.client
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger('volunteer.turnstile')
+
+DEFAULT_VERIFY_URL = 'https://challenges.cloudflare.com/turnstile/v0/siteverify'
+
+
+class VerifierUnavailable(Exception):
+    """核验服务超时、连不上或返回 5xx。"""
+
+
+class ConnectionPool:
+    """同一个主机的 HTTP(S) 长连接池，线程安全；连接不够时临时新建，归还时池满则关闭。"""
+    def __init__(self, url, size, timeout):
+        parts = urllib.parse.urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, connection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def post(self, body, headers):
+        """返回 (状态码, 响应体)。"""
+        connection, reused = self._acquire()
+        while True:
+            try:
+                connection.request('POST', self.path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except TimeoutError:
+                connection.close()
+                raise
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                # 池里的连接可能已被对端关闭，换一条新连接重试一次
+                if not reused:
+                    raise
+                connection, reused = self.connection_class(self.host, self.port, timeout=self.timeout), False
+                continue
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # 冷却结束后只放一个试探请求，其余请求继续按熔断处理
+            if not self._probing and time.monotonic() - self.opened_at >= self.cooldown:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning("Turnstile 核验连续失败 %s 次，熔断 %s 秒", self.failures, self.cooldown)
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class TurnstileVerifier:
+    def __init__(self, url=DEFAULT_VERIFY_URL, timeout=2.0, pool_size=4, token_cache_seconds=300,
+                 breaker_threshold=5, breaker_cooldown=30, fail_open=True):
+        self.pool = ConnectionPool(url, pool_size, timeout)
+        # averify() 专用线程，数量与连接池一致，不与其他 sync_to_async 调用争抢默认线程池
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='turnstile')
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self.token_cache_seconds = token_cache_seconds
+        self.fail_open = fail_open
+
+    @staticmethod
+    def _cache_key(token):
+        return 'volunteer:turnstile:' + hashlib.sha256(token.encode()).hexdigest()
+
+    def _siteverify(self, secret, token, remote_ip):
+        body = urllib.parse.urlencode({'secret': secret, 'response': token, 'remoteip': remote_ip or ''})
+        try:
+            status, data = self.pool.post(body, {
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'Connection': 'keep-alive',
+            })
+        except (OSError, http.client.HTTPException) as e:
+            raise VerifierUnavailable(str(e)) from e
+        if status >= 500:
+            raise VerifierUnavailable(f'HTTP {status}')
+        try:
+            return bool(json.loads(data).get('success'))
+        except ValueError:
+            raise VerifierUnavailable('无法解析的响应')
+
+    def verify(self, secret, token, remote_ip=None):
+        """token 通过核验返回 True；核验服务不可用时按 fail_open 返回。"""
+        key = self._cache_key(token)
+        if cache.get(key):
+            return True
+        if not self.breaker.allow():
+            return self.fail_open
+        try:
+            success = self._siteverify(secret, token, remote_ip)
+        except VerifierUnavailable as e:
+            self.breaker.record_failure()
+            logger.warning("Turnstile 核验失败（%s），按策略%s", e, '放行' if self.fail_open else '拒绝')
+            return self.fail_open
+        self.breaker.record_success()
+        if success:
+            cache.set(key, True, self.token_cache_seconds)
+        return success
+
+    async def averify(self, secret, token, remote_ip=None):
+        return await sync_to_async(self.verify, thread_sensitive=False, executor=self.executor)(secret, token, remote_ip)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.pool.close()
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_verifier():
+    """当前进程共用的核验器，按 settings 创建。"""
+    global _verifier
+    with _verifier_lock:
+        if _verifier is None:
+            _verifier = TurnstileVerifier(
+                url=getattr(settings, 'TURNSTILE_VERIFY_URL', DEFAULT_VERIFY_URL),
+                timeout=getattr(settings, 'TURNSTILE_TIMEOUT', 2.0),
+                pool_size=getattr(settings, 'TURNSTILE_POOL_SIZE', 4),
+                token_cache_seconds=getattr(settings, 'TURNSTILE_TOKEN_CACHE_SECONDS', 300),
+                breaker_threshold=getattr(settings, 'TURNSTILE_BREAKER_THRESHOLD', 5),
+                breaker_cooldown=getattr(settings, 'TURNSTILE_BREAKER_COOLDOWN', 30),
+                fail_open=getattr(settings, 'TURNSTILE_FAIL_OPEN', True),
+            )
+        return _verifier
+
+
+def reset_verifier():
+    global _verifier
+    with _verifier_lock:
+        if _verifier is not None:
+            _verifier.close()
+        _verifier = None
+
+
+@receiver(setting_changed)
+def _settings_changed(setting, **kwargs):
+    # 测试里用 override_settings 换成桩服务器地址时重建核验器
+    if setting.startswith('TURNSTILE_'):
+        reset_verifier()
+
+
+def verify(secret, token, remote_ip=None):
+    return get_verifier().verify(secret, token, remote_ip)
+
+
+async def averify(secret, token, remote_ip=None):
+    """异步视图用：核验放到线程池里执行，等待期间不阻塞事件循环，也不占用请求的数据库线程。"""
+    return await get_verifier().averify(secret, token, remote_ip)
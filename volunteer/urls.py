@@ -13,5 +13,7 @@ urlpatterns = [
     path('activities/<int:activity_id>/', views.activity_detail, name='activity_detail'),
     path('certificate/', views.certificate_placeholder_view, name='certificate_placeholder'),
     path('message-wall/', views.message_wall_view, name='message_wall'),
+    path('message-wall/feed/', views.message_wall_feed, name='message_wall_feed'),
+    path('leaderboard/', views.leaderboard_view, name='leaderboard'),
     path('register/', views.register_view, name='register'),
 ]
\ No newline at end of file
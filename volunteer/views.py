@@ -4,11 +4,16 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
 from .forms import LoginForm, RegistrationForm, UserProfileForm, MessageForm
-from .models import Activity, VolunteerProfile, Registration, Announcement, ActivitySession, MessageWall
+from .models import Activity, VolunteerProfile, Registration, ActivitySession, MessageWall
+from . import caching, eligibility, leaderboard, turnstile
+from .reservations import reserve_seat, ReservationError
+from .search import search_activities
+from django.db import transaction
 from django.db.models import Q
-import json
-import urllib.request
-import urllib.parse
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+import datetime
 import os
 
 # === Turnstile 配置 ===
@@ -25,44 +30,39 @@ def get_client_ip(request):
         ip = request.META.get('REMOTE_ADDR')
     return ip
 
-def login_view(request):
+def turnstile_keys():
+    """(site key, secret key)"""
     if os.environ.get('DB_NAME'):
-        current_site_key = REAL_SITE_KEY
-        current_secret_key = REAL_SECRET_KEY
-    else:
-        current_site_key = TEST_SITE_KEY
-        current_secret_key = TEST_SECRET_KEY
+        return REAL_SITE_KEY, REAL_SECRET_KEY
+    return TEST_SITE_KEY, TEST_SECRET_KEY
+
+def turnstile_token(request):
+    return request.POST.get('cf-turnstile-response') if request.method == 'POST' else None
+
+def turnstile_failed(request):
+    messages.error(request, '人机验证失败，请刷新重试。')
+    return render(request, 'volunteer/login.html', {
+        'form': LoginForm(request.POST),
+        'site_key': turnstile_keys()[0],
+        'remembered_user': request.COOKIES.get('remembered_user')
+    })
+
+def login_view(request):
+    # Turnstile验证逻辑（长连接池 + 熔断，见 volunteer.turnstile；异步版本见 async_views）
+    token = turnstile_token(request)
+    if token and not turnstile.verify(turnstile_keys()[1], token, get_client_ip(request)):
+        return turnstile_failed(request)
+    return login_flow(request)
+
+def login_flow(request):
+    """人机验证通过之后的登录流程，同步、异步两种模式共用。"""
+    current_site_key = turnstile_keys()[0]
 
     # 检查是否已记住用户
     remembered_username = request.COOKIES.get('remembered_user')
 
     if request.method == 'POST':
         form = LoginForm(request.POST)
-        turnstile_token = request.POST.get('cf-turnstile-response')
-        
-        # Turnstile验证逻辑
-        if turnstile_token:
-            client_ip = get_client_ip(request)
-            url = 'https://challenges.cloudflare.com/turnstile/v0/siteverify'
-            data = urllib.parse.urlencode({
-                'secret': current_secret_key,
-                'response': turnstile_token,
-                'remoteip': client_ip
-            }).encode('utf-8')
-            
-            try:
-                req = urllib.request.Request(url, data=data)
-                with urllib.request.urlopen(req, timeout=5) as response:
-                    result = json.loads(response.read().decode('utf-8'))
-                    if not result.get('success'):
-                        messages.error(request, '人机验证失败，请刷新重试。')
-                        return render(request, 'volunteer/login.html', {
-                            'form': form,
-                            'site_key': current_site_key,
-                            'remembered_user': remembered_username
-                        })
-            except:
-                pass  # 网络超时放行
 
         # 检查是否是快速登录（已记住用户且密码为空或假密码）
         password_from_post = request.POST.get('password', '').strip()
@@ -133,65 +133,77 @@ def logout_view(request):
 
 @login_required
 def activity_list(request):
+    return activity_list_response(request, VolunteerProfile.objects.filter(user=request.user).first())
+
+def activity_list_response(request, profile):
     query = request.GET.get('q', '')
+    # 没有志愿者档案的账号（如管理员）不显示资格标记
+    eligible_ids = eligibility.eligible_open_activity_ids(profile) if profile else None
+    eligible_only = eligible_ids is not None and request.GET.get('eligible') == '1'
     try:
-        activities = Activity.objects.filter(status="报名中").order_by('-id')
         if query:
-            activities = activities.filter(Q(title__icontains=query) | Q(description__icontains=query))
-        announcements = Announcement.objects.all().order_by('-created_at')[:3]
+            activities = search_activities(Activity.objects.filter(status="报名中").defer(*Activity.HEAVY_FIELDS).order_by('-id'), query)
+            if eligible_only:
+                activities = eligibility.filter_eligible(activities, profile)
+        elif eligible_only:
+            activities = SimpleLazyObject(lambda: [a for a in caching.open_activities() if a.pk in eligible_ids])
+        else:
+            activities = SimpleLazyObject(caching.open_activities)
+        # 延迟到模板里真正用到时才取，模板片段命中缓存时完全不查询
+        announcements = SimpleLazyObject(caching.latest_announcements)
     except Exception as e:
         activities = []
         announcements = []
     
-    context = {'activities': activities, 'announcements': announcements, 'search_query': query}
+    context = {
+        'activities': activities, 'announcements': announcements, 'search_query': query,
+        'eligible_ids': eligible_ids, 'eligible_only': eligible_only,
+        # 资格相同的学生共用同一份卡片片段
+        'eligibility_key': 'none' if eligible_ids is None else ','.join(map(str, sorted(eligible_ids))),
+        'cache_versions': caching.get_versions(caching.ACTIVITIES, caching.ANNOUNCEMENTS),
+        'cache_timeout': caching.timeout(),
+    }
     return render(request, 'volunteer/activity_list.html', context)
 
+# 报名占座自己开一个短事务，不要让整个请求（含模板渲染）一直持有活动行锁
+@transaction.non_atomic_requests
 @login_required
 def activity_detail(request, activity_id):
-    activity = get_object_or_404(Activity, pk=activity_id)
     profile = get_object_or_404(VolunteerProfile, user=request.user)
+    # 报名资格与活动一起查出，和列表页"只看我能报名的"使用同一套规则
+    activity = get_object_or_404(eligibility.annotate_eligibility(detail_queryset(), profile), pk=activity_id)
+    return activity_detail_response(request, profile, activity)
 
+def detail_queryset():
+    # 详情页输出保存时清洗好的 description_html，原始 HTML 和检索文本不用查
+    return Activity.objects.defer('description', 'description_text', 'search_document')
+
+def activity_detail_response(request, profile, activity):
     existing_registration = Registration.objects.filter(student=profile, activity=activity).first()
     is_registered = existing_registration is not None
     registration_status = existing_registration.status if is_registered else None
     registered_session = existing_registration.session if is_registered else None
     
     registrations_count = activity.approved_registrations_count
-    is_full = activity.capacity > 0 and registrations_count >= activity.capacity
-
-    if activity.max_xp == 0:
-        xp_ok = profile.total_xp >= activity.min_xp
-    else:
-        xp_ok = activity.min_xp <= profile.total_xp <= activity.max_xp
-
-    gender_ok = (activity.gender_restriction == '不限') or (profile.gender == activity.gender_restriction)
-    
-    grade_ok = True
-    if activity.grade_restriction.exists():
-        if profile.grade:
-            grade_ok = activity.grade_restriction.filter(pk=profile.grade.pk).exists()
-        else:
-            grade_ok = False
+    is_full = activity.is_full
 
-    can_register = xp_ok and gender_ok and grade_ok
+    xp_ok, gender_ok, grade_ok = activity.xp_ok, activity.gender_ok, activity.grade_ok
+    can_register = activity.can_register
 
     if request.method == 'POST':
         form = RegistrationForm(request.POST, activity=activity)
         if not is_registered and not is_full and can_register:
             if form.is_valid():
-                session = form.cleaned_data['session']
-                if session.is_full:
-                     messages.error(request, '该场次名额已满')
-                else:
-                    Registration.objects.create(
-                        student=profile,
-                        activity=activity,
-                        session=session,
+                try:
+                    reserve_seat(
+                        profile, activity, form.cleaned_data['session'],
                         phone_number=form.cleaned_data['phone_number'],
                         class_name=form.cleaned_data['class_name'],
                         headteacher_name=form.cleaned_data['headteacher_name'],
-                        status='Pending'
                     )
+                except ReservationError as e:
+                    messages.error(request, str(e))
+                else:
                     messages.success(request, '报名已提交')
                     return redirect('activity_detail', activity_id=activity.id)
         elif not can_register:
@@ -236,10 +248,41 @@ def my_profile_view(request):
     context = {
         'profile': profile, 'registrations': registrations, 
         'xp_in_level': xp_in_level, 'xp_percent': xp_percent, 
-        'next_level_xp': next_level_xp, 'xp_needed_for_next_level': xp_needed_for_next_level
+        'next_level_xp': next_level_xp, 'xp_needed_for_next_level': xp_needed_for_next_level,
+        # 排名来自定期刷新的快照，按主键取一行
+        'my_rank': leaderboard.my_rank(profile),
     }
     return render(request, 'volunteer/my_profile.html', context)
 
+LEADERBOARD_SCOPE_LABELS = (('school', '全校'), ('grade', '本年级'), ('class', '本班'))
+
+@login_required
+def leaderboard_view(request):
+    profile = VolunteerProfile.objects.filter(user=request.user).first()
+    scope = request.GET.get('scope', 'school')
+    # 年级/班级榜按当前学生所在的年级和班级显示
+    if scope not in leaderboard.SCOPES or profile is None:
+        scope = 'school'
+    rank_field, size_field = leaderboard.SCOPES[scope]
+    entries = leaderboard.top_entries(
+        scope,
+        grade_id=profile.grade_id if profile else None,
+        class_name=profile.class_name if profile else None,
+    )
+    my_rank = leaderboard.my_rank(profile) if profile else None
+
+    context = {
+        'scope': scope,
+        'scopes': LEADERBOARD_SCOPE_LABELS if profile else LEADERBOARD_SCOPE_LABELS[:1],
+        'entries': [(getattr(entry, rank_field), entry) for entry in entries],
+        'my_rank': my_rank,
+        'my_position': getattr(my_rank, rank_field, None),
+        'scope_size': getattr(my_rank, size_field, None),
+        'refreshed_at': entries[0].refreshed_at if entries else None,
+        'tiers': leaderboard.tier_distribution(),
+    }
+    return render(request, 'volunteer/leaderboard.html', context)
+
 @login_required
 def edit_profile_view(request):
     if request.method == 'POST':
@@ -252,9 +295,51 @@ def edit_profile_view(request):
         form = UserProfileForm(instance=request.user)
     return render(request, 'volunteer/edit_profile.html', {'form': form})
 
+MESSAGE_WALL_PAGE_SIZE = 30
+
+MESSAGE_CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+def encode_message_cursor(msg):
+    # 精确到微秒的 UTC 时间 + id，避免浮点时间戳丢精度导致翻页重复/遗漏
+    created_at = msg.created_at.astimezone(datetime.timezone.utc)
+    return f"{created_at.strftime(MESSAGE_CURSOR_FORMAT)}_{msg.pk}"
+
+def decode_message_cursor(cursor):
+    try:
+        ts, pk = cursor.split('_', 1)
+        created_at = datetime.datetime.strptime(ts, MESSAGE_CURSOR_FORMAT)
+        return created_at.replace(tzinfo=datetime.timezone.utc), int(pk)
+    except ValueError:
+        return None
+
+def get_message_page(cursor=None, page_size=MESSAGE_WALL_PAGE_SIZE):
+    """
+    按 (created_at, id) 倒序的游标分页，每页代价固定，与留言总数无关。
+    返回 (本页留言列表, 下一页游标或 None)。
+    """
+    qs = MessageWall.objects.filter(is_public=True).select_related('user').order_by('-created_at', '-id')
+    position = decode_message_cursor(cursor) if cursor else None
+    if position:
+        created_at, pk = position
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+    page = list(qs[:page_size + 1])
+    next_cursor = encode_message_cursor(page[page_size - 1]) if len(page) > page_size else None
+    return page[:page_size], next_cursor
+
+def serialize_message(msg):
+    author = '匿名志愿者' if msg.is_anonymous else msg.user.first_name
+    return {
+        'id': msg.pk,
+        'content': msg.content,
+        'color': msg.color,
+        'author': author,
+        'initial': '?' if msg.is_anonymous else msg.user.first_name[:1],
+        'created_at': timezone.localtime(msg.created_at).strftime('%m-%d %H:%M'),
+    }
+
 @login_required
 def message_wall_view(request):
-    messages_list = MessageWall.objects.filter(is_public=True).order_by('-created_at')
+    messages_list, next_cursor = get_message_page()
     
     if request.method == 'POST':
         form = MessageForm(request.POST)
@@ -269,11 +354,21 @@ def message_wall_view(request):
 
     context = {
         'messages_list': messages_list,
+        'next_cursor': next_cursor,
         'form': form,
         'colors': MessageWall.COLOR_CHOICES,
     }
     return render(request, 'volunteer/message_wall.html', context)
 
+@login_required
+def message_wall_feed(request):
+    """留言墙无限滚动接口：?cursor= 传上一页返回的 next_cursor。"""
+    messages_list, next_cursor = get_message_page(request.GET.get('cursor'))
+    return JsonResponse({
+        'messages': [serialize_message(msg) for msg in messages_list],
+        'next_cursor': next_cursor,
+    })
+
 def register_view(request):
     return render(request, 'volunteer/registration_form.html')
 
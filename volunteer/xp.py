@@ -0,0 +1,61 @@
+"""
+经验值校准。
+
+总经验值 = 总服务时长 + 所有标签的额外经验加成。
+这里把"应有经验值"写成一个相关子查询表达式，整批校准只需要一条 UPDATE，
+同时只更新与应有值不一致的行，返回值就是实际变化的行数。
+"""
+from django.db import transaction
+from django.db.models import F, IntegerField, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import VolunteerProfile
+
+RECALCULATE_CHUNK_SIZE = 5000
+
+
+def tag_bonus_subquery(profile_ref='pk'):
+    """某个档案所有标签 xp_bonus 之和（没有标签时为 0）。"""
+    return Coalesce(
+        Subquery(
+            VolunteerProfile.objects.filter(pk=OuterRef(profile_ref))
+            .order_by()
+            .values('pk')
+            .annotate(bonus=Sum('tags__xp_bonus'))
+            .values('bonus'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def expected_xp_expression():
+    return F('total_hours') + tag_bonus_subquery()
+
+
+def recalculate_xp(queryset):
+    """把 queryset 中档案的 total_xp 校准为应有值，一条 UPDATE，返回实际变化的行数。"""
+    expected = expected_xp_expression()
+    return (VolunteerProfile.objects
+            .filter(pk__in=queryset.values('pk'))
+            .exclude(total_xp=expected)
+            .update(total_xp=expected_xp_expression()))
+
+
+def recalculate_all_xp(chunk_size=RECALCULATE_CHUNK_SIZE, progress=None):
+    """
+    全表校准，按主键区间分批，每批一个短事务，避免长时间锁住整张表。
+    返回 (检查的行数, 实际变化的行数)。
+    """
+    bounds = VolunteerProfile.objects.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return 0, 0
+    checked = changed = 0
+    for start in range(bounds['low'], bounds['high'] + 1, chunk_size):
+        chunk = VolunteerProfile.objects.filter(pk__gte=start, pk__lt=start + chunk_size)
+        with transaction.atomic():
+            checked += chunk.count()
+            changed += recalculate_xp(chunk)
+        if progress:
+            progress(checked, changed)
+    return checked, changed